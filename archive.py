@@ -0,0 +1,424 @@
+import glob
+import logging
+import lzma
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from array import array
+
+from record_format import check_record, read_header, record_end, decode_record, encode_record, open_symbols
+
+DEFAULT_ARCHIVE_DIR = 'archive'
+
+# Segment rolling and retention defaults
+DEFAULT_MAX_SEGMENT_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_SEGMENT_AGE = 60 * 60                # seconds
+DEFAULT_RETENTION = 30 * 24 * 60 * 60            # seconds
+DEFAULT_BLOCK_SIZE = 256 * 1024                  # uncompressed bytes per block
+
+# The active segment is fsynced and its offset index checkpointed after
+# this many bytes or seconds, whichever comes first. Recovery only has to
+# verify what was written after the last checkpoint.
+DEFAULT_CHECKPOINT_BYTES = 4 * 1024 * 1024
+DEFAULT_CHECKPOINT_INTERVAL = 5.0                # seconds
+
+ACTIVE_SUFFIX = '.seg'
+SEALED_SUFFIX = '.segz'
+INDEX_SUFFIX = '.idx'   # offset index checkpoint of a raw segment
+
+# Index checkpoint: magic, number of bytes covered, then one uint64 record
+# offset per record in those bytes
+INDEX_HEADER = struct.Struct('<4sQ')
+INDEX_MAGIC = b'HL7I'
+
+# Sealed segment layout:
+#   SEALED_MAGIC, compressed blocks..., block index, trailer
+# Every block holds whole records and is compressed independently, so a
+# reader only has to decompress the block it needs.
+SEALED_MAGIC = b'HL7Z'
+BLOCK_ENTRY = struct.Struct('<QIIId')   # offset, compressed len, raw len, records, first received_at
+TRAILER = struct.Struct('<QIBdd4s')     # index offset, block count, codec, first/last received_at, magic
+
+CODECS = {
+    'zlib': (1, lambda data: zlib.compress(data, 6), zlib.decompress),
+    'lzma': (2, lzma.compress, lzma.decompress),
+}
+CODECS_BY_ID = {codec_id: decompress for codec_id, _, decompress in CODECS.values()}
+
+
+def iter_record_spans(buffer, offset=0, end=None, verify=False):
+    """
+    Walk the records in a buffer of raw segment data without decoding them.
+
+    :param verify: Also stop at the first record whose payload fails its CRC.
+    :return: Generator of (offset, record end, header). Stops at the first
+             incomplete or unrecognised record.
+    """
+    end = len(buffer) if end is None else end
+    while True:
+        header = read_header(buffer, offset)
+        if header is None:
+            break
+        next_offset = record_end(header, offset)
+        if next_offset > end or (verify and not check_record(buffer, offset, header)):
+            break
+        yield offset, next_offset, header
+        offset = next_offset
+
+
+def iter_records(buffer, offset=0, end=None, symbols=None):
+    """
+    Decode the records in a buffer of raw segment data.
+
+    :return: Generator of (offset, MessageRecord).
+    """
+    for record_offset, _, header in iter_record_spans(buffer, offset, end):
+        yield record_offset, decode_record(buffer, record_offset, header, symbols)
+
+
+def read_sealed_index(data):
+    """
+    Parse the footer of a sealed segment.
+
+    :param data: The whole segment (bytes or mmap).
+    :return: Tuple of (codec id, first received_at, last received_at, list of block entries).
+    """
+    if len(data) < len(SEALED_MAGIC) + TRAILER.size or data[:len(SEALED_MAGIC)] != SEALED_MAGIC:
+        raise ValueError("Not a sealed archive segment")
+    index_offset, block_count, codec_id, first_at, last_at, magic = TRAILER.unpack_from(
+        data, len(data) - TRAILER.size)
+    if magic != SEALED_MAGIC:
+        raise ValueError("Sealed archive segment has a damaged trailer")
+    blocks = [BLOCK_ENTRY.unpack_from(data, index_offset + i * BLOCK_ENTRY.size)
+              for i in range(block_count)]
+    return codec_id, first_at, last_at, blocks
+
+
+def read_sealed_block(data, codec_id, block):
+    offset, compressed_len, _, _, _ = block
+    return CODECS_BY_ID[codec_id](bytes(data[offset:offset + compressed_len]))
+
+
+def iter_segment_records(path, symbols=None):
+    """Yield a MessageRecord for every record in a segment file."""
+    if symbols is None:
+        symbols = open_symbols(os.path.dirname(path))
+    with open(path, 'rb') as file:
+        data = file.read()
+    if path.endswith(SEALED_SUFFIX):
+        codec_id, _, _, blocks = read_sealed_index(data)
+        for block in blocks:
+            raw = read_sealed_block(data, codec_id, block)
+            for _, record in iter_records(raw, symbols=symbols):
+                yield record
+    else:
+        for _, record in iter_records(data, symbols=symbols):
+            yield record
+
+
+def read_index_checkpoint(path, segment_size):
+    """
+    Load the offset index checkpoint of a raw segment.
+
+    :return: Tuple of (bytes covered, array of record offsets); (0, empty)
+             when there is no usable checkpoint.
+    """
+    try:
+        with open(path + INDEX_SUFFIX, 'rb') as file:
+            data = file.read()
+        magic, indexed_end = INDEX_HEADER.unpack_from(data)
+        offsets = array('Q')
+        offsets.frombytes(data[INDEX_HEADER.size:])
+    except (OSError, struct.error, ValueError):
+        # A missing or damaged checkpoint only costs a rescan
+        return 0, array('Q')
+    if magic != INDEX_MAGIC or indexed_end > segment_size or (offsets and offsets[-1] >= indexed_end):
+        return 0, array('Q')
+    return indexed_end, offsets
+
+
+def write_index_checkpoint(path, indexed_end, offsets):
+    index_path = path + INDEX_SUFFIX
+    temp_path = index_path + '.tmp'
+    try:
+        with open(temp_path, 'wb') as file:
+            file.write(INDEX_HEADER.pack(INDEX_MAGIC, indexed_end))
+            file.write(offsets.tobytes())
+        os.replace(temp_path, index_path)
+    except OSError as e:
+        logging.warning(f"Failed to write archive index checkpoint {index_path}: {e}")
+
+
+def recover_segment(path):
+    """
+    Make a raw segment consistent after a crash.
+
+    Records covered by the index checkpoint are trusted; only the tail
+    written after it is scanned and checked against the record CRCs. A torn
+    or corrupt tail is truncated and the checkpoint brought up to date.
+
+    :return: Tuple of (valid length, array of record offsets).
+    """
+    size = os.path.getsize(path)
+    indexed_end, offsets = read_index_checkpoint(path, size)
+    valid_end = indexed_end
+    if size > indexed_end:
+        with open(path, 'rb') as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for offset, next_offset, _ in iter_record_spans(data, indexed_end, size, verify=True):
+                offsets.append(offset)
+                valid_end = next_offset
+        if valid_end < size:
+            logging.warning(f"Truncating {size - valid_end} torn bytes from archive segment {path}")
+            with open(path, 'r+b') as file:
+                file.truncate(valid_end)
+                os.fsync(file.fileno())
+    if valid_end != indexed_end or not os.path.exists(path + INDEX_SUFFIX):
+        write_index_checkpoint(path, valid_end, offsets)
+    return valid_end, offsets
+
+
+def compress_segment(path, codec='zlib', block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Turn a raw segment into a sealed, block-compressed segment and delete the raw file.
+
+    :return: Path of the sealed segment.
+    """
+    codec_id, compress, _ = CODECS[codec]
+    with open(path, 'rb') as file:
+        data = file.read()
+
+    sealed_path = path[:-len(ACTIVE_SUFFIX)] + SEALED_SUFFIX
+    temp_path = sealed_path + '.tmp'
+    blocks = []
+    first_at = last_at = None
+    records_end = 0
+
+    with open(temp_path, 'wb') as out:
+        out.write(SEALED_MAGIC)
+        offset = len(SEALED_MAGIC)
+
+        def write_block(start, end, records, block_first_at):
+            nonlocal offset
+            compressed = compress(data[start:end])
+            out.write(compressed)
+            blocks.append((offset, len(compressed), end - start, records, block_first_at))
+            offset += len(compressed)
+
+        block_start = None
+        block_records = 0
+        block_first_at = 0.0
+        for record_offset, records_end, header in iter_record_spans(data):
+            received_at = header[4]
+            if first_at is None:
+                first_at = received_at
+            last_at = received_at
+            if block_start is None:
+                block_start = record_offset
+                block_first_at = received_at
+            block_records += 1
+            if records_end - block_start >= block_size:
+                write_block(block_start, records_end, block_records, block_first_at)
+                block_start = None
+                block_records = 0
+        if block_start is not None:
+            write_block(block_start, records_end, block_records, block_first_at)
+
+        if records_end < len(data):
+            logging.warning(f"Dropped {len(data) - records_end} trailing bytes from {path}")
+
+        index_offset = offset
+        for block in blocks:
+            out.write(BLOCK_ENTRY.pack(*block))
+        out.write(TRAILER.pack(index_offset, len(blocks), codec_id, first_at or 0.0,
+                               last_at or 0.0, SEALED_MAGIC))
+
+    os.replace(temp_path, sealed_path)
+    os.remove(path)
+    if os.path.exists(path + INDEX_SUFFIX):
+        os.remove(path + INDEX_SUFFIX)
+    return sealed_path
+
+
+class SegmentedArchive:
+    """
+    Append-only message archive split into time- or size-bounded segments.
+
+    The active segment is a plain file of records. When it is rolled it is
+    sealed: a background thread compresses it and applies the retention
+    policy, so disk usage stays bounded regardless of uptime.
+    """
+
+    def __init__(self, directory=DEFAULT_ARCHIVE_DIR, max_segment_bytes=DEFAULT_MAX_SEGMENT_BYTES,
+                 max_segment_age=DEFAULT_MAX_SEGMENT_AGE, retention=DEFAULT_RETENTION,
+                 codec='zlib', block_size=DEFAULT_BLOCK_SIZE,
+                 checkpoint_bytes=DEFAULT_CHECKPOINT_BYTES, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL):
+        if codec not in CODECS:
+            raise ValueError(f"Unsupported archive codec: {codec}")
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_age = max_segment_age
+        self.retention = retention
+        self.codec = codec
+        self.block_size = block_size
+        self.checkpoint_bytes = checkpoint_bytes
+        self.checkpoint_interval = checkpoint_interval
+
+        os.makedirs(directory, exist_ok=True)
+        self.symbols = open_symbols(directory, writable=True)
+        self.lock = threading.Lock()
+        self.active_file = None
+        self.active_path = None
+        self.active_started = 0.0
+        self.active_size = 0
+        self.active_offsets = array('Q')
+        self.checkpointed_size = 0
+        self.checkpointed_at = 0.0
+
+        self.compress_queue = queue.Queue()
+        self.compressor = threading.Thread(target=self.run_compressor, name="ArchiveCompressor",
+                                           daemon=True)
+        self.compressor.start()
+
+        # Raw segments left over from a previous run are recovered now, so a
+        # torn tail never reaches a reader, and sealed in the background
+        for path in self.list_segments(sealed=False):
+            started = time.perf_counter()
+            try:
+                valid_end, offsets = recover_segment(path)
+            except OSError as e:
+                logging.error(f"Failed to recover archive segment {path}: {e}")
+                continue
+            logging.info(f"Recovered {len(offsets)} records ({valid_end} bytes) from {path} "
+                         f"in {(time.perf_counter() - started) * 1000:.1f} ms")
+            self.compress_queue.put(path)
+        self.compress_queue.put(None)  # apply retention once at startup
+
+    def list_segments(self, sealed=None):
+        """Return segment paths, oldest first. sealed=None lists both kinds."""
+        patterns = []
+        if sealed is not True:
+            patterns.append('*' + ACTIVE_SUFFIX)
+        if sealed is not False:
+            patterns.append('*' + SEALED_SUFFIX)
+        paths = []
+        for pattern in patterns:
+            paths.extend(glob.glob(os.path.join(self.directory, pattern)))
+        # Names start with a zero-padded timestamp, so they sort chronologically
+        return sorted(paths, key=os.path.basename)
+
+    def disk_usage(self):
+        return sum(os.path.getsize(path) for path in self.list_segments())
+
+    def add_messages(self, records):
+        """Append a batch of MessageRecords."""
+        now = time.time()
+        encoded = [encode_record(record, self.symbols) for record in records]
+        if not encoded:
+            return
+        with self.lock:
+            if self.active_file is not None and (
+                    self.active_size >= self.max_segment_bytes
+                    or now - self.active_started >= self.max_segment_age):
+                self._seal_active()
+            if self.active_file is None:
+                self._open_active(now)
+            for data in encoded:
+                self.active_offsets.append(self.active_size)
+                self.active_size += len(data)
+            self.active_file.write(b''.join(encoded))
+            self.active_file.flush()
+            if (self.active_size - self.checkpointed_size >= self.checkpoint_bytes
+                    or now - self.checkpointed_at >= self.checkpoint_interval):
+                self._checkpoint_active(now)
+
+    def checkpoint(self):
+        """Make everything written so far durable and checkpoint the active segment's index."""
+        with self.lock:
+            self._checkpoint_active(time.time())
+
+    def _checkpoint_active(self, now):
+        if self.active_file is None:
+            return
+        self.active_file.flush()
+        # Records refer to symbols by id, so the symbols go to disk first
+        self.symbols.sync()
+        os.fsync(self.active_file.fileno())
+        write_index_checkpoint(self.active_path, self.active_size, self.active_offsets)
+        self.checkpointed_size = self.active_size
+        self.checkpointed_at = now
+
+    def roll(self):
+        """Seal the active segment now; the next write starts a new one."""
+        with self.lock:
+            self._seal_active()
+
+    def _open_active(self, now):
+        # Segment names must never repeat, even when rolling within a millisecond
+        stamp = int(now * 1000)
+        while True:
+            name = f"{stamp:015d}"
+            path = os.path.join(self.directory, name + ACTIVE_SUFFIX)
+            if not (os.path.exists(path) or os.path.exists(os.path.join(self.directory, name + SEALED_SUFFIX))):
+                break
+            stamp += 1
+        self.active_path = path
+        self.active_file = open(self.active_path, 'ab')
+        self.active_started = now
+        self.active_size = self.active_file.tell()
+        self.active_offsets = array('Q')
+        self.checkpointed_size = 0
+        self.checkpointed_at = now
+
+    def _seal_active(self):
+        if self.active_file is None:
+            return
+        self._checkpoint_active(time.time())
+        self.active_file.close()
+        self.compress_queue.put(self.active_path)
+        self.active_file = None
+        self.active_path = None
+        self.active_size = 0
+
+    def run_compressor(self):
+        while True:
+            path = self.compress_queue.get()
+            if path is StopIteration:
+                break
+            if path is not None:
+                try:
+                    compress_segment(path, self.codec, self.block_size)
+                except Exception as e:
+                    logging.error(f"Failed to compress archive segment {path}: {e}")
+            self.apply_retention()
+
+    def apply_retention(self, now=None):
+        """Delete sealed segments whose newest message is older than the retention period."""
+        if not self.retention:
+            return
+        cutoff = (now if now is not None else time.time()) - self.retention
+        for path in self.list_segments(sealed=True):
+            try:
+                with open(path, 'rb') as file:
+                    file.seek(-TRAILER.size, os.SEEK_END)
+                    last_at = TRAILER.unpack(file.read(TRAILER.size))[4]
+                if last_at < cutoff:
+                    os.remove(path)
+                    logging.info(f"Deleted expired archive segment {path}")
+            except (OSError, struct.error) as e:
+                logging.error(f"Failed to apply retention to {path}: {e}")
+
+    def close(self):
+        """Close the active segment and wait for pending compression to finish."""
+        with self.lock:
+            if self.active_file is not None:
+                self._checkpoint_active(time.time())
+                self.active_file.close()
+                self.active_file = None
+        self.compress_queue.put(StopIteration)
+        self.compressor.join()
+        self.symbols.close()
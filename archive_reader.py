@@ -0,0 +1,226 @@
+import bisect
+import logging
+import mmap
+import os
+
+from archive import (DEFAULT_ARCHIVE_DIR, ACTIVE_SUFFIX, SEALED_SUFFIX, iter_record_spans, iter_records,
+                     read_index_checkpoint, read_sealed_index, read_sealed_block)
+from record_format import open_symbols
+
+REFRESH_ATTEMPTS = 5
+
+
+class RawSegmentIndex:
+    """Record offsets of a raw (active or not yet sealed) segment."""
+
+    def __init__(self, path, symbols=None):
+        self.path = path
+        self.symbols = symbols
+        self.base = 0   # archive position of the first record, set by ArchiveReader
+        # Start from the writer's checkpoint and scan only what follows it
+        self.indexed_end, self.offsets = read_index_checkpoint(path, os.path.getsize(path))
+        self.update()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def update(self):
+        """Index records appended since the last update."""
+        size = os.path.getsize(self.path)
+        if size <= self.indexed_end:
+            return
+        with open(self.path, 'rb') as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for offset, record_end, _ in iter_record_spans(data, self.indexed_end, size):
+                self.offsets.append(offset)
+                self.indexed_end = record_end
+
+    def read(self, start, stop):
+        if start >= stop:
+            return []
+        with open(self.path, 'rb') as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return [next(iter_records(data, self.offsets[i], symbols=self.symbols))[1]
+                    for i in range(start, stop)]
+
+
+class SealedSegmentIndex:
+    """Block index of a sealed segment, read from its footer."""
+
+    def __init__(self, path, symbols=None):
+        self.path = path
+        self.symbols = symbols
+        self.base = 0   # archive position of the first record, set by ArchiveReader
+        with open(path, 'rb') as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            self.codec_id, _, _, self.blocks = read_sealed_index(data)
+        # First record number of every block, for bisecting
+        self.block_starts = []
+        total = 0
+        for block in self.blocks:
+            self.block_starts.append(total)
+            total += block[3]
+        self.record_count = total
+        self.cached_block = None
+        self.cached_records = None
+
+    def __len__(self):
+        return self.record_count
+
+    def update(self):
+        pass
+
+    def block_records(self, data, block_number):
+        if self.cached_block != block_number:
+            raw = read_sealed_block(data, self.codec_id, self.blocks[block_number])
+            self.cached_records = [record for _, record in iter_records(raw, symbols=self.symbols)]
+            self.cached_block = block_number
+        return self.cached_records
+
+    def read(self, start, stop):
+        if start >= stop:
+            return []
+        records = []
+        with open(self.path, 'rb') as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            block_number = bisect.bisect_right(self.block_starts, start) - 1
+            while start < stop:
+                block_start = self.block_starts[block_number]
+                block = self.block_records(data, block_number)
+                end = min(stop, block_start + len(block))
+                records.extend(block[start - block_start:end - block_start])
+                start = end
+                block_number += 1
+        return records
+
+
+class ArchiveReader:
+    """
+    Random access to the records of a SegmentedArchive.
+
+    Records are addressed by their position in the whole archive, oldest
+    first, so the newest messages can be shown straight away and older ones
+    paged in by seeking instead of reading everything.
+
+    A segment keeps the base position it was first given, also once it is
+    sealed, so positions stay valid when retention deletes older segments;
+    the positions of deleted records are simply no longer readable.
+    """
+
+    def __init__(self, directory=DEFAULT_ARCHIVE_DIR):
+        self.directory = directory
+        self.symbols = open_symbols(directory) if os.path.isdir(directory) else None
+        self.segments = []
+        self.next_position = 0   # position after the newest record seen
+        self.refresh()
+
+    def refresh(self):
+        """Pick up new, sealed and deleted segments and index appended records."""
+        # A raw segment can be sealed, or a segment deleted, between listing
+        # and opening it. Skipping it would give the segments after it the
+        # wrong base positions, so list again instead.
+        for _ in range(REFRESH_ATTEMPTS - 1):
+            try:
+                return self._refresh()
+            except FileNotFoundError:
+                continue
+        return self._refresh()
+
+    def _refresh(self):
+        by_stem = {}
+        try:
+            names = sorted(os.listdir(self.directory))
+        except FileNotFoundError:
+            names = []
+        if names and self.symbols is None:
+            self.symbols = open_symbols(self.directory)
+        for name in names:
+            stem, suffix = os.path.splitext(name)
+            # A raw segment that has just been sealed briefly exists twice;
+            # the sealed copy wins
+            if suffix == SEALED_SUFFIX or (suffix == ACTIVE_SUFFIX and stem not in by_stem):
+                by_stem[stem] = os.path.join(self.directory, name)
+
+        existing = {segment_stem(segment.path): segment for segment in self.segments}
+        segments = []
+        for stem in sorted(by_stem):
+            path = by_stem[stem]
+            try:
+                segment = existing.get(stem)
+                if segment is not None and segment.path == path:
+                    segment.update()
+                else:
+                    if path.endswith(SEALED_SUFFIX):
+                        new_segment = SealedSegmentIndex(path, self.symbols)
+                    else:
+                        new_segment = RawSegmentIndex(path, self.symbols)
+                    # Sealing keeps record positions; a new segment follows
+                    # the previous one, or everything seen so far
+                    if segment is not None:
+                        new_segment.base = segment.base
+                    elif segments:
+                        new_segment.base = segments[-1].base + len(segments[-1])
+                    else:
+                        new_segment.base = self.next_position
+                    segment = new_segment
+                segments.append(segment)
+            except FileNotFoundError:
+                raise
+            except (OSError, ValueError) as e:
+                logging.error(f"Skipping unreadable archive segment {path}: {e}")
+        self.segments = segments
+        if segments:
+            self.next_position = max(self.next_position, segments[-1].base + len(segments[-1]))
+
+    def count(self):
+        """Number of records in the archive."""
+        return sum(len(segment) for segment in self.segments)
+
+    def first_position(self):
+        return self.segments[0].base if self.segments else self.next_position
+
+    def end_position(self):
+        return self.next_position
+
+    def read_range(self, start, stop):
+        """
+        Return records [start, stop) as MessageRecords. Positions before
+        first_position() have been deleted and are skipped.
+        """
+        try:
+            return self._read_range(start, stop)
+        except FileNotFoundError:
+            # A raw segment was sealed since the last refresh; sealing keeps
+            # record positions, so pick up the sealed copy and read again
+            self.refresh()
+            return self._read_range(start, stop)
+
+    def _read_range(self, start, stop):
+        records = []
+        for segment in self.segments:
+            segment_end = segment.base + len(segment)
+            if segment_end > start and segment.base < stop:
+                records.extend(segment.read(max(start, segment.base) - segment.base,
+                                            min(stop, segment_end) - segment.base))
+            if segment_end >= stop:
+                break
+        return records
+
+    def newest(self, count):
+        """
+        Return the newest `count` records, oldest first, and the position of
+        the first one (pass it to page_before to go further back).
+        """
+        end = self.end_position()
+        records = self.read_range(max(self.first_position(), end - count), end)
+        # Reading may have found older segments deleted meanwhile
+        return records, end - len(records)
+
+    def page_before(self, position, count):
+        """Return up to `count` records before `position` and the new position."""
+        records = self.read_range(max(self.first_position(), position - count), position)
+        return records, position - len(records)
+
+
+def segment_stem(path):
+    return os.path.splitext(os.path.basename(path))[0]
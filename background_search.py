@@ -0,0 +1,143 @@
+import logging
+import threading
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+# Typing pause before a search starts
+DEFAULT_DEBOUNCE_MS = 250
+
+
+class SearchCancelled(Exception):
+    """Raised inside a search job when a newer search has replaced it."""
+
+
+class SearchRunner(QObject):
+    """
+    Runs searches on a worker thread, one at a time, newest wins.
+
+    ``request`` restarts a debounce timer, so a burst of keystrokes starts
+    a single search. Starting a search cancels the one still running: its
+    ``cancelled`` check starts returning True and its cancel hook (e.g.
+    ``sqlite3.Connection.interrupt``) is called. Only the result of the
+    newest search is delivered, through ``finished`` on the GUI thread.
+    """
+
+    finished = pyqtSignal(object)
+    _job_done = pyqtSignal(int, object)
+
+    def __init__(self, debounce_ms=DEFAULT_DEBOUNCE_MS, parent=None):
+        super().__init__(parent)
+        self.debounce_timer = QTimer(self)
+        self.debounce_timer.setSingleShot(True)
+        self.debounce_timer.setInterval(debounce_ms)
+        self.debounce_timer.timeout.connect(self.start_pending)
+        self._job_done.connect(self.deliver)
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.generation = 0
+        self.next_function = None
+        self.pending = None      # (generation, function) waiting for the worker
+        self.cancel_hook = None  # interrupts the job that is running now
+        self.worker = threading.Thread(target=self.run, name="SearchRunner", daemon=True)
+        self.worker.start()
+
+        # Metrics
+        self.started = 0
+        self.cancelled_jobs = 0
+
+    def request(self, function):
+        """
+        Schedule a search after the debounce interval.
+
+        :param function: Called on the worker thread as function(job) where
+                         job has ``cancelled()``, ``check()`` (raises
+                         SearchCancelled) and ``on_cancel(hook)``. Its return
+                         value is emitted through ``finished``.
+        """
+        self.next_function = function
+        self.debounce_timer.start()
+
+    def request_now(self, function):
+        """Start a search straight away, skipping the debounce interval."""
+        self.next_function = function
+        self.start_pending()
+
+    def start_pending(self):
+        self.debounce_timer.stop()
+        with self.lock:
+            self.generation += 1
+            self.pending = (self.generation, self.next_function)
+            self._cancel_running()
+            self.wakeup.notify()
+
+    def cancel(self):
+        """Drop any pending or running search."""
+        self.debounce_timer.stop()
+        with self.lock:
+            self.generation += 1
+            self.pending = None
+            self._cancel_running()
+
+    def _cancel_running(self):
+        # Called with the lock held, after the generation has moved on
+        if self.cancel_hook is not None:
+            try:
+                self.cancel_hook()
+            except Exception as e:
+                logging.debug(f"Search cancel hook failed: {e}")
+            self.cancel_hook = None
+
+    def run(self):
+        while True:
+            with self.lock:
+                while self.pending is None:
+                    self.wakeup.wait()
+                generation, function = self.pending
+                self.pending = None
+            job = SearchJob(self, generation)
+            self.started += 1
+            try:
+                result = function(job)
+            except SearchCancelled:
+                self.cancelled_jobs += 1
+                continue
+            except Exception as e:
+                if job.cancelled():
+                    # e.g. sqlite3.OperationalError: interrupted
+                    self.cancelled_jobs += 1
+                else:
+                    logging.error(f"Search failed: {e}")
+                continue
+            finally:
+                with self.lock:
+                    if self.generation == generation:
+                        self.cancel_hook = None
+            self._job_done.emit(generation, result)
+
+    def deliver(self, generation, result):
+        # A newer search may have started while this result was in flight
+        if generation == self.generation:
+            self.finished.emit(result)
+
+
+class SearchJob:
+    """Handle passed to a search function to check for cancellation."""
+
+    def __init__(self, runner, generation):
+        self.runner = runner
+        self.generation = generation
+
+    def cancelled(self):
+        return self.runner.generation != self.generation
+
+    def check(self):
+        if self.cancelled():
+            raise SearchCancelled()
+
+    def on_cancel(self, hook):
+        """Register a callable that aborts the job's blocking work when it is cancelled."""
+        with self.runner.lock:
+            if self.runner.generation == self.generation:
+                self.runner.cancel_hook = hook
+                return
+        hook()
@@ -0,0 +1,160 @@
+import threading
+import zlib
+from collections import Counter, OrderedDict
+
+# Bodies shorter than this are kept as they are; compressing them saves
+# too little to be worth the decompression when they are shown
+DEFAULT_COMPRESS_THRESHOLD = 128
+# Bytes of decompressed bodies kept for the rows on screen; a larger body
+# is not cached
+DEFAULT_CACHE_BYTES = 4 * 1024 * 1024
+# Bodies sampled before the shared dictionary is built
+DEFAULT_TRAINING_SAMPLES = 200
+DICTIONARY_SIZE = 32 * 1024   # zlib's window; a larger dictionary is not used
+COMPRESS_LEVEL = 6
+WBITS = -15                   # raw deflate: no zlib header or checksum per body
+# First byte of a packed body: how the rest of it is stored
+STORED = 0
+DEFLATED = 1
+DICT_DEFLATED = 2   # against the codec's shared dictionary
+
+
+class BodyCodec:
+    """
+    Compresses message bodies held in memory and decompresses them on access.
+
+    Bodies of at least `threshold` bytes are deflated. HL7 messages repeat
+    the same segments and field values, so with `use_dictionary` the first
+    `training_samples` bodies are used to build a shared zlib dictionary
+    that every later body is compressed against. The dictionary is built
+    once and never changes, so bodies packed with it stay readable.
+
+    A packed body is plain bytes whose first byte says how the rest is
+    stored (STORED, DEFLATED or DICT_DEFLATED), one byte per body. The most
+    recently unpacked bodies are kept in an LRU of at most `cache_bytes`
+    bytes, which serves the rows on screen that are painted repeatedly.
+    """
+
+    def __init__(self, threshold=DEFAULT_COMPRESS_THRESHOLD, use_dictionary=True,
+                 cache_bytes=DEFAULT_CACHE_BYTES, training_samples=DEFAULT_TRAINING_SAMPLES):
+        self.threshold = threshold
+        self.cache_bytes = cache_bytes
+        self.training_samples = training_samples if use_dictionary else 0
+        self.dictionary = None
+        self.samples = []
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+        # Bodies are packed on search worker threads as well as the GUI thread
+        self.lock = threading.Lock()
+
+        # Metrics
+        self.packed_in = 0
+        self.packed_out = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def pack(self, data, prefix=b''):
+        """
+        Return the form of a body to keep in memory.
+
+        :param data: Body as bytes.
+        :param prefix: Bytes to put in front of the packed body, for callers
+                       that keep other fields in the same bytes object.
+        :return: prefix, then the body compressed when it is at least the
+                 threshold and shrinks, otherwise stored as it is.
+        """
+        if len(data) < self.threshold:
+            return prefix + bytes((STORED,)) + data
+        dictionary = self.dictionary
+        if dictionary is None and self.training_samples:
+            self.add_sample(data)
+            dictionary = self.dictionary
+        if dictionary is not None:
+            compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, WBITS, zdict=dictionary)
+            kind = DICT_DEFLATED
+        else:
+            compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, WBITS)
+            kind = DEFLATED
+        compressed = compressor.compress(data) + compressor.flush()
+        if len(compressed) >= len(data):
+            return prefix + bytes((STORED,)) + data
+        self.packed_in += len(data)
+        self.packed_out += len(compressed)
+        return prefix + bytes((kind,)) + compressed
+
+    def unpack(self, packed, start=0):
+        """
+        Return the original bytes of a body returned by pack.
+
+        :param start: Length of the prefix the body was packed with.
+        """
+        kind = packed[start]
+        if kind == STORED:
+            return packed[start + 1:]
+        # Equal packed bytes unpack to the same body, so they are the key
+        with self.lock:
+            data = self.cache.get(packed)
+            if data is not None:
+                self.cache.move_to_end(packed)
+                self.cache_hits += 1
+                return data
+        body = memoryview(packed)[start + 1:]
+        if kind == DICT_DEFLATED:
+            data = zlib.decompressobj(WBITS, zdict=self.dictionary).decompress(body)
+        else:
+            data = zlib.decompress(body, WBITS)
+        with self.lock:
+            self.cache_misses += 1
+            if len(data) <= self.cache_bytes and packed not in self.cache:
+                self.cache[packed] = data
+                self.cached_bytes += len(data)
+                while self.cached_bytes > self.cache_bytes:
+                    _, evicted = self.cache.popitem(last=False)
+                    self.cached_bytes -= len(evicted)
+        return data
+
+    def add_sample(self, data):
+        with self.lock:
+            if self.dictionary is not None:
+                return
+            self.samples.append(data)
+            if len(self.samples) < self.training_samples:
+                return
+            samples = self.samples
+            self.samples = []
+        self.dictionary = train_dictionary(samples)
+
+    def ratio(self):
+        """Compressed size as a fraction of the original, for the bodies packed so far."""
+        return self.packed_out / self.packed_in if self.packed_in else 1.0
+
+
+def train_dictionary(samples, size=DICTIONARY_SIZE):
+    """
+    Build a zlib dictionary from sample HL7 bodies.
+
+    Segments and field values that recur across the samples are ranked by
+    the bytes they would save (occurrences x length). The best are placed
+    at the end, where deflate references them most cheaply.
+
+    :param samples: Iterable of bodies as bytes.
+    :param size: Maximum dictionary size in bytes.
+    :return: The dictionary as bytes.
+    """
+    counts = Counter()
+    for sample in samples:
+        for segment in sample.split(b'\r'):
+            if not segment:
+                continue
+            counts[segment + b'\r'] += 1
+            counts.update(field for field in segment.split(b'|') if len(field) > 2)
+    ranked = sorted(((count * len(value), value) for value, count in counts.items() if count > 1),
+                    reverse=True)
+    chosen = []
+    total = 0
+    for _, value in ranked:
+        if total + len(value) > size:
+            continue
+        chosen.append(value)
+        total += len(value)
+    return b''.join(reversed(chosen))
@@ -1,15 +1,31 @@
-from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel
-from PyQt5.QtGui import QPixmap
-from PyQt5.QtCore import Qt
+import math
+import time
+from collections import Counter, deque
+from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QGridLayout, QLabel, QProgressBar, QTabWidget, QTableView,
+                             QAbstractItemView, QHeaderView)
+from PyQt5.QtGui import QPainter, QPixmap, QColor, QPolygonF, QPen
+from PyQt5.QtCore import Qt, QTimer, QPointF, QRect, QSortFilterProxyModel
+from metrics import percentiles, format_count, format_bytes, format_latency
+from peer_stats_model import PeerStatsModel, SORT_ROLE
+
+# How often the engine's metrics are sampled
+DEFAULT_SAMPLE_INTERVAL_MS = 1000
+# Samples shown by each trend panel
+DEFAULT_HISTORY = 120
+# Samples the ACK code ratio is computed over
+ACK_RATIO_WINDOW = 60
+ACK_COLORS = {"AA": QColor("#2e7d32"), "AE": QColor("#f9a825"), "AR": QColor("#c62828")}
+
 
 class DashboardTab(QWidget):
-    def __init__(self, parent=None):
+    def __init__(self, server=None, sample_interval_ms=DEFAULT_SAMPLE_INTERVAL_MS, parent=None):
         super().__init__(parent)
+        self.server = server
         layout = QVBoxLayout()
 
         # Engine status
         self.status_label = QLabel("HL7 Engine Status: Checking...")
-        
+
         # Status indicator (could be a simple label or icon)
         self.status_indicator = QLabel()
         self.update_status("Checking")  # Initial status
@@ -17,11 +33,246 @@ class DashboardTab(QWidget):
         layout.addWidget(self.status_label)
         layout.addWidget(self.status_indicator)
 
+        # Live panels, fed by sampling the server's counters on a timer
+        self.message_rate = TrendPanel("Messages", [("msg/s", QColor("#1565c0"))], format_count)
+        self.byte_rate = TrendPanel("Throughput", [("bytes/s", QColor("#6a1b9a"))], format_bytes)
+        self.latency = TrendPanel("ACK latency", [("p50", QColor("#2e7d32")), ("p95", QColor("#f9a825")),
+                                                  ("p99", QColor("#c62828"))], format_latency)
+        self.connections = TrendPanel("Connections", [("active", QColor("#00838f"))], format_count)
+        self.ack_ratio = AckRatioBar()
+        self.queue_bars = QGridLayout()
+        self.queues = []    # (name, depth function, capacity, progress bar)
+
+        panels = QGridLayout()
+        panels.addWidget(self.message_rate, 0, 0)
+        panels.addWidget(self.byte_rate, 0, 1)
+        panels.addWidget(self.latency, 1, 0)
+        panels.addWidget(self.connections, 1, 1)
+        panels.addWidget(self.ack_ratio, 2, 0, 1, 2)
+        panels.addLayout(self.queue_bars, 3, 0, 1, 2)
+        layout.addLayout(panels)
+
+        # Per-connection and per-sender statistics, refreshed with the panels
+        self.stats_tables = QTabWidget()
+        self.stats_models = []
+        if server is not None:
+            self.add_stats_table("Connections", server.stats_by_connection)
+            self.add_stats_table("Sending Facilities", server.stats_by_facility)
+            layout.addWidget(self.stats_tables, 1)
+        else:
+            layout.addStretch()
+
         self.setLayout(layout)
 
+        self.last_sample = None     # (time, metrics) of the previous sample
+        self.ack_window = deque(maxlen=ACK_RATIO_WINDOW)
+        if server is not None:
+            if server.writer is not None:
+                self.add_queue("Storage queue", server.writer.queue_depth, server.writer.queue.maxsize)
+            self.last_sample = (time.monotonic(), server.metrics())
+            server.ack_latency.take_interval()
+            self.timer = QTimer(self)
+            self.timer.timeout.connect(self.sample)
+            self.timer.start(sample_interval_ms)
+
     def update_status(self, status):
         # Update the status label
         self.status_label.setText(f"HL7 Engine Status: {status}")
 
+    def add_stats_table(self, title, source):
+        model = PeerStatsModel(source, self)
+        proxy = QSortFilterProxyModel(self)
+        proxy.setSourceModel(model)
+        proxy.setSortRole(SORT_ROLE)
+        table = QTableView()
+        table.setModel(proxy)
+        table.setSortingEnabled(True)
+        table.sortByColumn(1, Qt.DescendingOrder)   # busiest first
+        table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        table.setWordWrap(False)
+        table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        table.verticalHeader().hide()
+        table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.stats_tables.addTab(table, title)
+        self.stats_models.append(model)
+
+    def add_queue(self, name, depth, capacity):
+        """
+        Show the depth of a queue.
+
+        :param depth: Callable returning the number of queued items.
+        :param capacity: Maximum depth, or 0 when unbounded.
+        """
+        bar = QProgressBar()
+        bar.setRange(0, max(capacity, 1))
+        bar.setFormat(f"%v / {capacity}" if capacity else "%v")
+        row = len(self.queues)
+        self.queue_bars.addWidget(QLabel(name), row, 0)
+        self.queue_bars.addWidget(bar, row, 1)
+        self.queues.append((name, depth, capacity, bar))
+
+    def sample(self):
+        now = time.monotonic()
+        metrics = self.server.metrics()
+        latency = percentiles(self.server.ack_latency.take_interval())
+        if self.last_sample is not None:
+            then, previous = self.last_sample
+            elapsed = max(now - then, 1e-6)
+            self.message_rate.add_sample(
+                [(metrics['messages_received'] - previous['messages_received']) / elapsed])
+            self.byte_rate.add_sample([(metrics['bytes_received'] - previous['bytes_received']) / elapsed])
+            self.latency.add_sample(latency)
+            acks = Counter(metrics['ack_counts'])
+            acks.subtract(previous['ack_counts'])
+            self.ack_window.append(acks)
+            self.ack_ratio.set_counts(sum(self.ack_window, Counter()))
+        self.connections.add_sample([metrics['active_connections']])
+        for _, depth, capacity, bar in self.queues:
+            value = depth()
+            if not capacity and value > bar.maximum():
+                bar.setMaximum(value)
+            bar.setValue(min(value, bar.maximum()))
+        for model in self.stats_models:
+            model.refresh()
+        self.last_sample = (now, metrics)
+
+
+class TrendPanel(QWidget):
+    """
+    Small line chart of the last `history` samples of one or more series.
+
+    The chart is kept in a pixmap. A new sample scrolls the pixmap left by
+    one step and draws only the newest segment; the whole chart is redrawn
+    only when the scale changes, the panel is resized, or it was hidden.
+    """
+
+    def __init__(self, title, series, formatter, history=DEFAULT_HISTORY, parent=None):
+        super().__init__(parent)
+        self.title = title
+        self.series = series          # [(name, QColor)]
+        self.formatter = formatter
+        self.history = history
+        self.samples = deque(maxlen=history)
+        self.scale = 1
+        self.pixmap = None
+        self.setMinimumSize(240, 100)
+
+    def add_sample(self, values):
+        """Add one value per series; None leaves a gap."""
+        self.samples.append(values)
+        scale = nice_ceiling(max((value for sample in self.samples for value in sample if value is not None),
+                                 default=0))
+        if scale != self.scale:
+            self.scale = scale
+            self.pixmap = None
+        if self.pixmap is not None and self.isVisible():
+            self.scroll_chart()
+        else:
+            self.pixmap = None
+        self.update()
+
+    def step(self):
+        return max(1, self.width() // max(1, self.history - 1))
+
+    def y_for(self, value):
+        height = self.height() - 1
+        return height - (min(value, self.scale) / self.scale) * (height - 20)
+
+    def scroll_chart(self):
+        step = self.step()
+        width = self.pixmap.width()
+        self.pixmap.scroll(-step, 0, self.pixmap.rect())
+        painter = QPainter(self.pixmap)
+        painter.fillRect(QRect(width - step, 0, step, self.pixmap.height()), self.palette().base())
+        if len(self.samples) >= 2:
+            painter.setRenderHint(QPainter.Antialiasing)
+            previous, latest = self.samples[-2], self.samples[-1]
+            for (_, color), before, after in zip(self.series, previous, latest):
+                if before is None or after is None:
+                    continue
+                painter.setPen(QPen(color, 1.5))
+                painter.drawLine(QPointF(width - 1 - step, self.y_for(before)),
+                                 QPointF(width - 1, self.y_for(after)))
+        painter.end()
+
+    def redraw_chart(self):
+        self.pixmap = QPixmap(self.size())
+        self.pixmap.fill(self.palette().base().color())
+        painter = QPainter(self.pixmap)
+        painter.setRenderHint(QPainter.Antialiasing)
+        step = self.step()
+        right = self.width() - 1
+        count = len(self.samples)
+        for number, (_, color) in enumerate(self.series):
+            painter.setPen(QPen(color, 1.5))
+            line = QPolygonF()
+            for age, sample in enumerate(self.samples):
+                value = sample[number]
+                if value is None:
+                    if line.size() > 1:
+                        painter.drawPolyline(line)
+                    line = QPolygonF()
+                    continue
+                line.append(QPointF(right - (count - 1 - age) * step, self.y_for(value)))
+            if line.size() > 1:
+                painter.drawPolyline(line)
+        painter.end()
+
+    def resizeEvent(self, event):
+        self.pixmap = None
+        super().resizeEvent(event)
+
+    def paintEvent(self, event):
+        if self.pixmap is None:
+            self.redraw_chart()
+        painter = QPainter(self)
+        painter.drawPixmap(0, 0, self.pixmap)
+        painter.setPen(self.palette().text().color())
+        painter.drawRect(self.rect().adjusted(0, 0, -1, -1))
+        latest = self.samples[-1] if self.samples else [None] * len(self.series)
+        text = "   ".join(f"{name} {self.formatter(value)}" for (name, _), value in zip(self.series, latest))
+        painter.drawText(6, 14, f"{self.title}: {text}")
+        painter.drawText(self.rect().adjusted(0, 2, -6, 0), Qt.AlignRight | Qt.AlignTop,
+                         self.formatter(self.scale))
+
+
+class AckRatioBar(QWidget):
+    """Bar split by the share of AA, AE and AR acknowledgments."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.counts = Counter()
+        self.setMinimumHeight(28)
+
+    def set_counts(self, counts):
+        counts = Counter({code: counts.get(code, 0) for code in ACK_COLORS})
+        if counts != self.counts:
+            self.counts = counts
+            self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        rect = self.rect().adjusted(0, 0, -1, -1)
+        total = sum(self.counts.values())
+        left = rect.left()
+        parts = []
+        for code, color in ACK_COLORS.items():
+            count = self.counts[code]
+            if total and count:
+                width = round(rect.width() * count / total)
+                painter.fillRect(QRect(left, rect.top(), width, rect.height()), color)
+                left += width
+            parts.append(f"{code} {100 * count / total:.1f}%" if total else f"{code} -")
+        painter.setPen(self.palette().text().color())
+        painter.drawRect(rect)
+        painter.drawText(rect, Qt.AlignCenter, "ACKs (last minute): " + "   ".join(parts))
+
 
-        
\ No newline at end of file
+def nice_ceiling(value):
+    """Smallest 1, 2 or 5 times a power of ten that is at least `value` (and at least 1)."""
+    if value <= 1:
+        return 1
+    magnitude = 10 ** math.floor(math.log10(value))
+    for multiple in (1, 2, 5, 10):
+        if value <= multiple * magnitude:
+            return multiple * magnitude
@@ -0,0 +1,158 @@
+import hashlib
+import logging
+import math
+import threading
+from collections import OrderedDict
+
+DEFAULT_LRU_SIZE = 50000
+DEFAULT_BLOOM_CAPACITY = 2000000
+DEFAULT_BLOOM_ERROR_RATE = 0.001
+
+
+def duplicate_key(message):
+    """
+    Return the (MSH-3, MSH-4, MSH-10) key that identifies a message, or None
+    if the message has no control ID.
+    """
+    end = message.find('\r')
+    msh_segment = message[:end] if end != -1 else message
+    if not msh_segment.startswith("MSH"):
+        msh_segment = next((seg for seg in message.split('\r') if seg.startswith("MSH")), "")
+    msh_fields = msh_segment.split('|', 10)
+    if len(msh_fields) < 10 or not msh_fields[9]:
+        return None
+    return msh_fields[2], msh_fields[3], msh_fields[9]
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter; memory does not grow with the number of items."""
+
+    def __init__(self, capacity=DEFAULT_BLOOM_CAPACITY, error_rate=DEFAULT_BLOOM_ERROR_RATE):
+        self.bit_count = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.bit_count / capacity * math.log(2)))
+        self.bits = bytearray((self.bit_count + 7) // 8)
+
+    def _positions(self, key):
+        # Double hashing: k positions from the two halves of one digest
+        digest = hashlib.blake2b('\x1f'.join(key).encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.bit_count for i in range(self.hash_count)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(key))
+
+
+class DuplicateDetector:
+    """
+    Recognises retransmitted messages and remembers the ACK that was sent.
+
+    Recent keys live in an LRU together with their ACK. Older keys are
+    covered by a Bloom filter loaded from the message store; a Bloom hit is
+    confirmed by looking the original ACK up in the store.
+
+    The filter is built by a loader thread into a filter of its own and
+    swapped in when complete, with the keys remembered in the meantime
+    added to it. Until then only the LRU is consulted, so the event loop
+    never queries the store for every message while the filter loads;
+    retransmissions of messages received before startup are recognised
+    once it is in place.
+    """
+
+    def __init__(self, store=None, lru_size=DEFAULT_LRU_SIZE, bloom_capacity=DEFAULT_BLOOM_CAPACITY,
+                 bloom_error_rate=DEFAULT_BLOOM_ERROR_RATE):
+        self.store = store
+        self.lru_size = lru_size
+        self.recent = OrderedDict()
+        self.bloom_capacity = bloom_capacity
+        self.bloom_error_rate = bloom_error_rate
+        # With a store, the loader thread builds the filter
+        self.bloom = BloomFilter(bloom_capacity, bloom_error_rate) if store is None else None
+        self.bloom_ready = store is None
+        # Guards the swap. Keys remembered while the filter loads wait in
+        # pending_keys, which is None once loading has failed.
+        self.bloom_lock = threading.Lock()
+        self.pending_keys = []
+
+        # Metrics
+        self.duplicates = 0
+        self.lru_hits = 0
+        self.store_hits = 0
+        self.bloom_false_positives = 0
+
+        if store is not None:
+            threading.Thread(target=self.load_from_store, name="DuplicateBloomLoader",
+                             daemon=True).start()
+
+    def load_from_store(self):
+        try:
+            # Only this thread touches the new filter until it is swapped in
+            bloom = BloomFilter(self.bloom_capacity, self.bloom_error_rate)
+            for key in self.store.iter_duplicate_keys():
+                bloom.add(key)
+            with self.bloom_lock:
+                for key in self.pending_keys:
+                    bloom.add(key)
+                self.pending_keys = []
+                self.bloom = bloom
+                self.bloom_ready = True
+        except Exception as e:
+            # Without a complete filter every miss goes to the store
+            logging.error(f"Failed to load duplicate filter from the store: {e}")
+            with self.bloom_lock:
+                self.pending_keys = None
+
+    def lookup(self, key):
+        """
+        Return the ACK sent for an earlier copy of this message, or None if
+        the message has not been seen before.
+        """
+        acknowledgment = self.recent.get(key)
+        if acknowledgment is not None:
+            self.recent.move_to_end(key)
+            self.lru_hits += 1
+            self.duplicates += 1
+            return acknowledgment
+
+        if self.store is None:
+            return None
+        if self.bloom_ready:
+            if key not in self.bloom:
+                return None
+        elif self.pending_keys is not None:
+            return None   # still loading
+
+        acknowledgment = self.store.find_acknowledgment(*key)
+        if acknowledgment is None:
+            if self.bloom_ready:
+                self.bloom_false_positives += 1
+            return None
+        self.store_hits += 1
+        self.duplicates += 1
+        self.remember(key, acknowledgment)
+        return acknowledgment
+
+    def remember(self, key, acknowledgment):
+        self.recent[key] = acknowledgment
+        self.recent.move_to_end(key)
+        if len(self.recent) > self.lru_size:
+            self.recent.popitem(last=False)
+        with self.bloom_lock:
+            if self.bloom_ready:
+                self.bloom.add(key)
+            elif self.pending_keys is not None:
+                self.pending_keys.append(key)
+
+    def metrics(self):
+        return {
+            'duplicates': self.duplicates,
+            'lru_hits': self.lru_hits,
+            'store_hits': self.store_hits,
+            'bloom_false_positives': self.bloom_false_positives,
+            'lru_size': len(self.recent),
+        }
@@ -0,0 +1,226 @@
+import bisect
+import logging
+import os
+import struct
+import threading
+import zlib
+
+DEFAULT_QUEUE_DIR = 'intake_queue'
+DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+SEGMENT_SUFFIX = '.q'
+CURSOR_SUFFIX = '.cursor'
+
+# Record: payload length, CRC-32 of the payload, then the payload
+RECORD_HEADER = struct.Struct('<II')
+# Cursor file: committed position
+CURSOR = struct.Struct('<Q')
+
+
+class DurableQueue:
+    """
+    Disk-backed FIFO queue between message intake and downstream processing.
+
+    Records are appended to segment files named after the queue position of
+    their first byte, so a position identifies a record across restarts.
+    Each consumer has its own cursor: records it has polled are handed out
+    again after a restart unless they were committed. Segments every
+    consumer has committed past are deleted.
+
+    Appends are flushed to the operating system before enqueue returns, so
+    they survive the process crashing; with `sync` they are also fsynced
+    and survive a power loss.
+    """
+
+    def __init__(self, directory=DEFAULT_QUEUE_DIR, segment_bytes=DEFAULT_SEGMENT_BYTES, sync=False):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.sync = sync
+        self.lock = threading.Lock()
+        self.consumers = {}
+
+        os.makedirs(directory, exist_ok=True)
+        self.segment_starts = sorted(
+            int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(directory)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+        if not self.segment_starts:
+            self.segment_starts = [0]
+            open(self.segment_path(0), 'ab').close()
+
+        # Drop a torn record left at the end by a crash, then append after it
+        last_start = self.segment_starts[-1]
+        valid_length = self.recover_segment(self.segment_path(last_start))
+        self.end = last_start + valid_length
+        self.file = open(self.segment_path(last_start), 'ab', buffering=WRITE_BUFFER_SIZE)
+        self.segment_start = last_start
+
+    def segment_path(self, start):
+        return os.path.join(self.directory, f"{start:020d}{SEGMENT_SUFFIX}")
+
+    def recover_segment(self, path):
+        with open(path, 'rb') as file:
+            data = file.read()
+        valid_length = 0
+        for record_offset, payload in iter_queue_records(data):
+            valid_length = record_offset + RECORD_HEADER.size + len(payload)
+        if valid_length < len(data):
+            logging.warning(f"Truncating {len(data) - valid_length} torn bytes from {path}")
+            with open(path, 'r+b') as file:
+                file.truncate(valid_length)
+        return valid_length
+
+    def enqueue(self, payload):
+        """Append one record (bytes or str) and return its queue position."""
+        return self.enqueue_many([payload])[0]
+
+    def enqueue_many(self, payloads):
+        """Append records and make them visible to consumers; returns their positions."""
+        positions = []
+        with self.lock:
+            for payload in payloads:
+                if isinstance(payload, str):
+                    payload = payload.encode('utf-8')
+                if self.end - self.segment_start >= self.segment_bytes:
+                    self._roll()
+                positions.append(self.end)
+                self.file.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+                self.file.write(payload)
+                self.end += RECORD_HEADER.size + len(payload)
+            self.file.flush()
+            if self.sync:
+                os.fsync(self.file.fileno())
+        return positions
+
+    def _roll(self):
+        self.file.close()
+        self.segment_start = self.end
+        self.segment_starts.append(self.end)
+        self.file = open(self.segment_path(self.end), 'ab', buffering=WRITE_BUFFER_SIZE)
+
+    def consumer(self, name):
+        """Return the consumer with this name, resuming from its committed position."""
+        with self.lock:
+            consumer = self.consumers.get(name)
+            if consumer is None:
+                consumer = QueueConsumer(self, name)
+                self.consumers[name] = consumer
+            return consumer
+
+    def read(self, position, max_records, end=None):
+        """
+        Return up to max_records (position, payload) tuples starting at
+        position, and before `end` when one is given.
+        """
+        with self.lock:
+            end = self.end if end is None else min(end, self.end)
+            starts = list(self.segment_starts)
+        records = []
+        if position < starts[0]:
+            position = starts[0]  # older segments were already deleted
+        while position < end and len(records) < max_records:
+            index = bisect.bisect_right(starts, position) - 1
+            segment_start = starts[index]
+            segment_end = starts[index + 1] if index + 1 < len(starts) else end
+            if position >= segment_end:
+                position = segment_end
+                continue
+            with open(self.segment_path(segment_start), 'rb') as file:
+                file.seek(position - segment_start)
+                while position < segment_end and len(records) < max_records:
+                    header = file.read(RECORD_HEADER.size)
+                    length, crc = RECORD_HEADER.unpack(header)
+                    payload = file.read(length)
+                    if zlib.crc32(payload) != crc:
+                        raise IOError(f"Corrupt queue record at position {position}")
+                    records.append((position, payload))
+                    position += RECORD_HEADER.size + length
+        return records
+
+    def depth(self, consumer):
+        """Bytes between a consumer's read position and the end of the queue."""
+        return self.end - consumer.position
+
+    def delete_consumed_segments(self):
+        """Delete segments that every consumer with a cursor file has committed past."""
+        committed = []
+        for name in os.listdir(self.directory):
+            if name.endswith(CURSOR_SUFFIX):
+                position = read_cursor(os.path.join(self.directory, name))
+                committed.append(position if position is not None else 0)
+        if not committed:
+            return
+        committed = min(committed)
+        with self.lock:
+            while len(self.segment_starts) > 1 and self.segment_starts[1] <= committed:
+                start = self.segment_starts.pop(0)
+                os.remove(self.segment_path(start))
+
+    def close(self):
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+
+
+class QueueConsumer:
+    """A named read cursor over a DurableQueue."""
+
+    def __init__(self, queue, name):
+        self.queue = queue
+        self.name = name
+        self.cursor_path = os.path.join(queue.directory, name + CURSOR_SUFFIX)
+        self.committed = read_cursor(self.cursor_path)
+        if self.committed is None:
+            self.committed = queue.segment_starts[0]
+            self.write_cursor()
+        self.position = self.committed
+
+    def poll(self, max_records=100, end=None):
+        """Return the next records (before `end`, if given) as (position, payload) tuples."""
+        records = self.queue.read(self.position, max_records, end)
+        if records:
+            last_position, last_payload = records[-1]
+            self.position = last_position + RECORD_HEADER.size + len(last_payload)
+        return records
+
+    def commit(self):
+        """Mark everything polled so far as processed."""
+        if self.position != self.committed:
+            self.committed = self.position
+            self.write_cursor()
+            self.queue.delete_consumed_segments()
+
+    def rewind(self):
+        """Go back to the last committed position."""
+        self.position = self.committed
+
+    def write_cursor(self):
+        temp_path = self.cursor_path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(CURSOR.pack(self.committed))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.cursor_path)
+
+
+def read_cursor(path):
+    """Return the committed position in a cursor file, or None if it has none."""
+    try:
+        with open(path, 'rb') as file:
+            return CURSOR.unpack(file.read(CURSOR.size))[0]
+    except (FileNotFoundError, struct.error):
+        return None
+
+
+def iter_queue_records(data, offset=0):
+    """Yield (offset, payload) for every intact record in segment data."""
+    while offset + RECORD_HEADER.size <= len(data):
+        length, crc = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        yield offset, payload
+        offset = start + length
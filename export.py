@@ -0,0 +1,177 @@
+"""
+Export stored HL7 messages to JSONL or CSV.
+
+Examples:
+    python export.py out.jsonl --fields MSH-9,MSH-10,PID-3.1,PID-5 --type ADT
+    python export.py out.csv --format csv --since 2024-01-01 --sender LAB
+"""
+import argparse
+import csv
+import json
+import sys
+from datetime import datetime
+
+from message_store import MessageStore, DEFAULT_DB_PATH
+
+WRITE_BUFFER_SIZE = 1024 * 1024
+DEFAULT_FIELDS = ['received_at', 'MSH-9', 'MSH-10', 'MSH-4', 'PID-3']
+
+# Columns that come from the store row rather than from the message text
+ROW_COLUMNS = {'id': 0, 'received_at': 1, 'message': 2, 'acknowledgment': 3}
+
+
+def parse_field_path(path):
+    """
+    Parse a field path such as "PID-5", "PID-5.1" or "OBX-5.1.2".
+
+    :return: Tuple of (segment, field, component, subcomponent); missing
+             parts are None.
+    """
+    segment, _, rest = path.partition('-')
+    numbers = rest.split('.')
+    if len(segment) != 3 or not segment.isalnum() or len(numbers) > 3 \
+            or not all(number.isdigit() and int(number) >= 1 for number in numbers):
+        raise ValueError(f"Invalid field path: {path}")
+    parts = [int(number) for number in numbers]
+    parts += [None] * (3 - len(parts))
+    return (segment.upper(), *parts)
+
+
+def field_value(segments, segment_name, field, component=None, subcomponent=None):
+    """
+    Return one value from a message that has been split into segments.
+
+    :param segments: Dictionary of segment name -> first segment of that name.
+    """
+    segment = segments.get(segment_name)
+    if segment is None:
+        return ''
+    # MSH-1 is the field separator itself, so MSH numbering is shifted by one
+    if segment_name == 'MSH' and field == 1:
+        return '|'
+    fields = segment.split('|')
+    index = field - 1 if segment_name == 'MSH' else field
+    if index >= len(fields):
+        return ''
+    value = fields[index]
+    if component is not None:
+        components = value.split('~')[0].split('^')
+        value = components[component - 1] if component <= len(components) else ''
+        if subcomponent is not None:
+            subcomponents = value.split('&')
+            value = subcomponents[subcomponent - 1] if subcomponent <= len(subcomponents) else ''
+    return value
+
+
+def make_projection(fields):
+    """
+    Build a function that turns a store row into a list of column values.
+    Field paths are parsed once here, not once per row.
+    """
+    getters = []
+    for name in fields:
+        if name in ROW_COLUMNS:
+            getters.append((ROW_COLUMNS[name], None))
+        else:
+            getters.append((None, parse_field_path(name)))
+    needs_segments = any(path is not None for _, path in getters)
+
+    def project(row):
+        segments = {}
+        if needs_segments:
+            for segment in row[2].split('\r'):
+                name = segment[:3]
+                if name and name not in segments:
+                    segments[name] = segment
+        return [row[column] if path is None else field_value(segments, *path)
+                for column, path in getters]
+
+    return project
+
+
+def export_messages(store, out, fields=DEFAULT_FIELDS, output_format='jsonl', **filters):
+    """
+    Stream matching messages from the store into a text file object.
+
+    :param filters: Passed to MessageStore.iter_messages (message_type,
+                    sending_facility, sending_app, since, until, ...).
+    :return: Number of messages written.
+    """
+    project = make_projection(fields)
+    count = 0
+    if output_format == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(fields)
+        for row in store.iter_messages(**filters):
+            writer.writerow(project(row))
+            count += 1
+    elif output_format == 'jsonl':
+        for row in store.iter_messages(**filters):
+            out.write(json.dumps(dict(zip(fields, project(row))), ensure_ascii=False))
+            out.write('\n')
+            count += 1
+    else:
+        raise ValueError(f"Unsupported export format: {output_format}")
+    return count
+
+
+def field_list(value):
+    """Parse the --fields argument, rejecting any path parse_field_path cannot read."""
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    if not fields:
+        raise argparse.ArgumentTypeError("no fields given")
+    for name in fields:
+        if name not in ROW_COLUMNS:
+            try:
+                parse_field_path(name)
+            except ValueError as e:
+                raise argparse.ArgumentTypeError(str(e))
+    return fields
+
+
+def parse_time(value):
+    """Accept an ISO date/time or a Unix timestamp."""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export stored HL7 messages to JSONL or CSV.")
+    parser.add_argument('output', help="Output file, or - for stdout")
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help="Message store to read")
+    parser.add_argument('--format', choices=['jsonl', 'csv'], help="Defaults to the output file extension")
+    parser.add_argument('--fields', type=field_list, default=DEFAULT_FIELDS,
+                        help="Comma-separated field paths (e.g. MSH-9,PID-5.1) or id, received_at, "
+                             "message, acknowledgment")
+    parser.add_argument('--type', dest='message_type', help="Message type, e.g. ADT or ADT^A01")
+    parser.add_argument('--sender', dest='sending_facility', help="Sending facility (MSH-4)")
+    parser.add_argument('--sending-app', help="Sending application (MSH-3)")
+    parser.add_argument('--since', type=parse_time, help="Received at or after (ISO time or timestamp)")
+    parser.add_argument('--until', type=parse_time, help="Received before (ISO time or timestamp)")
+    args = parser.parse_args()
+
+    output_format = args.format or ('csv' if args.output.endswith('.csv') else 'jsonl')
+    filters = {
+        'message_type': args.message_type,
+        'sending_facility': args.sending_facility,
+        'sending_app': args.sending_app,
+        'since': args.since,
+        'until': args.until,
+    }
+
+    store = MessageStore(args.db)
+    try:
+        if args.output == '-':
+            count = export_messages(store, sys.stdout, args.fields, output_format, **filters)
+        else:
+            with open(args.output, 'w', newline='', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as out:
+                count = export_messages(store, out, args.fields, output_format, **filters)
+    finally:
+        store.close()
+    print(f"Exported {count} messages", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
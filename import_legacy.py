@@ -0,0 +1,116 @@
+"""
+One-shot import of the legacy auto-save file (HL7_messages.hl7) into the
+segmented archive and, optionally, the SQLite message store.
+
+Examples:
+    python import_legacy.py
+    python import_legacy.py old/HL7_messages.hl7 --archive archive --db HL7_messages.db
+"""
+import argparse
+import os
+
+from archive import SegmentedArchive, DEFAULT_ARCHIVE_DIR
+from message_record import MessageRecord, ack_code_of
+from message_store import MessageStore, DEFAULT_DB_PATH
+
+DEFAULT_LEGACY_PATH = 'HL7_messages.hl7'
+IMPORT_BATCH_SIZE = 1000
+
+LEGACY_HEADER = "Received HL7 Message:"
+LEGACY_ACK_HEADER = "Acknowledgment:"
+LEGACY_SEPARATOR = "=" * 40
+
+
+def parse_legacy_file(path):
+    """
+    Yield (message, acknowledgment) for every entry in a legacy auto-save
+    file (the rendered "Received HL7 Message:" text). Segments are rejoined
+    with carriage returns; acknowledgment is None when the entry has none.
+    """
+    message = None
+    acknowledgment = None
+    current = None
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.rstrip('\r\n')
+            if line == LEGACY_HEADER:
+                message, acknowledgment = [], None
+                current = message
+            elif line == LEGACY_ACK_HEADER and message is not None:
+                acknowledgment = []
+                current = acknowledgment
+            elif line == LEGACY_SEPARATOR:
+                if message:
+                    yield join_segments(message), join_segments(acknowledgment)
+                message = acknowledgment = current = None
+            elif current is not None and line:
+                current.append(line)
+    if message:
+        yield join_segments(message), join_segments(acknowledgment)
+
+
+def join_segments(lines):
+    return '\r'.join(lines) + '\r' if lines else None
+
+
+def read_legacy_messages(path):
+    """Yield (None, message) for every message in a legacy file; it carries no receive times."""
+    for message, _ in parse_legacy_file(path):
+        yield None, message
+
+
+def import_legacy_file(path, archive=None, store=None, received_at=None):
+    """
+    Copy every message of a legacy file into the archive and/or store.
+
+    :param received_at: Time recorded for the imported messages; defaults to
+                        the file's modification time.
+    :return: Number of messages imported.
+    """
+    if received_at is None:
+        received_at = os.path.getmtime(path)
+    count = 0
+    batch = []
+    for message, acknowledgment in parse_legacy_file(path):
+        batch.append(MessageRecord(message, acknowledgment, received_at,
+                                   ack_code=ack_code_of(acknowledgment)))
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            count += write_batch(batch, archive, store)
+            batch = []
+    if batch:
+        count += write_batch(batch, archive, store)
+    return count
+
+
+def write_batch(batch, archive, store):
+    if archive is not None:
+        archive.add_messages(batch)
+    if store is not None:
+        store.add_messages(batch)
+    return len(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import the legacy HL7_messages.hl7 file into the archive.")
+    parser.add_argument('source', nargs='?', default=DEFAULT_LEGACY_PATH, help="Legacy auto-save file")
+    parser.add_argument('--archive', default=DEFAULT_ARCHIVE_DIR, help="Archive directory to write")
+    parser.add_argument('--db', help=f"Also insert into this message store (e.g. {DEFAULT_DB_PATH})")
+    parser.add_argument('--force', action='store_true', help="Import even if the archive already has segments")
+    args = parser.parse_args()
+
+    archive = SegmentedArchive(args.archive)
+    store = MessageStore(args.db) if args.db else None
+    try:
+        if archive.list_segments() and not args.force:
+            print(f"{args.archive} already contains messages; use --force to import again")
+            return
+        count = import_legacy_file(args.source, archive, store)
+    finally:
+        archive.close()
+        if store is not None:
+            store.close()
+    print(f"Imported {count} messages from {args.source} into {args.archive}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+import logging
+import mmap
+import os
+import threading
+from array import array
+from bisect import bisect_right
+from contextlib import contextmanager
+from PyQt5.QtCore import (Qt, QAbstractListModel, QModelIndex, QFileSystemWatcher, QTimer, pyqtSignal)
+from log_model import LEVEL_ROLE
+
+# Bytes per sparse index entry: locating a line scans at most this much
+INDEX_BLOCK_SIZE = 64 * 1024
+# Bytes searched between cancellation checks
+SEARCH_CHUNK = 8 * 1024 * 1024
+# Stat polling interval; catches rotation and changes the watcher missed
+POLL_INTERVAL_MS = 1000
+# Decoded lines kept for the rows being painted
+LINE_CACHE_SIZE = 512
+LEVEL_NAMES = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+
+
+class LineIndex:
+    """
+    Sparse line index over a log file.
+
+    Every INDEX_BLOCK_SIZE bytes or so, the index records the offset of a
+    line start and its line number. Building it only counts newlines a
+    block at a time, so it runs at memory speed. Reading line n scans
+    forward from the nearest entry, at most one block.
+
+    The file is not kept open: each indexing step, search chunk and line
+    read opens and maps it for just that pass (see mapped), so the log
+    handler can rename it on rollover, which Windows refuses while it is
+    open or mapped.
+
+    Only complete lines (ending in a newline) are indexed. The index is
+    built by one thread and read by another: `lines` and the entry arrays
+    only grow.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        stat = os.stat(path)
+        self.inode = (stat.st_dev, stat.st_ino)
+        self.size = 0                    # file length at the last indexing step
+        self.offsets = array('q', [0])   # line start offsets...
+        self.line_numbers = array('q', [0])  # ...and their line numbers
+        self.indexed_end = 0             # end of the last complete line indexed
+        self.lines = 0
+
+    @contextmanager
+    def mapped(self):
+        """
+        Map the file for one pass. Yields None when there is nothing to
+        read, or when the path is gone or names another file or a shorter one;
+        the model reopens those on its next check.
+        """
+        try:
+            file = open(self.path, 'rb')
+        except FileNotFoundError:
+            # Renamed by a rollover and not recreated yet
+            yield None
+            return
+        with file:
+            stat = os.fstat(file.fileno())
+            if (stat.st_dev, stat.st_ino) != self.inode or stat.st_size < self.indexed_end \
+                    or stat.st_size == 0:
+                yield None
+                return
+            with mmap.mmap(file.fileno(), stat.st_size, access=mmap.ACCESS_READ) as data:
+                yield data
+
+    def build(self, should_stop=None):
+        """
+        Index the data not indexed yet.
+
+        :param should_stop: Optional callable checked between blocks.
+        :return: Number of lines indexed in total.
+        """
+        with self.mapped() as data:
+            if data is None:
+                return self.lines
+            end = self.size = len(data)
+            position = self.indexed_end
+            lines = self.lines
+            while position < end:
+                if should_stop is not None and should_stop():
+                    break
+                block_end = min(end, position + INDEX_BLOCK_SIZE)
+                last_newline = data.rfind(b'\n', position, block_end)
+                if last_newline < 0:
+                    # A line longer than a block, or an unfinished last line
+                    last_newline = data.find(b'\n', block_end, end)
+                    if last_newline < 0:
+                        break
+                lines += data[position:last_newline + 1].count(b'\n')
+                position = last_newline + 1
+                self.offsets.append(position)
+                self.line_numbers.append(lines)
+                self.indexed_end = position
+                self.lines = lines
+        return self.lines
+
+    def line_offset(self, data, row, hint=None):
+        """
+        Return the byte offset where line `row` starts.
+
+        :param data: The file, from mapped().
+        :param hint: Optional (row, offset) of an earlier line in the same
+                     block, to scan from instead of the block start.
+        """
+        entry = bisect_right(self.line_numbers, row) - 1
+        line_number = self.line_numbers[entry]
+        offset = self.offsets[entry]
+        if hint is not None and line_number <= hint[0] <= row:
+            line_number, offset = hint
+        while line_number < row:
+            offset = data.find(b'\n', offset) + 1
+            line_number += 1
+        return offset
+
+    def line_at_offset(self, data, offset):
+        """Return the line number containing byte `offset`."""
+        entry = bisect_right(self.offsets, offset) - 1
+        return self.line_numbers[entry] + data[self.offsets[entry]:offset].count(b'\n')
+
+    def read_line(self, row, hint=None):
+        """
+        Return (text, offset) of line `row`; text is empty if the file has
+        been replaced.
+        """
+        with self.mapped() as data:
+            if data is None:
+                return "", None
+            offset = self.line_offset(data, row, hint)
+            end = data.find(b'\n', offset)
+            return data[offset:end].rstrip(b'\r').decode('utf-8', errors='replace'), offset
+
+    def search(self, needle, start_row, job=None):
+        """
+        Return the first line at or after `start_row` containing `needle`
+        (lowercase bytes), ignoring ASCII case, or None. Scans forward in
+        chunks, mapping the file for each one, so a SearchJob can cancel it.
+        """
+        end = self.indexed_end
+        position = None if start_row < self.lines else end
+        while position is None or position < end:
+            if job is not None:
+                job.check()
+            with self.mapped() as data:
+                if data is None:
+                    return None
+                if position is None:
+                    position = self.line_offset(data, start_row)
+                    if position >= end:
+                        break
+                chunk_end = min(end, position + SEARCH_CHUNK)
+                # Extend to the end of the line so matches are not cut in two
+                newline = data.find(b'\n', chunk_end - 1, end)
+                chunk_end = end if newline < 0 else newline + 1
+                found = data[position:chunk_end].lower().find(needle)
+                if found >= 0:
+                    return self.line_at_offset(data, position + found)
+            position = chunk_end
+        return None
+
+
+class LogFileModel(QAbstractListModel):
+    """
+    List model over a log file, following it as it grows.
+
+    The file is indexed by a background thread (see LineIndex); rows appear
+    as the index grows, so even a multi-gigabyte file shows at once. Only
+    the rows a view paints are read and decoded.
+
+    Appends are noticed through QFileSystemWatcher (inotify on Linux) and
+    a stat poll, which is also how rotation is detected: when the path
+    names a new file or the file shrinks, the model reopens it.
+    """
+
+    _indexed = pyqtSignal(object, int)
+
+    def __init__(self, path, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.line_index = None
+        self.rows = 0
+        self.cache = {}
+        self.cursor = None   # (row, offset) of the last line read
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.pending = False
+        self.stopping = False
+        self.line_indexer = threading.Thread(target=self.run_indexer, name="LogFileIndexer", daemon=True)
+        self._indexed.connect(self.show_indexed)
+
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.fileChanged.connect(self.check_file)
+        self.poll_timer = QTimer(self)
+        self.poll_timer.setInterval(POLL_INTERVAL_MS)
+        self.poll_timer.timeout.connect(self.check_file)
+
+        self.open_file()
+        self.line_indexer.start()
+        self.poll_timer.start()
+
+    # Qt model interface
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.rows
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, LEVEL_ROLE):
+            return None
+        text = self.line(index.row())
+        if role == Qt.DisplayRole:
+            return text
+        return level_of(text)
+
+    def line(self, row):
+        text = self.cache.get(row)
+        if text is None:
+            text, offset = self.line_index.read_line(row, self.cursor)
+            if offset is None:
+                return text   # replaced; not cached, the next check reopens it
+            self.cursor = (row, offset)
+            if len(self.cache) >= LINE_CACHE_SIZE:
+                self.cache.clear()
+            self.cache[row] = text
+        return text
+
+    # Following the file
+
+    def open_file(self):
+        self.beginResetModel()
+        # Passes still running on the old index finish with their own mapping
+        self.line_index = None
+        self.rows = 0
+        self.cache = {}
+        self.cursor = None
+        try:
+            self.line_index = LineIndex(self.path)
+        except OSError as e:
+            # Missing; the poll tries again
+            logging.debug(f"Cannot open log file {self.path}: {e}")
+        self.endResetModel()
+        if self.line_index is not None:
+            if self.path not in self.watcher.files():
+                self.watcher.addPath(self.path)
+            self.request_indexing()
+
+    def check_file(self, path=None):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return   # rotated away; the new file shows up on a later poll
+        if self.line_index is None or (stat.st_dev, stat.st_ino) != self.line_index.inode \
+                or stat.st_size < self.line_index.indexed_end:
+            self.open_file()
+            return
+        if stat.st_size > self.line_index.size:
+            self.request_indexing()
+        if self.path not in self.watcher.files():
+            # Some editors and rotations replace the file, which drops the watch
+            self.watcher.addPath(self.path)
+
+    def request_indexing(self):
+        with self.lock:
+            self.pending = True
+            self.wakeup.notify()
+
+    def run_indexer(self):
+        while True:
+            with self.lock:
+                while not self.pending and not self.stopping:
+                    self.wakeup.wait()
+                if self.stopping:
+                    return
+                self.pending = False
+                line_index = self.line_index
+            if line_index is None:
+                continue
+            try:
+                # Report progress per step so a long first pass fills the view gradually
+                while not self.stopping:
+                    lines = line_index.lines
+                    line_index.build(lambda: line_index.lines - lines > 100000 or self.stopping)
+                    self._indexed.emit(line_index, line_index.lines)
+                    if line_index.lines == lines:
+                        break   # only an unfinished last line is left
+            except (OSError, ValueError) as e:
+                logging.error(f"Failed to index log file {self.path}: {e}")
+
+    def show_indexed(self, line_index, lines):
+        # A reopen may have replaced the index the count came from
+        if line_index is not self.line_index or lines <= self.rows:
+            return
+        self.beginInsertRows(QModelIndex(), self.rows, lines - 1)
+        self.rows = lines
+        self.endInsertRows()
+
+    # Searching
+
+    def make_search(self, text, start_row):
+        """
+        Return a function for a SearchRunner that finds the next line at or
+        after `start_row` containing `text` (case-insensitive).
+        """
+        line_index = self.line_index
+        needle = text.encode('utf-8').lower()
+        rows = self.rows
+
+        def search(job):
+            if line_index is None:
+                return None
+            row = line_index.search(needle, start_row, job)
+            return row if row is not None and row < rows else None
+        return search
+
+    def close(self):
+        self.poll_timer.stop()
+        with self.lock:
+            self.stopping = True
+            self.wakeup.notify()
+        self.line_indexer.join()
+
+
+def level_of(text):
+    """Level name in a line written with ' - LEVEL - ' separators, or None."""
+    for level in LEVEL_NAMES:
+        if f" - {level} - " in text:
+            return level
+    return None
@@ -0,0 +1,276 @@
+from bisect import bisect_left
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex
+
+# Log lines kept; older lines are overwritten
+DEFAULT_LOG_CAPACITY = 100000
+# Lines checked between cancellation checks while searching
+SEARCH_CHUNK = 10000
+# Role returning a line's level, for the color delegate
+LEVEL_ROLE = Qt.UserRole + 1
+
+
+class SequenceIndex:
+    """
+    Ascending list of log sequence numbers with cheap removal from the front.
+
+    Used for the per-level indexes and for search results. Dropped entries
+    are skipped by moving a head offset; the list is compacted once most of
+    it is dead, so dropping is amortized O(1).
+    """
+
+    def __init__(self, seqs=None):
+        self.seqs = seqs if seqs is not None else []
+        self.head = 0
+
+    def __len__(self):
+        return len(self.seqs) - self.head
+
+    def __getitem__(self, row):
+        return self.seqs[self.head + row]
+
+    def append(self, seq):
+        self.seqs.append(seq)
+
+    def extend(self, seqs):
+        self.seqs.extend(seqs)
+
+    def count_before(self, seq):
+        """Number of entries older than `seq`."""
+        return bisect_left(self.seqs, seq, self.head) - self.head
+
+    def drop_before(self, seq):
+        self.head = bisect_left(self.seqs, seq, self.head)
+        if self.head > 1024 and self.head * 2 > len(self.seqs):
+            del self.seqs[:self.head]
+            self.head = 0
+
+    def snapshot(self):
+        """Copy of the live entries, safe to read on another thread."""
+        return self.seqs[self.head:]
+
+
+class LogBuffer:
+    """
+    Fixed-size ring buffer of (level, message) log lines.
+
+    Every line gets an increasing sequence number; the live lines are
+    first..end-1 and line `seq` sits in slot seq % capacity. Each level
+    keeps a SequenceIndex of its lines, so filtering by level is a lookup.
+
+    Only the GUI thread writes. A search thread may read messages by
+    sequence number: `first` is advanced before a slot is overwritten, so a
+    reader that checks `seq >= first` after reading a slot knows whether
+    what it read was still that line.
+    """
+
+    def __init__(self, capacity=DEFAULT_LOG_CAPACITY):
+        self.capacity = capacity
+        self.levels = [None] * capacity
+        self.messages = [None] * capacity
+        self.first = 0
+        self.end = 0
+        self.level_index = {}
+
+    def __len__(self):
+        return self.end - self.first
+
+    def level_at(self, seq):
+        return self.levels[seq % self.capacity]
+
+    def message_at(self, seq):
+        return self.messages[seq % self.capacity]
+
+    def index_for(self, level):
+        index = self.level_index.get(level)
+        if index is None:
+            index = self.level_index[level] = SequenceIndex()
+        return index
+
+    def drop_before(self, seq):
+        """Forget every line older than `seq`."""
+        if seq <= self.first:
+            return
+        self.first = seq
+        for index in self.level_index.values():
+            index.drop_before(seq)
+
+    def extend(self, entries):
+        """
+        Append (level, message) lines. The caller makes room first with
+        drop_before; lines beyond the capacity overwrite the oldest.
+        """
+        capacity = self.capacity
+        if self.end + len(entries) - self.first > capacity:
+            self.drop_before(self.end + len(entries) - capacity)
+        levels = self.levels
+        messages = self.messages
+        level_index = self.level_index
+        seq = self.end
+        for level, message in entries:
+            slot = seq % capacity
+            levels[slot] = level
+            messages[slot] = message
+            index = level_index.get(level)
+            if index is None:
+                index = self.index_for(level)
+            index.seqs.append(seq)
+            seq += 1
+        self.end = seq
+
+    def clear(self):
+        self.drop_before(self.end)
+        self.level_index = {}
+
+
+class LogListModel(QAbstractListModel):
+    """
+    List model over a LogBuffer, optionally filtered by level and text.
+
+    Unfiltered, row i is line first + i. With a level filter the rows are
+    that level's index in the buffer; with search text they are a
+    SequenceIndex of matches, computed by `search` (which may run on a
+    worker thread) and installed by `apply_search`. New lines are matched
+    as they are appended, so a filtered view stays live.
+
+    All changes to the buffer go through append_logs and clear so rows are
+    inserted and removed in one batch per call.
+    """
+
+    def __init__(self, capacity=DEFAULT_LOG_CAPACITY, parent=None):
+        super().__init__(parent)
+        self.buffer = LogBuffer(capacity)
+        self.level = None        # None shows every level
+        self.search_text = ''
+        self.matches = None      # SequenceIndex of matching lines while searching
+
+    # Qt model interface
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        rows = self.rows()
+        return len(self.buffer) if rows is None else len(rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            seq = self.seq_at(index.row())
+            return f"[{self.buffer.level_at(seq)}] {self.buffer.message_at(seq)}"
+        if role == LEVEL_ROLE:
+            return self.buffer.level_at(self.seq_at(index.row()))
+        return None
+
+    def rows(self):
+        # The SequenceIndex behind the rows, or None when every line is shown
+        if self.matches is not None:
+            return self.matches
+        if self.level is not None:
+            return self.buffer.index_for(self.level)
+        return None
+
+    def seq_at(self, row):
+        rows = self.rows()
+        return self.buffer.first + row if rows is None else rows[row]
+
+    # Appending
+
+    def append_logs(self, entries):
+        """
+        Append a batch of (level, message) lines, dropping the oldest lines
+        beyond the buffer's capacity.
+        """
+        if not entries:
+            return
+        buffer = self.buffer
+        entries = entries[-buffer.capacity:]
+        new_first = max(buffer.first, buffer.end + len(entries) - buffer.capacity)
+        rows = self.rows()
+        removed = new_first - buffer.first if rows is None else rows.count_before(new_first)
+        if removed:
+            self.beginRemoveRows(QModelIndex(), 0, removed - 1)
+        buffer.drop_before(new_first)
+        if self.matches is not None:
+            self.matches.drop_before(new_first)
+        if removed:
+            self.endRemoveRows()
+
+        start = buffer.end
+        if rows is None:
+            added = len(entries)
+        elif self.matches is not None:
+            new_matches = [start + offset for offset, (level, message) in enumerate(entries)
+                           if self.line_matches(level, message)]
+            added = len(new_matches)
+        else:
+            added = sum(1 for level, _ in entries if level == self.level)
+        count = self.rowCount()
+        if added:
+            self.beginInsertRows(QModelIndex(), count, count + added - 1)
+        buffer.extend(entries)
+        if self.matches is not None:
+            self.matches.extend(new_matches)
+        if added:
+            self.endInsertRows()
+
+    def line_matches(self, level, message):
+        return (self.level is None or level == self.level) and self.search_text in message.lower()
+
+    def clear(self):
+        self.beginResetModel()
+        self.buffer.clear()
+        if self.matches is not None:
+            self.matches = SequenceIndex()
+        self.endResetModel()
+
+    # Filtering
+
+    def set_level(self, level):
+        """Show only one level (None for all); a level lookup, no scan."""
+        self.beginResetModel()
+        self.level = level
+        self.search_text = ''
+        self.matches = None
+        self.endResetModel()
+
+    def make_search(self, level, search_text):
+        """
+        Capture what a search needs on the GUI thread and return a function
+        that runs it, for a SearchRunner.
+        """
+        buffer = self.buffer
+        if level is None:
+            seqs = range(buffer.first, buffer.end)
+        else:
+            seqs = buffer.index_for(level).snapshot()
+        end = buffer.end
+        return lambda job: (level, search_text, end, self.search(seqs, search_text, job))
+
+    def search(self, seqs, search_text, job=None):
+        """Return the sequence numbers in `seqs` whose message contains search_text."""
+        buffer = self.buffer
+        messages = buffer.messages
+        capacity = buffer.capacity
+        matches = []
+        for start in range(0, len(seqs), SEARCH_CHUNK):
+            if job is not None:
+                job.check()
+            for seq in seqs[start:start + SEARCH_CHUNK]:
+                # Read the slot before checking it still holds this line
+                if search_text in messages[seq % capacity].lower() and seq >= buffer.first:
+                    matches.append(seq)
+        return matches
+
+    def apply_search(self, result):
+        """Show the result of a search made by make_search."""
+        level, search_text, end, matches = result
+        self.beginResetModel()
+        self.level = level
+        self.search_text = search_text
+        self.matches = SequenceIndex(matches)
+        # Lines appended while the search ran
+        buffer = self.buffer
+        self.matches.extend(seq for seq in range(max(end, buffer.first), buffer.end)
+                            if self.line_matches(buffer.level_at(seq), buffer.message_at(seq)))
+        self.matches.drop_before(buffer.first)
+        self.endResetModel()
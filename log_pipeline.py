@@ -0,0 +1,239 @@
+import hashlib
+import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+# Records waiting for the listener thread; when full, new records are dropped
+DEFAULT_QUEUE_SIZE = 10000
+# Formatted lines waiting for the GUI; when full, new lines are dropped
+DEFAULT_MAX_PENDING = 50000
+# Deliveries to the GUI per second, and lines per delivery
+DEFAULT_LOG_RATE = 10
+DEFAULT_MAX_BATCH = 5000
+VIEWER_FORMAT = '%(asctime)s - %(message)s'
+# Log files use the engine's stderr format, which the file viewer parses levels from
+FILE_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+DEFAULT_LOG_FILE_BYTES = 100 * 1024 * 1024
+DEFAULT_LOG_FILE_BACKUPS = 5
+# Characters of a body's SHA-256 shown in place of the body
+DIGEST_LENGTH = 12
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler that never blocks the thread that logs: when the queue is
+    full the record is dropped and counted instead. Records are queued
+    unformatted, so arguments are only turned into text on the listener
+    thread.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # QueueHandler formats the message here, on the thread that logs;
+        # the listener's handlers format it instead
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Called under the handler's lock, so the count is exact
+            self.dropped += 1
+
+
+class LogPump(QObject):
+    """
+    Delivers log records from any thread to the GUI in batches.
+
+    install() routes the root logger through a DroppingQueueHandler. A
+    QueueListener thread then passes each record to the handlers that were
+    on the root logger (e.g. stderr) and to this pump, so a thread that
+    logs only pays for queuing the record. The pump collects
+    (level, text) lines and emits them through ``batch_ready`` at most
+    ``max_rate`` times per second, up to ``max_batch`` lines each time.
+    When the GUI falls behind, lines beyond ``max_pending`` are dropped and
+    counted; the next batch reports how many were lost.
+
+    The delivery timer only runs while lines are waiting.
+    """
+
+    batch_ready = pyqtSignal(list)
+    _wake = pyqtSignal()
+
+    def __init__(self, max_rate=DEFAULT_LOG_RATE, max_batch=DEFAULT_MAX_BATCH,
+                 max_pending=DEFAULT_MAX_PENDING, queue_size=DEFAULT_QUEUE_SIZE, parent=None):
+        super().__init__(parent)
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.queue_handler = DroppingQueueHandler(queue.Queue(queue_size))
+        self.collector = LogCollector(self)
+        self.collector.setFormatter(logging.Formatter(VIEWER_FORMAT))
+        self.logger = None
+        self.listener = None
+        self.moved_handlers = []
+
+        self.lock = threading.Lock()
+        self.pending = []
+        self.timer = QTimer(self)
+        self.timer.setInterval(max(1, int(1000 / max_rate)))
+        self.timer.timeout.connect(self.flush)
+        self._wake.connect(self.start_timer)
+
+        # Metrics
+        self.delivered = 0
+        self.dropped_pending = 0
+        self.reported_drops = 0
+
+    def install(self, logger=None):
+        """Route `logger` (the root logger by default) through the pump."""
+        logger = logger if logger is not None else logging.getLogger()
+        self.moved_handlers = [handler for handler in logger.handlers
+                               if not isinstance(handler, QueueHandler)]
+        for handler in self.moved_handlers:
+            logger.removeHandler(handler)
+        logger.addHandler(self.queue_handler)
+        self.listener = QueueListener(self.queue_handler.queue, self.collector, *self.moved_handlers,
+                                      respect_handler_level=True)
+        self.listener.start()
+        self.logger = logger
+
+    def uninstall(self):
+        """Stop the listener after it has handled the queued records, and restore the handlers."""
+        if self.listener is None:
+            return
+        self.logger.removeHandler(self.queue_handler)
+        self.listener.stop()
+        self.listener = None
+        for handler in self.moved_handlers:
+            self.logger.addHandler(handler)
+        self.moved_handlers = []
+
+    def add_line(self, level, text):
+        # Runs on the listener thread
+        with self.lock:
+            if len(self.pending) >= self.max_pending:
+                self.dropped_pending += 1
+                return
+            self.pending.append((level, text))
+            wake = len(self.pending) == 1
+        if wake:
+            self._wake.emit()
+
+    def start_timer(self):
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def queue_depth(self):
+        """Records and lines waiting, for the dashboard."""
+        return self.queue_handler.queue.qsize() + len(self.pending)
+
+    def dropped(self):
+        """Records lost so far, at the queue and at the GUI."""
+        return self.queue_handler.dropped + self.dropped_pending
+
+    def flush(self):
+        """Emit up to max_batch of the waiting lines."""
+        with self.lock:
+            batch = self.pending[:self.max_batch]
+            del self.pending[:self.max_batch]
+        dropped = self.dropped()
+        if dropped > self.reported_drops:
+            batch.append(("WARNING", f"{dropped - self.reported_drops} log records dropped "
+                                     f"because the log view fell behind"))
+            self.reported_drops = dropped
+        if not batch:
+            # Nothing arrived during the last interval; the next line restarts the timer
+            self.timer.stop()
+            return
+        self.delivered += len(batch)
+        self.batch_ready.emit(batch)
+
+
+class LogCollector(logging.Handler):
+    """Handler run by the listener thread; passes formatted lines to a LogPump."""
+
+    def __init__(self, pump):
+        super().__init__()
+        self.pump = pump
+
+    def emit(self, record):
+        try:
+            text = self.format(record).replace('\r', ' ').replace('\n', ' ')
+            self.pump.add_line(record.levelname, text)
+        except Exception:
+            self.handleError(record)
+
+
+def add_log_file(path, max_bytes=DEFAULT_LOG_FILE_BYTES, backup_count=DEFAULT_LOG_FILE_BACKUPS, logger=None):
+    """
+    Also write `logger` (the root logger by default) to a rotating log file.
+    Call before LogPump.install so the file is written by the listener thread.
+
+    :return: The RotatingFileHandler.
+    """
+    handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+    handler.setFormatter(logging.Formatter(FILE_FORMAT))
+    (logger if logger is not None else logging.getLogger()).addHandler(handler)
+    return handler
+
+
+class LogSampler:
+    """
+    Decides which occurrences of frequent events are logged.
+
+    An event is logged on one occurrence in `every`, and at most
+    `per_second` times a second (a token bucket with a one second burst).
+    Skipped occurrences are counted so the next line that is logged can
+    say how many were left out. Not thread-safe; meant for the thread that
+    handles the events, e.g. the server's event loop.
+    """
+
+    def __init__(self, every=1, per_second=10):
+        self.every = every
+        self.per_second = per_second
+        # event -> [occurrences, skipped since last logged, tokens, last refill]
+        self.events = {}
+
+    def allow(self, event):
+        """
+        Record an occurrence of `event`.
+
+        :return: None when it should not be logged, otherwise the number of
+                 occurrences skipped since it was last logged.
+        """
+        now = time.monotonic()
+        state = self.events.get(event)
+        if state is None:
+            state = self.events[event] = [0, 0, float(self.per_second), now]
+        state[0] += 1
+        state[2] = min(self.per_second, state[2] + (now - state[3]) * self.per_second)
+        state[3] = now
+        if (state[0] - 1) % self.every or state[2] < 1:
+            state[1] += 1
+            return None
+        state[2] -= 1
+        skipped = state[1]
+        state[1] = 0
+        return skipped
+
+
+class BodyDigest:
+    """
+    Log argument standing in for a message body: formats as a short
+    SHA-256 of it, so the body can be told apart without being shown.
+    The hash is only computed if the line is actually formatted.
+    """
+
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+    def __str__(self):
+        return hashlib.sha256(self.text.encode('utf-8')).hexdigest()[:DIGEST_LENGTH]
@@ -1,9 +1,34 @@
-from PyQt5.QtWidgets import QWidget, QVBoxLayout, QTextEdit, QLineEdit, QPushButton, QComboBox
-from PyQt5.QtGui import QColor
+import os
+from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QTableView, QLineEdit, QPushButton, QComboBox,
+                             QStyledItemDelegate, QAbstractItemView, QHeaderView, QFileDialog)
+from PyQt5.QtGui import QColor, QPalette
+from background_search import SearchRunner
+from log_model import LogListModel, LEVEL_ROLE, DEFAULT_LOG_CAPACITY
+from log_file_reader import LogFileModel
+
+LEVEL_COLORS = {
+    "INFO": QColor("blue"),
+    "WARNING": QColor("orange"),
+    "ERROR": QColor("red"),
+}
+DEFAULT_COLOR = QColor("black")
+
+
+class LogLevelDelegate(QStyledItemDelegate):
+    """Paints each log line in its level's color."""
+
+    def initStyleOption(self, option, index):
+        super().initStyleOption(option, index)
+        option.palette.setColor(QPalette.Text, LEVEL_COLORS.get(index.data(LEVEL_ROLE), DEFAULT_COLOR))
+
 
 class LogViewerTab(QWidget):
-    def __init__(self):
+    def __init__(self, capacity=DEFAULT_LOG_CAPACITY, log_file=None):
         super().__init__()
+        # Engine log file offered by "Open Log File..."; a LogFileModel
+        # replaces the live lines while a file is open
+        self.log_file = log_file
+        self.file_model = None
 
         # Create layout
         layout = QVBoxLayout(self)
@@ -18,66 +43,175 @@ class LogViewerTab(QWidget):
         self.log_level_filter.addItems(["All", "INFO", "WARNING", "ERROR"])
         layout.addWidget(self.log_level_filter)
 
-        # Create log display
-        self.log_display = QTextEdit()
-        self.log_display.setReadOnly(True)
+        # Create log display. The last `capacity` lines are kept in a ring
+        # buffer and the view only paints the rows on screen. Fixed row
+        # heights keep inserting and scrolling independent of the line count.
+        self.log_model = LogListModel(capacity, self)
+        self.log_display = QTableView()
+        self.log_display.setModel(self.log_model)
+        self.log_display.setItemDelegate(LogLevelDelegate(self.log_display))
+        self.log_display.setShowGrid(False)
+        self.log_display.setWordWrap(False)
+        self.log_display.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.log_display.setVerticalScrollMode(QAbstractItemView.ScrollPerItem)
+        self.log_display.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.log_display.verticalHeader().setDefaultSectionSize(self.log_display.fontMetrics().height() + 4)
+        self.log_display.verticalHeader().hide()
+        self.log_display.horizontalHeader().setStretchLastSection(True)
+        self.log_display.horizontalHeader().hide()
+        self.following = True
+        self.log_display.verticalScrollBar().valueChanged.connect(self.check_following)
+        self.log_display.verticalScrollBar().rangeChanged.connect(self.follow_new_logs)
         layout.addWidget(self.log_display)
 
-        # Create clear logs button
+        # Create clear logs and log file buttons
+        buttons = QHBoxLayout()
         self.clear_button = QPushButton("Clear Logs")
         self.clear_button.clicked.connect(self.clear_logs)
-        layout.addWidget(self.clear_button)
+        self.open_file_button = QPushButton("Open Log File...")
+        self.open_file_button.clicked.connect(self.open_log_file)
+        self.live_button = QPushButton("Live Logs")
+        self.live_button.clicked.connect(self.show_live_logs)
+        self.live_button.setEnabled(False)
+        buttons.addWidget(self.clear_button)
+        buttons.addWidget(self.open_file_button)
+        buttons.addWidget(self.live_button)
+        layout.addLayout(buttons)
 
-        # Connect search bar and log level filter to update logs
+        # Connect search bar and log level filter to update logs. Level
+        # filtering is an index lookup; text searches run on a worker thread
+        # and are restarted by every change.
+        # In a log file, searching finds the next matching line instead;
+        # Enter moves on to the match after the selected line.
+        self.search_runner = SearchRunner(parent=self)
+        self.search_runner.finished.connect(self.show_search_result)
         self.search_bar.textChanged.connect(self.filter_logs)
-        self.log_level_filter.currentTextChanged.connect(self.filter_logs)
-
-        # Store all logs
-        self.logs = self.get_all_logs()
+        self.search_bar.returnPressed.connect(self.find_next)
+        self.log_level_filter.currentTextChanged.connect(self.filter_logs_now)
 
     def append_log(self, level, message):
         # Add log with level and message
-        color = {
-            "INFO": QColor("blue"),
-            "WARNING": QColor("orange"),
-            "ERROR": QColor("red")
-        }.get(level, QColor("black"))
-        formatted_message = f"[{level}] {message}"
-        self.logs.append({"level": level, "message": message})
-        self.display_logs()
+        self.log_model.append_logs([(level, message)])
+
+    def append_logs(self, entries):
+        # Add a batch of (level, message) lines, e.g. from a LogPump
+        self.log_model.append_logs(entries)
+
+    def check_following(self, value):
+        # Keep the newest line in view unless the user has scrolled up. New
+        # rows only move the scroll bar's maximum, so this sees user scrolls.
+        self.following = value >= self.log_display.verticalScrollBar().maximum() - 1
+
+    def follow_new_logs(self, minimum, maximum):
+        # The range is updated after the rows are laid out, so this also
+        # follows rows that arrive in quick succession
+        if self.following:
+            self.log_display.verticalScrollBar().setValue(maximum)
 
     def filter_logs(self):
-        # Display filtered logs
-        self.display_logs()
+        # Debounced while typing; the previous search is cancelled
+        if self.file_model is not None:
+            self.find_in_file(self.current_row())
+        elif self.search_bar.text():
+            self.search_runner.request(self.make_filter())
+        else:
+            self.display_logs()
 
-    def display_logs(self):
-        # Clear current display
-        self.log_display.clear()
+    def filter_logs_now(self):
+        if self.file_model is not None:
+            return   # log files are shown unfiltered
+        if self.search_bar.text():
+            self.search_runner.request_now(self.make_filter())
+        else:
+            self.display_logs()
 
-        # Implement filtering based on search and log level
-        search_text = self.search_bar.text().lower()
+    def current_level(self):
         log_level = self.log_level_filter.currentText()
+        return None if log_level == "All" else log_level
+
+    def make_filter(self):
+        return self.log_model.make_search(self.current_level(), self.search_bar.text().lower())
 
-        # Filter and display logs
-        for log in self.logs:
-            if (search_text in log['message'].lower()) and (log_level == "All" or log['level'] == log_level):
-                color = {
-                    "INFO": QColor("blue"),
-                    "WARNING": QColor("orange"),
-                    "ERROR": QColor("red")
-                }.get(log['level'], QColor("black"))
-                formatted_message = f"[{log['level']}] {log['message']}"
-                self.log_display.append(f'<font color="{color.name()}">{formatted_message}</font>')
+    def display_logs(self):
+        # Filter synchronously, dropping any search still in progress
+        self.search_runner.cancel()
+        search_text = self.search_bar.text().lower()
+        if search_text:
+            self.show_filtered_logs(self.make_filter()(None))
+        else:
+            self.log_model.set_level(self.current_level())
+        self.log_display.scrollToBottom()
+
+    def show_search_result(self, result):
+        if self.file_model is not None:
+            self.show_found_line(result)
+        else:
+            self.show_filtered_logs(result)
+
+    def show_filtered_logs(self, result):
+        self.log_model.apply_search(result)
+        self.log_display.scrollToBottom()
 
     def clear_logs(self):
         # Clear the log display and logs list
-        self.log_display.clear()
-        self.logs = []
-
-    def get_all_logs(self):
-        # Placeholder function to return all logs
-        # You should replace this with the actual method to retrieve logs
-        return [
-            {"level": "INFO", "message": "Server started"},
-            {"level": "ERROR", "message": "Failed to connect"}
-        ]
+        self.search_runner.cancel()
+        self.log_model.clear()
+
+    # Log files
+
+    def open_log_file(self, path=None):
+        if not path:
+            start = os.path.dirname(os.path.abspath(self.log_file)) if self.log_file else ""
+            path, _ = QFileDialog.getOpenFileName(self, "Open Log File", start, "Log Files (*.log*);;All Files (*)")
+            if not path:
+                return
+        self.search_runner.cancel()
+        self.close_log_file()
+        self.file_model = LogFileModel(path, self)
+        self.following = True
+        self.log_display.setModel(self.file_model)
+        self.log_level_filter.setEnabled(False)
+        self.clear_button.setEnabled(False)
+        self.live_button.setEnabled(True)
+        self.search_bar.setPlaceholderText(f"Find in {os.path.basename(path)}...")
+
+    def show_live_logs(self):
+        self.search_runner.cancel()
+        self.log_display.setModel(self.log_model)
+        self.close_log_file()
+        self.log_level_filter.setEnabled(True)
+        self.clear_button.setEnabled(True)
+        self.live_button.setEnabled(False)
+        self.search_bar.setPlaceholderText("Search logs...")
+        self.display_logs()
+
+    def close_log_file(self):
+        if self.file_model is not None:
+            self.file_model.close()
+            self.file_model.deleteLater()
+            self.file_model = None
+
+    def current_row(self):
+        current = self.log_display.currentIndex()
+        return current.row() if current.isValid() else 0
+
+    def find_next(self):
+        if self.file_model is not None:
+            self.find_in_file(self.current_row() + 1, now=True)
+
+    def find_in_file(self, start_row, now=False):
+        # Scans forward from start_row on the worker; a new search stops it
+        text = self.search_bar.text()
+        if not text:
+            self.search_runner.cancel()
+        elif now:
+            self.search_runner.request_now(self.file_model.make_search(text, start_row))
+        else:
+            self.search_runner.request(self.file_model.make_search(text, start_row))
+
+    def show_found_line(self, row):
+        if row is None:
+            return
+        index = self.file_model.index(row)
+        self.log_display.setCurrentIndex(index)
+        self.log_display.scrollTo(index, QAbstractItemView.PositionAtCenter)
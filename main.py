@@ -1,3 +1,5 @@
+import json
+import logging
 import sys
 from PyQt5.QtWidgets import QApplication, QMainWindow, QTabWidget, QWidget, QVBoxLayout, QPushButton, QTextEdit
 from dashboard import DashboardTab
@@ -6,6 +8,11 @@ from message_receiver import MessageReceiverTab
 from log_viewer import LogViewerTab
 from settings import SettingsTab
 from tcp_server import HL7Server
+from message_store import MessageStore
+from archive import SegmentedArchive
+from durable_queue import DurableQueue
+from ui_batcher import UpdateCoalescer, DEFAULT_MAX_UI_RATE
+from log_pipeline import LogPump, add_log_file
 
 class HL7IntegrationGUI(QMainWindow):
     def __init__(self):
@@ -20,11 +27,24 @@ class HL7IntegrationGUI(QMainWindow):
         # Create a vertical layout for the central widget
         layout = QVBoxLayout(central_widget)
 
-        # Initialize HL7 server
-        self.server = HL7Server()
+        # Open the message history store
+        self.store = MessageStore()
+
+        # Raw messages are also kept in a rolling, compressed archive
+        self.archive = SegmentedArchive()
+
+        # Accepted messages are written to a disk queue before they are ACKed
+        self.intake_queue = DurableQueue()
 
-        # integrate tcp listenner with main application to pass messages to message_receiver tab
-        self.server.message_received.connect(self.received_message_display)
+        # Initialize HL7 server
+        self.server = HL7Server(store=self.store, archive=self.archive, intake_queue=self.intake_queue)
+
+        # integrate tcp listenner with main application; the server persists
+        # messages and reports every stored batch. Reports are coalesced so
+        # the message_receiver tab refreshes at a bounded rate.
+        self.ui_updates = UpdateCoalescer(self.load_max_ui_rate(), self)
+        self.server.messages_stored.connect(self.ui_updates.push)
+        self.ui_updates.batch_ready.connect(self.received_message_display)
         self.server.status_changed.connect(self.update_status)
 
         # Create a tab widget and add it to the layout
@@ -37,10 +57,19 @@ class HL7IntegrationGUI(QMainWindow):
         self.create_message_receiver_tab()
         self.create_log_viewer_tab()
         self.create_settings_tab()
-        
+
+        # Show the engine's logging in the Logs tab. Records are queued by
+        # the thread that logs and handed to the tab in rate-limited batches.
+        if self.log_file:
+            add_log_file(self.log_file)
+        self.log_pump = LogPump(parent=self)
+        self.log_pump.batch_ready.connect(self.log_viewer_tab.append_logs)
+        self.log_pump.install()
+        self.dashboard_tab.add_queue("Log queue", self.log_pump.queue_depth,
+                                     self.log_pump.queue_handler.queue.maxsize + self.log_pump.max_pending)
       
     def create_dashboard_tab(self):
-        self.dashboard_tab = DashboardTab()
+        self.dashboard_tab = DashboardTab(self.server)
         self.tabs.addTab(self.dashboard_tab, "Dashboard")
 
     def create_message_sender_tab(self):
@@ -48,11 +77,12 @@ class HL7IntegrationGUI(QMainWindow):
         self.tabs.addTab(self.message_sender_tab, "Send Message")
 
     def create_message_receiver_tab(self):
-        self.message_receiver_tab = MessageReceiverTab()
+        self.message_receiver_tab = MessageReceiverTab(self.store)
         self.tabs.addTab(self.message_receiver_tab, "Received Messages")
 
     def create_log_viewer_tab(self):
-        self.log_viewer_tab = LogViewerTab()
+        self.log_file = self.load_log_file()
+        self.log_viewer_tab = LogViewerTab(log_file=self.log_file)
         self.tabs.addTab(self.log_viewer_tab, "Logs")
 
     def create_settings_tab(self):
@@ -63,15 +93,36 @@ class HL7IntegrationGUI(QMainWindow):
     def update_status(self, status_message):
         self.dashboard_tab.update_status(status_message)
 
-    def received_message_display(self, message):
-        self.message_receiver_tab.add_message(message)
+    def received_message_display(self, counts):
+        self.message_receiver_tab.show_stored_messages(sum(counts))
+
+    def load_max_ui_rate(self):
+        # Optional "max_ui_rate" (updates per second) in settings.json
+        try:
+            with open("settings.json", "r") as file:
+                rate = float(json.load(file).get("max_ui_rate", DEFAULT_MAX_UI_RATE))
+        except (OSError, ValueError, AttributeError):
+            return DEFAULT_MAX_UI_RATE
+        return rate if rate > 0 else DEFAULT_MAX_UI_RATE
+
+    def load_log_file(self):
+        # Optional "log_file" in settings.json: the engine also logs to this
+        # rotating file, which the Logs tab can open and follow
+        try:
+            with open("settings.json", "r") as file:
+                return json.load(file).get("log_file") or None
+        except (OSError, ValueError, AttributeError):
+            return None
 
     def add_log_entry(self, entry):
-        self.log_viewer_tab.add_log_entry(entry)  
+        logging.info(entry)
 
     def closeEvent(self, event):
-        if self.server.is_listening():
-            self.server.stop_server()
+        self.server.shutdown()
+        self.log_pump.uninstall()
+        self.log_viewer_tab.close_log_file()
+        self.store.close()
+        self.archive.close()
         event.accept()    
 
 if __name__ == "__main__":
@@ -0,0 +1,115 @@
+"""
+Measure how many bytes the Received Messages view holds per message, for
+the old tuple rows and for CompactMessage rows, plain and compressed,
+using tracemalloc.
+
+Examples:
+    python measure_memory.py
+    python measure_memory.py --db HL7_messages.db --count 50000
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+from datetime import datetime
+
+from message_record import CompactMessage, Interner, ack_code_of
+from body_codec import BodyCodec
+from message_store import MessageStore, parse_index_fields
+
+SAMPLE_TYPES = ['ADT^A01', 'ADT^A04', 'ADT^A08', 'ORU^R01', 'ORM^O01']
+SAMPLE_FACILITIES = ['LAB', 'RADIOLOGY', 'WARD_A', 'WARD_B', 'PHARMACY', 'ER']
+SAMPLE_RESULTS = [('718-7', 'Hemoglobin', 13, 'g/dL'), ('4544-3', 'Hematocrit', 40, '%'),
+                  ('6690-2', 'Leukocytes', 7, '10*3/uL'), ('777-3', 'Platelets', 250, '10*3/uL'),
+                  ('789-8', 'Erythrocytes', 4, '10*6/uL'), ('787-2', 'MCV', 90, 'fL')]
+
+
+def synthetic_rows(count):
+    """Yield (id, received_at, message, acknowledgment) rows like the store returns."""
+    now = time.time()
+    for i in range(count):
+        message_type = SAMPLE_TYPES[i % len(SAMPLE_TYPES)]
+        facility = SAMPLE_FACILITIES[i % len(SAMPLE_FACILITIES)]
+        message = (
+            f"MSH|^~\\&|HIS|{facility}|HL7_INTERFACE|HOSPITAL|20240101{i % 240000:06d}||"
+            f"{message_type}|MSG{i:08d}|P|2.5.1\r"
+            f"EVN|{message_type.split('^')[1]}|20240101120000\r"
+            f"PID|1||{100000 + i}^^^HOSP^MR||Doe^John^Q||19800101|M|||1 Main St^^Town^ST^12345\r"
+            f"PV1|1|I|WARD^101^1\r"
+        )
+        if message_type == 'ORU^R01':
+            message += f"OBR|1|{i}|{i}|CBC^Complete Blood Count^L|||20240101120000\r"
+            for n, (code, name, value, units) in enumerate(SAMPLE_RESULTS, 1):
+                message += f"OBX|{n}|NM|{code}^{name}^LN||{value + i % 7}|{units}|||||F\r"
+        acknowledgment = (
+            f"MSH|^~\\&|HL7_INTERFACE|HOSPITAL|HIS|{facility}|20240101120000||ACK|MSG{i:08d}|P|2.5.1\r"
+            f"MSA|AA|MSG{i:08d}\r"
+        )
+        yield i + 1, now + i, message, acknowledgment
+
+
+def store_rows(path, count):
+    store = MessageStore(path)
+    try:
+        yield from store.query_messages(limit=count)
+    finally:
+        store.close()
+
+
+def tuple_row(message_id, received_at, message, acknowledgment):
+    # Row layout used before CompactMessage: the texts plus a tuple of the
+    # displayed column strings
+    fields = parse_index_fields(message)
+    summary = (
+        datetime.fromtimestamp(received_at).strftime('%Y-%m-%d %H:%M:%S'),
+        fields['message_type'] or '',
+        fields['control_id'] or '',
+        fields['sending_app'] or '',
+        fields['sending_facility'] or '',
+        ack_code_of(acknowledgment) or '',
+    )
+    return message_id, received_at, message, acknowledgment, summary
+
+
+def measure(make_rows, build):
+    """
+    Build one row per source row and return the traced bytes held per row.
+    The source strings are allocated while tracing, as a store fetch would.
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    held = [build(*row) for row in make_rows()]
+    gc.collect()
+    held_bytes = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    return held_bytes / len(held) if held else 0.0, len(held)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure bytes per message held by the message view rows.")
+    parser.add_argument('--db', help="Measure messages from this store instead of synthetic ones")
+    parser.add_argument('--count', type=int, default=100000, help="Number of messages")
+    args = parser.parse_args()
+
+    if args.db:
+        make_rows = lambda: store_rows(args.db, args.count)
+    else:
+        make_rows = lambda: synthetic_rows(args.count)
+
+    before, count = measure(make_rows, tuple_row)
+    interner = Interner()
+    after, _ = measure(make_rows, lambda *row: CompactMessage(*row, interner))
+    codec = BodyCodec()
+    compressed, _ = measure(make_rows, lambda *row: CompactMessage(*row, interner, codec))
+    print(f"Messages measured: {count}")
+    print(f"Tuple rows:          {before:8.1f} bytes/message")
+    print(f"CompactMessage rows: {after:8.1f} bytes/message")
+    print(f"Compressed rows:     {compressed:8.1f} bytes/message (bodies at {codec.ratio() * 100:.0f}%)")
+    if before:
+        print(f"Saved:               {before - compressed:8.1f} bytes/message "
+              f"({(1 - compressed / before) * 100:.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
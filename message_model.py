@@ -0,0 +1,331 @@
+import logging
+from datetime import datetime
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, pyqtSignal
+from message_record import CompactMessage, Interner, ACK_CODE_NAMES
+from body_codec import BodyCodec
+from background_search import SearchRunner
+
+COLUMNS = ["Received", "Type", "Control ID", "Sending App", "Sending Facility", "ACK"]
+
+
+# Resident rows are capped by count and by message bytes; rows beyond the
+# cap are dropped from memory and fetched from the store again when needed.
+# Bodies are held compressed, so the byte cap is usually the one reached.
+DEFAULT_MAX_ROWS = 60000
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+# Rough per-row cost of a CompactMessage besides the message text
+ROW_OVERHEAD_BYTES = 100
+
+
+class MessageListModel(QAbstractTableModel):
+    """
+    Newest-first list of received messages, fetched a page at a time.
+
+    Only the rows a view scrolls to are loaded: Qt calls fetchMore when the
+    view reaches the end, which pages further back through the store by id.
+    Messages stored after the model was filled are inserted at the top by
+    fetch_newer; with a full-text search filter that query runs on a
+    worker thread, one at a time. When the store is empty but the archive
+    is not (e.g. after importing a legacy file), pages come from the
+    archive instead.
+
+    The loaded rows are a bounded window over the store. Every message is
+    in the store before the model sees it, so rows evicted to stay within
+    max_rows/max_bytes are simply dropped: from the bottom when new rows
+    arrive at the top, from the top when the view pages further back. The
+    view calls fetch_newer_page to bring evicted top rows back.
+    """
+
+    # Rows were inserted (+) or removed (-) above the current rows, so a
+    # view can keep its scroll position
+    rows_shifted = pyqtSignal(int)
+
+    def __init__(self, store, archive_reader=None, page_size=500, max_rows=DEFAULT_MAX_ROWS,
+                 max_bytes=DEFAULT_MAX_BYTES, codec=None, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.archive_reader = archive_reader
+        self.page_size = page_size
+        self.max_rows = max(max_rows, 2 * page_size)
+        self.max_bytes = max_bytes
+        self.filters = {}
+        # Rows are CompactMessages whose key is the store id, or the archive
+        # position for archive rows. Header values are interned model-wide
+        # and large bodies are held compressed by the codec.
+        self.rows = []
+        self.interner = Interner()
+        self.codec = codec if codec is not None else BodyCodec()
+        self.resident_bytes = 0
+        self.use_archive = False
+        self.exhausted = True        # nothing older than the last row
+        self.newer_available = False # rows newer than the first row were evicted
+        self.newer_runner = SearchRunner(debounce_ms=0, parent=self)
+        self.newer_runner.finished.connect(self.finish_newer)
+        self.fetching_newer = False  # a fetch_newer query is on the worker
+        self.newer_requested = False # and another is to follow it
+
+    # Qt model interface
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            return self.column_text(self.rows[index.row()], index.column())
+        return None
+
+    def column_text(self, row, column):
+        # Computed on demand: only visible cells are ever asked for
+        if column == 0:
+            return datetime.fromtimestamp(row.received_at).strftime('%Y-%m-%d %H:%M:%S')
+        if column == 1:
+            return self.interner.value(row.message_type) or ''
+        if column == 2:
+            return row.control_id()
+        if column == 3:
+            return self.interner.value(row.sending_app) or ''
+        if column == 4:
+            return self.interner.value(row.sending_facility) or ''
+        return ACK_CODE_NAMES.get(row.ack_code) or ''
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return COLUMNS[section]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.exhausted:
+            return
+        page = self.fetch_older()
+        if page:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+            self.rows.extend(page)
+            self.resident_bytes += sum(row_bytes(row) for row in page)
+            self.endInsertRows()
+            self.evict_newest()
+
+    # Loading
+
+    def set_filters(self, message_type=None, search=None):
+        """Apply new filters and reload from the newest message."""
+        self.apply_first_page(self.load_first_page({'message_type': message_type, 'search': search}))
+
+    def load_first_page(self, filters, job=None):
+        """
+        Query the newest page for a set of filters without touching the
+        model, so it can run on a SearchRunner worker thread.
+
+        :param job: SearchJob; a newer search interrupts the query.
+        :return: Tuple of (filters, rows, exhausted). rows is None when the
+                 store is empty and the archive should be shown instead.
+        """
+        if job is not None:
+            job.on_cancel(self.store.connection().interrupt)
+        unfiltered = not any(filters.values())
+        if unfiltered and self.archive_reader is not None and not self.store.query_messages(limit=1):
+            return filters, None, False
+        rows = self.store.query_messages(limit=self.page_size, **filters)
+        if job is not None:
+            job.check()
+        return filters, [self.make_row(*row) for row in rows], len(rows) < self.page_size
+
+    def apply_first_page(self, result):
+        """Replace the model's contents with a result of load_first_page."""
+        filters, rows, exhausted = result
+        self.beginResetModel()
+        self.filters = filters
+        # A fetch_newer still running is for the old contents; its result is
+        # dropped, and new rows are fetched afresh from the new first page
+        self.fetching_newer = False
+        self.newer_requested = False
+        self.use_archive = False
+        self.newer_available = False
+        self.rows = []
+        self.exhausted = False
+        if rows is None:
+            self.archive_reader.refresh()
+            self.use_archive = self.archive_reader.count() > 0
+            rows = self.fetch_older()
+        else:
+            self.exhausted = exhausted
+        self.rows = rows
+        self.resident_bytes = sum(row_bytes(row) for row in rows)
+        self.endResetModel()
+
+    def fetch_older(self):
+        """Return the next page of rows older than the oldest loaded one."""
+        if self.use_archive:
+            position = self.rows[-1].key if self.rows else self.archive_reader.end_position()
+            records, start = self.archive_reader.page_before(position, self.page_size)
+            self.exhausted = start <= self.archive_reader.first_position()
+            return [self.make_row(start + offset, record.received_at, record.message, record.acknowledgment)
+                    for offset, record in reversed(list(enumerate(records)))]
+
+        before_id = self.rows[-1].key if self.rows else None
+        rows = self.store.query_messages(limit=self.page_size, before_id=before_id, **self.filters)
+        self.exhausted = len(rows) < self.page_size
+        return [self.make_row(*row) for row in rows]
+
+    def fetch_newer(self):
+        """Insert messages stored since the model was filled at the top."""
+        if self.use_archive:
+            # The store has started receiving messages; show those instead
+            self.apply_first_page(self.load_first_page(self.filters))
+            return
+        if self.newer_available:
+            # The top of the list is not loaded; new rows come in with it
+            return
+        newest_id = self.rows[0].key if self.rows else 0
+        if not self.filters.get('search'):
+            self.apply_newer(self.load_newer(self.filters, newest_id))
+        elif self.fetching_newer:
+            # Batches keep arriving; the one running is not cancelled, or
+            # it might never finish
+            self.newer_requested = True
+        else:
+            # Full-text queries grow with the store, so they stay off the GUI thread
+            self.fetching_newer = True
+            filters = self.filters
+            self.newer_runner.request_now(lambda job: self.load_newer(filters, newest_id, job))
+
+    def load_newer(self, filters, newest_id, job=None):
+        """
+        Query the rows stored after `newest_id` without touching the model,
+        so it can run on a worker thread.
+
+        :return: Tuple of (filters, newest_id, rows, first_page). When there
+                 are more than a page of new rows, rows is None and
+                 first_page is the load_first_page result to show instead.
+        """
+        try:
+            rows = self.store.query_messages(limit=self.page_size + 1, after_id=newest_id, **filters)
+            if len(rows) > self.page_size:
+                # Too many to insert one by one; start again from the newest page
+                return filters, newest_id, None, self.load_first_page(filters, job)
+            return filters, newest_id, [self.make_row(*row) for row in rows], None
+        except Exception as e:
+            if job is None:
+                raise
+            # Returned rather than raised so finish_newer still runs and
+            # clears fetching_newer; the next batch tries again
+            logging.error(f"Failed to fetch new messages: {e}")
+            return filters, newest_id, [], None
+
+    def finish_newer(self, result):
+        requested = self.newer_requested
+        self.fetching_newer = False
+        self.newer_requested = False
+        self.apply_newer(result)
+        if requested:
+            self.fetch_newer()
+
+    def apply_newer(self, result):
+        """Insert a result of load_newer at the top, unless the model has moved on since."""
+        filters, newest_id, rows, first_page = result
+        if filters is not self.filters or self.use_archive or self.newer_available \
+                or newest_id != (self.rows[0].key if self.rows else 0):
+            return
+        if first_page is not None:
+            self.apply_first_page(first_page)
+        elif rows:
+            self.insert_at_top(rows)
+
+    def fetch_newer_page(self):
+        """Bring back the page of rows right above the first loaded row, after eviction."""
+        if not self.newer_available or not self.rows:
+            return
+        newest = self.rows[0].key
+        if self.use_archive:
+            start = max(newest + 1, self.archive_reader.first_position())
+            stop = min(self.archive_reader.end_position(), start + self.page_size)
+            records = self.archive_reader.read_range(start, stop)
+            start = max(start, self.archive_reader.first_position())
+            page = [self.make_row(start + offset, record.received_at, record.message,
+                                  record.acknowledgment)
+                    for offset, record in reversed(list(enumerate(records)))]
+            self.newer_available = stop < self.archive_reader.end_position()
+        else:
+            rows = self.store.query_messages(limit=self.page_size, after_id=newest, oldest_first=True,
+                                             **self.filters)
+            page = [self.make_row(*row) for row in reversed(rows)]
+            self.newer_available = len(rows) == self.page_size
+        if page:
+            self.insert_at_top(page)
+
+    def insert_at_top(self, page):
+        self.beginInsertRows(QModelIndex(), 0, len(page) - 1)
+        self.rows[0:0] = page
+        self.resident_bytes += sum(row_bytes(row) for row in page)
+        self.endInsertRows()
+        self.rows_shifted.emit(len(page))
+        self.evict_oldest()
+
+    def over_capacity(self):
+        return len(self.rows) > self.max_rows or self.resident_bytes > self.max_bytes
+
+    def evict_oldest(self):
+        # Drop rows from the bottom; fetchMore loads them again
+        if not self.over_capacity():
+            return
+        keep = len(self.rows)
+        size = self.resident_bytes
+        while keep > self.page_size and (keep > self.max_rows or size > self.max_bytes):
+            keep -= 1
+            size -= row_bytes(self.rows[keep])
+        if keep == len(self.rows):
+            return
+        self.beginRemoveRows(QModelIndex(), keep, len(self.rows) - 1)
+        del self.rows[keep:]
+        self.resident_bytes = size
+        self.endRemoveRows()
+        self.exhausted = False
+
+    def evict_newest(self):
+        # Drop rows from the top; fetch_newer_page loads them again
+        if not self.over_capacity():
+            return
+        drop = 0
+        size = self.resident_bytes
+        while len(self.rows) - drop > self.page_size and \
+                (len(self.rows) - drop > self.max_rows or size > self.max_bytes):
+            size -= row_bytes(self.rows[drop])
+            drop += 1
+        if not drop:
+            return
+        self.beginRemoveRows(QModelIndex(), 0, drop - 1)
+        del self.rows[:drop]
+        self.resident_bytes = size
+        self.endRemoveRows()
+        self.newer_available = True
+        self.rows_shifted.emit(-drop)
+
+    def make_row(self, key, received_at, message, acknowledgment):
+        return CompactMessage(key, received_at, message, acknowledgment, self.interner, self.codec)
+
+    def message_at(self, row):
+        """Return (message, acknowledgment) of a row."""
+        row = self.rows[row]
+        return row.message, row.acknowledgment
+
+    def iter_messages(self):
+        """Yield (message, acknowledgment) for every message matching the filters, oldest first."""
+        if self.use_archive:
+            end = self.archive_reader.end_position()
+            for start in range(self.archive_reader.first_position(), end, self.page_size):
+                for record in self.archive_reader.read_range(start, min(end, start + self.page_size)):
+                    yield record.message, record.acknowledgment
+            return
+        for _, _, message, acknowledgment in self.store.iter_messages(**self.filters):
+            yield message, acknowledgment
+
+
+def row_bytes(row):
+    return row.size() + ROW_OVERHEAD_BYTES
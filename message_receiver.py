@@ -1,13 +1,27 @@
-from PyQt5.QtWidgets import QWidget, QVBoxLayout, QTextEdit, QComboBox, QLineEdit, QFileDialog
+import os
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QComboBox, QLineEdit, QFileDialog, QPushButton,
+                             QTableView, QPlainTextEdit, QSplitter, QAbstractItemView, QHeaderView, QTreeView,
+                             QTabWidget)
+from message_store import MessageStore, MESSAGE_CODE, MESSAGE_TYPE
+from message_model import MessageListModel, DEFAULT_MAX_ROWS, DEFAULT_MAX_BYTES
+from message_tree_model import MessageTreeModel
+from archive import DEFAULT_ARCHIVE_DIR
+from archive_reader import ArchiveReader
+from import_legacy import import_legacy_file
+from background_search import SearchRunner
 
 class MessageReceiverTab(QWidget):
-    def __init__(self, parent=None):
+    def __init__(self, store=None, archive_directory=DEFAULT_ARCHIVE_DIR, max_rows=DEFAULT_MAX_ROWS,
+                 max_bytes=DEFAULT_MAX_BYTES, parent=None):
         super().__init__(parent)
         layout = QVBoxLayout()
 
-        # Add filter for message type
+        # Add filter for message type; the options are the message types
+        # received so far (see refresh_type_filter)
         self.filter_box = QComboBox()
-        self.filter_box.addItems(["All", "ADT", "ORM", "ORU"])
+        self.filter_box.addItem("All", None)
+        self.type_filter_version = None
         self.filter_box.currentIndexChanged.connect(self.filter_messages)
 
         # Add search bar for content search
@@ -18,92 +32,208 @@ class MessageReceiverTab(QWidget):
         layout.addWidget(self.filter_box)
         layout.addWidget(self.search_bar)
 
-        # Display for received messages
-        self.received_message_display = QTextEdit()
-        self.received_message_display.setPlaceholderText("Received HL7 Messages will appear here")
-        layout.addWidget(self.received_message_display)
+        # Message history lives in the store; the model keeps a bounded
+        # window of it in memory (max_rows / max_bytes) and loads pages as
+        # the list is scrolled, so only visible rows cost anything
+        self.store = store if store is not None else MessageStore()
+        self.page_size = 500
+        self.archive_reader = ArchiveReader(archive_directory)
+        self.message_model = MessageListModel(self.store, self.archive_reader, self.page_size,
+                                              max_rows, max_bytes)
+        self.message_model.rows_shifted.connect(self.keep_scroll_position)
+        self.paging_up = False
+        self.refresh_type_filter()
+
+        # Filter changes are queried on a worker thread; a newer change
+        # cancels the query still running and only its result is shown
+        self.search_runner = SearchRunner(parent=self)
+        self.search_runner.finished.connect(self.show_search_result)
+
+        # List of received messages, newest first
+        self.message_view = QTableView()
+        self.message_view.setModel(self.message_model)
+        self.message_view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.message_view.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.message_view.setWordWrap(False)
+        self.message_view.setVerticalScrollMode(QAbstractItemView.ScrollPerItem)
+        self.message_view.verticalScrollBar().valueChanged.connect(self.scrolled)
+        # Fixed row heights let the view skip measuring rows it does not show
+        self.message_view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.message_view.verticalHeader().setDefaultSectionSize(
+            self.message_view.fontMetrics().height() + 6)
+        self.message_view.verticalHeader().hide()
+        self.message_view.horizontalHeader().setStretchLastSection(True)
+        self.message_view.selectionModel().currentRowChanged.connect(self.show_selected_message)
+
+        # Structure of the selected message: segments, fields, components and
+        # subcomponents, split only as they are expanded
+        self.message_tree_model = MessageTreeModel(self)
+        self.message_tree = QTreeView()
+        self.message_tree.setModel(self.message_tree_model)
+        self.message_tree.setUniformRowHeights(True)
+        self.message_tree.setWordWrap(False)
+        self.message_tree.header().resizeSection(0, 160)
+
+        # Full text of the selected message, filled in when its tab is shown
+        self.message_detail = QPlainTextEdit()
+        self.message_detail.setReadOnly(True)
+        self.message_detail.setPlaceholderText("Select a message to see its content")
+        self.detail_text = None
+
+        self.detail_tabs = QTabWidget()
+        self.detail_tabs.addTab(self.message_tree, "Structure")
+        self.detail_tabs.addTab(self.message_detail, "Text")
+        self.detail_tabs.currentChanged.connect(self.show_detail_text)
+
+        splitter = QSplitter(Qt.Vertical)
+        splitter.addWidget(self.message_view)
+        splitter.addWidget(self.detail_tabs)
+        splitter.setStretchFactor(0, 3)
+        splitter.setStretchFactor(1, 2)
+        layout.addWidget(splitter)
+
+        self.save_button = QPushButton("Save Messages As...")
+        self.save_button.clicked.connect(self.save_messages_as)
+        layout.addWidget(self.save_button)
 
         self.setLayout(layout)
 
-        # Store messages
-        self.messages = []
-
-        # Define the path for the auto-save file
+        # Legacy auto-save file; new messages are kept in the store and archive
         self.auto_save_path = 'HL7_messages.hl7'
 
         # load and display auto-saved messages
         self.load_auto_saved_messages()
 
     def add_message(self, message, acknowledgment=None):
-        # Store messages and update display
-        self.messages.append((message, acknowledgment))
-        self.update_display()
-        self.auto_save_messages()  # Automatically save messages after adding
+        # Store the message and insert it at the top of the list
+        self.store.add_message(message, acknowledgment)
+        self.message_model.fetch_newer()
+
+    def show_stored_messages(self, count):
+        # Called after the server's writer has stored a batch of `count` messages
+        self.refresh_type_filter()
+        self.message_model.fetch_newer()
+
+    def scrolled(self, value):
+        # Rows evicted from the top come back when the list is scrolled up to them
+        if value == self.message_view.verticalScrollBar().minimum() and self.message_model.newer_available:
+            self.paging_up = True
+            try:
+                self.message_model.fetch_newer_page()
+            finally:
+                self.paging_up = False
+
+    def keep_scroll_position(self, delta):
+        # Rows were added or removed above the visible ones; scroll by the
+        # same amount so the user keeps looking at the same messages. At the
+        # very top, new messages should come into view instead.
+        scroll_bar = self.message_view.verticalScrollBar()
+        if scroll_bar.value() > 0 or self.paging_up:
+            scroll_bar.setValue(scroll_bar.value() + delta)
+
+    def refresh_type_filter(self):
+        # Offer every message code (ADT) and full type (ADT^A01) seen so far
+        if self.store.symbols_version == self.type_filter_version:
+            return
+        self.type_filter_version = self.store.symbols_version
+        values = {value for value, _ in self.store.observed_values(MESSAGE_CODE)}
+        values.update('^'.join(value.split('^')[:2])
+                      for value, _ in self.store.observed_values(MESSAGE_TYPE) if '^' in value)
+        current = self.filter_box.currentData()
+        self.filter_box.blockSignals(True)
+        self.filter_box.clear()
+        self.filter_box.addItem("All", None)
+        for value in sorted(values):
+            self.filter_box.addItem(value, value)
+        self.filter_box.setCurrentIndex(max(0, self.filter_box.findData(current)))
+        self.filter_box.blockSignals(False)
 
     def filter_messages(self):
-        self.update_display()
+        self.search_runner.request_now(self.make_search())
 
     def search_messages(self):
-        self.update_display()
+        # Debounced: typing restarts the timer instead of starting a query
+        self.search_runner.request(self.make_search())
+
+    def make_search(self):
+        filters = self.current_filters()
+        return lambda job: self.message_model.load_first_page(filters, job)
+
+    def current_filters(self):
+        search_query = self.search_bar.text()
+        return {
+            'message_type': self.filter_box.currentData(),
+            'search': search_query or None,
+        }
+
+    def show_search_result(self, result):
+        self.message_model.apply_first_page(result)
+        self.clear_detail()
 
     def update_display(self):
-        self.received_message_display.clear()
-        filter_type = self.filter_box.currentText()
-        search_query = self.search_bar.text().lower()
-
-        for message, acknowledgment in self.messages:
-            if filter_type != "All" and filter_type not in message:
-                continue
-            if search_query and search_query not in message.lower():
-                continue
-            
-            self.received_message_display.append(f"Received HL7 Message:\n{message}\n")
-            if acknowledgment:
-                self.received_message_display.append(f"Acknowledgment:\n{acknowledgment}\n")
-            self.received_message_display.append("\n" + "="*40 + "\n")  # Separator for different messages
-
-    def auto_save_messages(self):
-        # Automatically save messages to the defined file path
-        try:
-            # Get the text from QTextEdit widget
-            text_to_save = self.received_message_display.toPlainText()
-
-            # Write the text to the auto-save file
-            with open(self.auto_save_path, 'w') as file:
-                file.write(text_to_save)
-                
-            print(f"Messages automatically saved to {self.auto_save_path}")
-        except Exception as e:
-            print(f"Failed to automatically save messages: {e}")
+        # Reload synchronously, dropping any search still in progress
+        self.search_runner.cancel()
+        self.message_model.set_filters(**self.current_filters())
+        self.clear_detail()
+
+    def show_selected_message(self, current, previous=None):
+        if not current.isValid():
+            self.clear_detail()
+            return
+        message, acknowledgment = self.message_model.message_at(current.row())
+        self.message_tree_model.set_message(message)
+        # Laying out the text of a large message is slow, so it waits
+        # until the Text tab is looked at
+        self.detail_text = (message, acknowledgment)
+        self.message_detail.clear()
+        self.show_detail_text()
+
+    def show_detail_text(self):
+        if self.detail_text is not None and self.detail_tabs.currentWidget() is self.message_detail:
+            self.message_detail.setPlainText(self.format_message(*self.detail_text))
+            self.detail_text = None
+
+    def clear_detail(self):
+        self.message_tree_model.set_message("")
+        self.message_detail.clear()
+        self.detail_text = None
+
+    def format_message(self, message, acknowledgment=None):
+        # One segment per line
+        message = message.rstrip('\r').replace('\r', '\n')
+        text = f"Received HL7 Message:\n{message}\n"
+        if acknowledgment:
+            acknowledgment = acknowledgment.rstrip('\r').replace('\r', '\n')
+            text += f"\nAcknowledgment:\n{acknowledgment}\n"
+        text += "\n" + "="*40 + "\n"  # Separator for different messages
+        return text
 
     # add save as method as needed
     def save_messages_as(self):
-        # Allow the user to manually save messages to a chosen file path
+        # Save every message matching the current filter, not just the loaded rows
         try:
             options = QFileDialog.Options()
             file_path, _ = QFileDialog.getSaveFileName(self, "Save Messages As", "", "HL7 Files (*.hl7);;All Files (*)", options=options)
-            
-            if file_path:
-                # Get the text from QTextEdit widget
-                text_to_save = self.received_message_display.toPlainText()
 
-                # Write the text to the chosen file path
+            if file_path:
+                count = 0
                 with open(file_path, 'w') as file:
-                    file.write(text_to_save)
-                
-                print(f"Messages manually saved to {file_path}")
+                    for message, acknowledgment in self.message_model.iter_messages():
+                        file.write(self.format_message(message, acknowledgment) + "\n")
+                        count += 1
+
+                print(f"{count} messages manually saved to {file_path}")
         except Exception as e:
             print(f"Failed to manually save messages: {e}")
 
     def load_auto_saved_messages(self):
-        # Load and display messages from the auto-save file
+        # Nothing stored or archived yet: bring in the legacy auto-save file once
         try:
-            with open(self.auto_save_path, 'r') as file:
-                saved_text = file.read()
-                self.received_message_display.setPlainText(saved_text)
-            
-            print(f"Loaded messages from {self.auto_save_path}")
-        except FileNotFoundError:
-            print(f"No auto-save file found at {self.auto_save_path}")
+            if not self.store.query_messages(limit=1) and self.archive_reader.count() == 0 \
+                    and os.path.exists(self.auto_save_path):
+                count = import_legacy_file(self.auto_save_path, store=self.store)
+                print(f"Imported {count} messages from {self.auto_save_path}")
+                self.refresh_type_filter()
         except Exception as e:
-            print(f"Failed to load messages: {e}")
\ No newline at end of file
+            print(f"Failed to load messages: {e}")
+        self.update_display()
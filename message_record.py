@@ -0,0 +1,156 @@
+import struct
+import threading
+import time
+
+
+class MessageRecord:
+    """One received HL7 message and what happened when it was acknowledged."""
+
+    def __init__(self, message, acknowledgment=None, received_at=None, acked_at=None,
+                 ack_code=None, peer=None, stats=()):
+        self.message = message
+        self.acknowledgment = acknowledgment
+        self.received_at = received_at if received_at is not None else time.time()
+        self.acked_at = acked_at
+        self.ack_code = ack_code
+        self.peer = peer
+        # PeerStats of the sources it came from, told when it has been stored
+        self.stats = stats
+
+    def size(self):
+        """Approximate payload size, used for batching."""
+        return len(self.message) + (len(self.acknowledgment) if self.acknowledgment else 0)
+
+
+def ack_code_of(acknowledgment):
+    """Return MSA-1 of an ACK, or None."""
+    for segment in (acknowledgment or '').split('\r'):
+        if segment.startswith('MSA|'):
+            return segment.split('|')[1] or None
+    return None
+
+
+class Interner:
+    """Maps repeated strings (senders, message types, ...) to small integer ids and back."""
+
+    def __init__(self):
+        self.values = [None]  # id 0 means "not present"
+        self.ids = {}
+        self.shared_values = {}
+        self.lock = threading.Lock()
+
+    def id_for(self, value):
+        if not value:
+            return 0
+        symbol_id = self.ids.get(value)
+        if symbol_id is None:
+            # Rows may be built on a search worker thread as well as the GUI thread
+            with self.lock:
+                symbol_id = self.ids.get(value)
+                if symbol_id is None:
+                    symbol_id = len(self.values)
+                    self.values.append(value)
+                    self.ids[value] = symbol_id
+        return symbol_id
+
+    def value(self, symbol_id):
+        return self.values[symbol_id]
+
+    def shared(self, value):
+        """Return the one copy kept of a hashable value equal to `value`."""
+        with self.lock:
+            return self.shared_values.setdefault(value, value)
+
+
+# MSH fields kept as interned ids: name -> index after splitting on '|'
+# (MSH-1 is the separator itself, so MSH-n is at index n - 1)
+HEADER_FIELDS = {
+    'sending_app': 2,          # MSH-3
+    'sending_facility': 3,     # MSH-4
+    'receiving_app': 4,        # MSH-5
+    'receiving_facility': 5,   # MSH-6
+    'message_type': 8,         # MSH-9
+    'version': 11,             # MSH-12
+}
+CONTROL_ID_INDEX = 9           # MSH-10
+
+# ACK codes as small integers
+ACK_CODES = {None: 0, 'AA': 1, 'AE': 2, 'AR': 3, 'CA': 4, 'CE': 5, 'CR': 6}
+ACK_CODE_NAMES = {number: code for code, number in ACK_CODES.items()}
+
+# CompactMessage layout: key and received_at, then the message and ACK
+# joined by the MLLP end block, which neither can contain
+ROW_PREFIX = struct.Struct('<qd')
+ACK_SEPARATOR = b'\x1c'
+
+
+def header_field(index):
+    return property(lambda row: row.header[index])
+
+
+class CompactMessage:
+    """
+    Memory-lean form of a received message for holding many in memory.
+
+    Everything but the header values lives in one bytes object: the key and
+    received_at as a ROW_PREFIX struct, then the UTF-8 message and ACK
+    joined by ACK_SEPARATOR, packed by the BodyCodec when there is one. The
+    MSH header values and the ACK code are kept as a tuple of interned ids
+    that rows with the same header share. Text is decoded only when it is
+    asked for.
+    """
+
+    __slots__ = ('raw', 'codec', 'header')
+
+    # The HEADER_FIELDS ids, in order, then the ACK code
+    sending_app, sending_facility, receiving_app, receiving_facility, message_type, version, ack_code = \
+        (header_field(index) for index in range(len(HEADER_FIELDS) + 1))
+
+    def __init__(self, key, received_at, message, acknowledgment, interner, codec=None):
+        self.codec = codec
+        body = message.encode('utf-8')
+        if acknowledgment:
+            body += ACK_SEPARATOR + acknowledgment.encode('utf-8')
+        prefix = ROW_PREFIX.pack(key, received_at)
+        self.raw = codec.pack(body, prefix) if codec is not None else prefix + body
+        msh = message[:message.find('\r')] if '\r' in message else message
+        fields = msh.split('|') if msh.startswith('MSH') else []
+        header = tuple(interner.id_for(fields[index] if index < len(fields) else None)
+                       for index in HEADER_FIELDS.values())
+        self.header = interner.shared(header + (ACK_CODES.get(ack_code_of(acknowledgment), 0),))
+
+    def body(self):
+        if self.codec is not None:
+            return self.codec.unpack(self.raw, ROW_PREFIX.size)
+        return self.raw[ROW_PREFIX.size:]
+
+    @property
+    def key(self):
+        return ROW_PREFIX.unpack_from(self.raw)[0]
+
+    @property
+    def received_at(self):
+        return ROW_PREFIX.unpack_from(self.raw)[1]
+
+    @property
+    def message(self):
+        body = self.body()
+        end = body.find(ACK_SEPARATOR)
+        return body[:end if end >= 0 else len(body)].decode('utf-8')
+
+    @property
+    def acknowledgment(self):
+        body = self.body()
+        end = body.find(ACK_SEPARATOR)
+        return body[end + 1:].decode('utf-8') if end >= 0 else None
+
+    def control_id(self):
+        """Return MSH-10, read from the raw bytes."""
+        raw = self.body()
+        end = raw.find(b'\r')
+        fields = raw[:end if end >= 0 else len(raw)].split(b'|')
+        return fields[CONTROL_ID_INDEX].decode('utf-8') if len(fields) > CONTROL_ID_INDEX else ''
+
+    def size(self):
+        """Bytes of message and ACK held, compressed where they are."""
+        return len(self.raw)
@@ -55,7 +55,13 @@ class MessageSenderTab(QWidget):
             QMessageBox.warning(self, "Invalid Port", "Please enter a valid port number (0-65535).")
             return
 
-        settings = {"ip": ip, "port": port}
+        # Keep any other settings stored in the file
+        try:
+            with open("settings.json", "r") as file:
+                settings = json.load(file)
+        except (OSError, ValueError):
+            settings = {}
+        settings.update({"ip": ip, "port": port})
         with open("settings.json", "w") as file:
             json.dump(settings, file)
 
@@ -0,0 +1,467 @@
+import re
+import sqlite3
+import threading
+from collections import Counter
+
+from message_record import MessageRecord
+
+DEFAULT_DB_PATH = 'HL7_messages.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    received_at REAL NOT NULL,
+    message_type TEXT,
+    control_id TEXT,
+    sending_app TEXT,
+    sending_facility TEXT,
+    patient_id TEXT,
+    message TEXT NOT NULL,
+    acknowledgment TEXT,
+    type_id INTEGER,
+    event_id INTEGER,
+    facility_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_messages_control_id ON messages (control_id);
+CREATE INDEX IF NOT EXISTS idx_messages_patient_id ON messages (patient_id);
+CREATE INDEX IF NOT EXISTS idx_messages_received_at ON messages (received_at);
+CREATE TABLE IF NOT EXISTS symbols (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (kind, value)
+);
+"""
+
+# Filters go through interned ids. Index entries are ordered by rowid
+# within a key, so "newest messages of type X" is an index walk, no sort.
+# The (type_id, event_id) index serves "ADT^A01"; (type_id) alone keeps
+# "ADT" in id order.
+ID_INDEX_SCHEMA = """
+CREATE INDEX IF NOT EXISTS idx_messages_type_id ON messages (type_id);
+CREATE INDEX IF NOT EXISTS idx_messages_type_event ON messages (type_id, event_id);
+CREATE INDEX IF NOT EXISTS idx_messages_facility_id ON messages (facility_id);
+DROP INDEX IF EXISTS idx_messages_type;
+DROP INDEX IF EXISTS idx_messages_facility;
+"""
+
+# Symbol kinds
+MESSAGE_TYPE = 'message_type'          # full MSH-9, e.g. ADT^A01 (listed, not filtered on)
+MESSAGE_CODE = 'message_code'          # MSH-9.1, e.g. ADT
+TRIGGER_EVENT = 'trigger_event'        # MSH-9.2, e.g. A01
+SENDING_FACILITY = 'sending_facility'  # MSH-4
+
+MIGRATION_BATCH_SIZE = 10000
+
+# Full-text index over message content. The unicode61 tokenizer already
+# splits on the HL7 delimiters (| ^ ~ \ &), and the prefix indexes keep
+# short prefix queries fast. Triggers keep it in step with the messages table.
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE messages_fts USING fts5(
+    message, content='messages', content_rowid='id', prefix='2 3'
+);
+CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, message) VALUES (new.id, new.message);
+END;
+CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, message) VALUES ('delete', old.id, old.message);
+END;
+INSERT INTO messages_fts (messages_fts) VALUES ('rebuild');
+"""
+
+SEARCH_TOKEN = re.compile(r'\w+')
+
+
+def build_fts_query(search):
+    """
+    Turn search bar text into an FTS5 query: every word must appear, and the
+    words match as prefixes ("doe jo" finds "Doe^John").
+
+    :return: The query string, or None if the text has no searchable words.
+    """
+    tokens = SEARCH_TOKEN.findall(search)
+    if not tokens:
+        return None
+    return ' AND '.join(f'"{token}"*' for token in tokens)
+
+
+def parse_index_fields(message):
+    """
+    Extract the header fields the store indexes on.
+
+    :param message: The HL7 message as a string.
+    :return: Dictionary with message_type (MSH-9), message_code (MSH-9.1),
+             trigger_event (MSH-9.2), control_id (MSH-10), sending_app (MSH-3),
+             sending_facility (MSH-4) and patient_id (PID-3).
+    """
+    fields = {
+        'message_type': None,
+        'message_code': None,
+        'trigger_event': None,
+        'control_id': None,
+        'sending_app': None,
+        'sending_facility': None,
+        'patient_id': None,
+    }
+    for segment in message.strip().split('\r'):
+        if segment.startswith("MSH"):
+            msh_fields = segment.split('|')
+            if len(msh_fields) > 9:
+                fields['sending_app'] = msh_fields[2] or None
+                fields['sending_facility'] = msh_fields[3] or None
+                fields['message_type'] = msh_fields[8] or None
+                components = msh_fields[8].split('^')
+                fields['message_code'] = components[0] or None
+                fields['trigger_event'] = (components[1] if len(components) > 1 else None) or None
+                fields['control_id'] = msh_fields[9] or None
+        elif segment.startswith("PID"):
+            pid_fields = segment.split('|')
+            if len(pid_fields) > 3:
+                # Keep the ID number of the first identifier repetition
+                patient_id = pid_fields[3].split('~')[0].split('^')[0]
+                fields['patient_id'] = patient_id or None
+            break
+    return fields
+
+
+class MessageStore:
+    """
+    Queryable history of received HL7 messages kept in SQLite (WAL mode).
+
+    Every thread gets its own connection, so the GUI can read while the
+    receive pipeline is writing.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+        # Interned symbol ids, (kind, value) -> id. symbols_version changes
+        # whenever a value seen for the first time has been committed, so
+        # a reader that sees the new version also sees the new symbol.
+        self._symbol_ids = {}
+        self._symbols_lock = threading.Lock()
+        self.symbols_version = 0
+
+        connection = self.connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+        self.load_symbols(connection)
+        self.add_symbol_columns(connection)
+        connection.executescript(ID_INDEX_SCHEMA)
+        self.full_text = self.create_full_text_index(connection)
+
+    def load_symbols(self, connection):
+        with self._symbols_lock:
+            for symbol_id, kind, value in connection.execute("SELECT id, kind, value FROM symbols"):
+                self._symbol_ids[(kind, value)] = symbol_id
+
+    def add_symbol_columns(self, connection):
+        # Databases created before symbols were interned lack the id
+        # columns; add and fill them once
+        columns = {row[1] for row in connection.execute("PRAGMA table_info(messages)")}
+        if 'type_id' not in columns:
+            for column in ('type_id', 'event_id', 'facility_id'):
+                connection.execute(f"ALTER TABLE messages ADD COLUMN {column} INTEGER")
+            connection.commit()
+        last_id = 0
+        while True:
+            rows = connection.execute(
+                "SELECT id, message FROM messages WHERE type_id IS NULL AND id > ? ORDER BY id LIMIT ?",
+                (last_id, MIGRATION_BATCH_SIZE)).fetchall()
+            if not rows:
+                break
+            with connection:
+                counts = Counter()
+                updates = []
+                for message_id, message in rows:
+                    ids = self.intern_fields(connection, parse_index_fields(message), counts)
+                    # 0 marks "no type" so the row is not picked up again
+                    updates.append((ids[0] or 0, ids[1], ids[2], message_id))
+                connection.executemany(
+                    "UPDATE messages SET type_id = ?, event_id = ?, facility_id = ? WHERE id = ?", updates)
+                self.add_symbol_counts(connection, counts)
+            self.publish_symbols()
+            last_id = rows[-1][0]
+
+    def intern(self, connection, kind, value):
+        """Return the id of a symbol, adding it inside the caller's transaction if it is new."""
+        if not value:
+            return None
+        symbol_id = self._symbol_ids.get((kind, value))
+        if symbol_id is not None:
+            return symbol_id
+        with self._symbols_lock:
+            connection.execute("INSERT OR IGNORE INTO symbols (kind, value) VALUES (?, ?)", (kind, value))
+            symbol_id = connection.execute(
+                "SELECT id FROM symbols WHERE kind = ? AND value = ?", (kind, value)).fetchone()[0]
+            self._symbol_ids[(kind, value)] = symbol_id
+        # Published by publish_symbols once the transaction has committed
+        self._local.new_symbols = getattr(self._local, 'new_symbols', 0) + 1
+        return symbol_id
+
+    def publish_symbols(self, committed=True):
+        """Count the symbols this thread added in its last transaction in symbols_version."""
+        new_symbols = getattr(self._local, 'new_symbols', 0)
+        self._local.new_symbols = 0
+        if new_symbols and committed:
+            with self._symbols_lock:
+                self.symbols_version += new_symbols
+
+    def intern_fields(self, connection, fields, counts):
+        """
+        Intern the filterable header fields of one message.
+
+        :param counts: Counter of symbol id -> messages, updated in place.
+        :return: Tuple of (type id, event id, facility id).
+        """
+        type_id = self.intern(connection, MESSAGE_CODE, fields['message_code'])
+        event_id = self.intern(connection, TRIGGER_EVENT, fields['trigger_event'])
+        facility_id = self.intern(connection, SENDING_FACILITY, fields['sending_facility'])
+        full_type_id = self.intern(connection, MESSAGE_TYPE, fields['message_type'])
+        for symbol_id in (type_id, event_id, facility_id, full_type_id):
+            if symbol_id is not None:
+                counts[symbol_id] += 1
+        return type_id, event_id, facility_id
+
+    def add_symbol_counts(self, connection, counts):
+        connection.executemany(
+            "UPDATE symbols SET message_count = message_count + ? WHERE id = ?",
+            [(count, symbol_id) for symbol_id, count in counts.items()])
+
+    def symbol_id(self, kind, value):
+        """Look up the id of a symbol without adding it; None if it was never seen."""
+        symbol_id = self._symbol_ids.get((kind, value))
+        if symbol_id is None:
+            # It may have been added by another process
+            row = self.connection().execute(
+                "SELECT id FROM symbols WHERE kind = ? AND value = ?", (kind, value)).fetchone()
+            if row:
+                symbol_id = row[0]
+                with self._symbols_lock:
+                    self._symbol_ids[(kind, value)] = symbol_id
+        return symbol_id
+
+    def observed_values(self, kind):
+        """
+        Return the values of one symbol kind seen so far, with message counts.
+
+        :return: List of (value, message count) tuples, sorted by value.
+        """
+        return self.connection().execute(
+            "SELECT value, message_count FROM symbols WHERE kind = ? ORDER BY value", (kind,)).fetchall()
+
+    def create_full_text_index(self, connection):
+        # Returns False when SQLite was built without FTS5; search then falls
+        # back to a LIKE scan
+        exists = connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'").fetchone()
+        if exists:
+            return True
+        try:
+            connection.executescript(f"BEGIN;{FTS_SCHEMA}COMMIT;")
+            return True
+        except sqlite3.OperationalError as e:
+            if connection.in_transaction:
+                connection.rollback()
+            print(f"Full-text search is unavailable, using substring search: {e}")
+            return False
+
+    def connection(self):
+        # Return the connection that belongs to the calling thread
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def add_message(self, message, acknowledgment=None, received_at=None):
+        self.add_messages([MessageRecord(message, acknowledgment, received_at)])
+
+    def add_messages(self, records):
+        """
+        Insert a batch of messages in a single transaction.
+
+        :param records: Iterable of MessageRecords.
+        """
+        records = list(records)
+        if not records:
+            return
+
+        connection = self.connection()
+        try:
+            with connection:
+                counts = Counter()
+                params = []
+                for record in records:
+                    fields = parse_index_fields(record.message)
+                    type_id, event_id, facility_id = self.intern_fields(connection, fields, counts)
+                    params.append((
+                        record.received_at,
+                        fields['message_type'],
+                        fields['control_id'],
+                        fields['sending_app'],
+                        fields['sending_facility'],
+                        fields['patient_id'],
+                        record.message,
+                        record.acknowledgment,
+                        type_id or 0,
+                        event_id,
+                        facility_id,
+                    ))
+                connection.executemany(
+                    "INSERT INTO messages (received_at, message_type, control_id, sending_app,"
+                    " sending_facility, patient_id, message, acknowledgment, type_id, event_id,"
+                    " facility_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    params,
+                )
+                self.add_symbol_counts(connection, counts)
+            self.publish_symbols()
+        except sqlite3.Error:
+            # Symbols added in the failed transaction were rolled back too
+            self.publish_symbols(committed=False)
+            with self._symbols_lock:
+                self._symbol_ids.clear()
+            self.load_symbols(connection)
+            raise
+
+    def _where(self, message_type=None, search=None, sending_facility=None, sending_app=None,
+               patient_id=None, control_id=None, since=None, until=None, after_id=None,
+               before_id=None):
+        clauses = []
+        params = []
+        if message_type:
+            # "ADT" matches every ADT trigger event; "ADT^A01" only A01. An
+            # unseen value has no id and matches nothing.
+            components = message_type.split('^')
+            clauses.append("type_id = ?")
+            params.append(self.symbol_id(MESSAGE_CODE, components[0]))
+            if len(components) > 1 and components[1]:
+                clauses.append("event_id = ?")
+                params.append(self.symbol_id(TRIGGER_EVENT, components[1]))
+        if sending_facility:
+            clauses.append("facility_id = ?")
+            params.append(self.symbol_id(SENDING_FACILITY, sending_facility))
+        if sending_app:
+            clauses.append("sending_app = ?")
+            params.append(sending_app)
+        if patient_id:
+            clauses.append("patient_id = ?")
+            params.append(patient_id)
+        if control_id:
+            clauses.append("control_id = ?")
+            params.append(control_id)
+        if since is not None:
+            clauses.append("received_at >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("received_at < ?")
+            params.append(until)
+        if after_id is not None:
+            clauses.append("id > ?")
+            params.append(after_id)
+        if before_id is not None:
+            clauses.append("id < ?")
+            params.append(before_id)
+        fts_query = build_fts_query(search) if search and self.full_text else None
+        if fts_query:
+            # The id bounds are repeated inside so FTS5 only walks the matches
+            # in range; otherwise every match in the store is collected first
+            fts_clauses = ["messages_fts MATCH ?"]
+            params.append(fts_query)
+            if after_id is not None:
+                fts_clauses.append("rowid > ?")
+                params.append(after_id)
+            if before_id is not None:
+                fts_clauses.append("rowid < ?")
+                params.append(before_id)
+            clauses.append(f"id IN (SELECT rowid FROM messages_fts WHERE {' AND '.join(fts_clauses)})")
+        elif search:
+            clauses.append("message LIKE ? ESCAPE '\\'")
+            escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            params.append(f"%{escaped}%")
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        return where, params
+
+    def query_messages(self, limit=100, offset=0, oldest_first=False, **filters):
+        """
+        Return one page of messages, newest first.
+
+        :param limit: Maximum number of rows in the page.
+        :param offset: Number of matching rows to skip.
+        :param oldest_first: Return the oldest matching rows first instead
+                             (e.g. the page right after after_id).
+        :param filters: message_type, search, sending_facility, sending_app,
+                        patient_id, control_id, since, until, after_id, before_id.
+        :return: List of (id, received_at, message, acknowledgment) tuples.
+        """
+        where, params = self._where(**filters)
+        order = "ASC" if oldest_first else "DESC"
+        cursor = self.connection().execute(
+            f"SELECT id, received_at, message, acknowledgment FROM messages{where}"
+            f" ORDER BY id {order} LIMIT ? OFFSET ?",
+            params + [limit, offset],
+        )
+        return cursor.fetchall()
+
+    def iter_messages(self, batch_size=5000, **filters):
+        """
+        Stream matching messages oldest first, one batch at a time.
+
+        Pages are fetched by id (keyset pagination), so memory stays constant
+        and later pages cost the same as the first.
+
+        :return: Generator of (id, received_at, message, acknowledgment) tuples.
+        """
+        last_id = 0
+        while True:
+            where, params = self._where(after_id=last_id, **filters)
+            rows = self.connection().execute(
+                f"SELECT id, received_at, message, acknowledgment FROM messages{where}"
+                " ORDER BY id LIMIT ?",
+                params + [batch_size],
+            ).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last_id = rows[-1][0]
+
+    def count_messages(self, **filters):
+        where, params = self._where(**filters)
+        cursor = self.connection().execute(f"SELECT COUNT(*) FROM messages{where}", params)
+        return cursor.fetchone()[0]
+
+    def find_acknowledgment(self, sending_app, sending_facility, control_id):
+        """Return the ACK stored for the first message with this MSH-3/MSH-4/MSH-10, if any."""
+        row = self.connection().execute(
+            "SELECT acknowledgment FROM messages"
+            " WHERE control_id = ? AND sending_app IS ? AND sending_facility IS ?"
+            " AND acknowledgment IS NOT NULL ORDER BY id LIMIT 1",
+            (control_id, sending_app or None, sending_facility or None),
+        ).fetchone()
+        return row[0] if row else None
+
+    def iter_duplicate_keys(self, batch_size=10000):
+        """Yield the (MSH-3, MSH-4, MSH-10) key of every stored message."""
+        cursor = self.connection().execute(
+            "SELECT sending_app, sending_facility, control_id FROM messages"
+            " WHERE control_id IS NOT NULL")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for sending_app, sending_facility, control_id in rows:
+                yield sending_app or '', sending_facility or '', control_id
+
+    def close(self):
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+        self._local = threading.local()
@@ -0,0 +1,246 @@
+from PyQt5.QtCore import Qt, QAbstractItemModel, QModelIndex
+
+COLUMNS = ["Element", "Value"]
+# Segments located per fetch; the view asks for more as it is scrolled
+SEGMENT_BATCH = 1000
+# Characters of a value shown in the tree; longer values are cut short
+MAX_VALUE_LENGTH = 500
+# Segments whose first field is the field separator itself
+HEADER_SEGMENTS = ("MSH", "BHS", "FHS")
+DEFAULT_ENCODING_CHARACTERS = "^~\\&"
+
+SEGMENT, FIELD, REPETITION, COMPONENT, SUBCOMPONENT = range(5)
+
+
+class Node:
+    """
+    One element of the message: a span of the message text. `children`
+    is None until the element has been split.
+    """
+
+    __slots__ = ('parent', 'row', 'kind', 'number', 'start', 'end', 'children')
+
+    def __init__(self, parent, row, kind, number, start, end, children=None):
+        self.parent = parent
+        self.row = row
+        self.kind = kind
+        self.number = number    # 1-based position, as in PID-3.1
+        self.start = start
+        self.end = end
+        self.children = children
+
+
+class MessageTreeModel(QAbstractItemModel):
+    """
+    Tree of one HL7 message: segments, fields, repetitions, components and
+    subcomponents.
+
+    Nothing is split up front. Segments are located SEGMENT_BATCH at a time
+    as the view scrolls (fetchMore), and an element is split into its parts
+    only when the view expands it; hasChildren just looks for a separator.
+    Nodes are spans of the message text, so only displayed values are ever
+    copied out, and even a very large message shows at once.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.message = ""
+        self.root = Node(None, 0, None, 0, 0, 0, [])
+        self.located = 0    # offset up to which segments have been located
+        self.fetching = False
+        self.segment_separator = '\r'
+        self.field_separator = '|'
+        self.component_separator, self.repetition_separator, _, self.subcomponent_separator = \
+            DEFAULT_ENCODING_CHARACTERS
+
+    def set_message(self, message):
+        self.beginResetModel()
+        self.message = message or ""
+        self.root = Node(None, 0, None, 0, 0, 0, [])
+        self.located = 0
+        self.read_delimiters()
+        self.endResetModel()
+        self.fetchMore()
+
+    def read_delimiters(self):
+        # MSH-1 and MSH-2 name the separators the rest of the message uses
+        message = self.message
+        self.segment_separator = '\r' if '\r' in message or '\n' not in message else '\n'
+        if message[:3] in HEADER_SEGMENTS and len(message) > 4:
+            self.field_separator = message[3]
+            end = message.find(self.field_separator, 4, 9)
+            encoding = message[4:end if end >= 0 else 8]
+            # Senders may leave out the trailing encoding characters
+            encoding = (encoding + DEFAULT_ENCODING_CHARACTERS[len(encoding):])[:4]
+        else:
+            self.field_separator = '|'
+            encoding = DEFAULT_ENCODING_CHARACTERS
+        self.component_separator, self.repetition_separator, _, self.subcomponent_separator = encoding
+
+    # Qt model interface
+
+    def node_of(self, index):
+        return index.internalPointer() if index.isValid() else self.root
+
+    def index(self, row, column, parent=QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QModelIndex()
+        return self.createIndex(row, column, self.children(self.node_of(parent))[row])
+
+    def parent(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        parent = index.internalPointer().parent
+        if parent is self.root:
+            return QModelIndex()
+        return self.createIndex(parent.row, 0, parent)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        return len(self.children(self.node_of(parent)))
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(COLUMNS)
+
+    def hasChildren(self, parent=QModelIndex()):
+        node = self.node_of(parent)
+        if node.children is not None:
+            return bool(node.children) or (node is self.root and self.canFetchMore(parent))
+        return self.has_parts(node, self.child_separator(node))
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        node = index.internalPointer()
+        if index.column() == 0:
+            return self.label(node)
+        end = min(node.end, node.start + MAX_VALUE_LENGTH)
+        value = self.message[node.start:end]
+        if end < node.end:
+            value += f"... ({node.end - node.start:,} characters)"
+        return value
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return COLUMNS[section]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.fetching and self.located < len(self.message)
+
+    def fetchMore(self, parent=QModelIndex()):
+        # Views may ask for more while rows are being inserted; that call
+        # would locate the same segments again
+        if parent.isValid() or self.fetching:
+            return
+        self.fetching = True
+        try:
+            self.locate_segments()
+        finally:
+            self.fetching = False
+
+    def locate_segments(self):
+        message = self.message
+        end = len(message)
+        position = self.located
+        first = len(self.root.children)
+        segments = []
+        while position < end and len(segments) < SEGMENT_BATCH:
+            # Blank lines and the \n of \r\n endings are not segments
+            while position < end and message[position] in '\r\n':
+                position += 1
+            if position == end:
+                break
+            found = message.find(self.segment_separator, position)
+            stop = end if found < 0 else found
+            row = first + len(segments)
+            segments.append(Node(self.root, row, SEGMENT, row + 1, position, stop))
+            position = stop + 1
+        if segments:
+            self.beginInsertRows(QModelIndex(), first, first + len(segments) - 1)
+            self.root.children.extend(segments)
+            self.endInsertRows()
+        self.located = min(position, end)
+
+    # Splitting
+
+    def children(self, node):
+        if node.children is None:
+            node.children = self.split_segment(node) if node.kind == SEGMENT else self.split(node)
+        return node.children
+
+    def child_separator(self, node):
+        if node.kind == SEGMENT:
+            return self.field_separator
+        if node.kind == FIELD:
+            if self.message.find(self.repetition_separator, node.start, node.end) >= 0:
+                return self.repetition_separator
+            return self.component_separator
+        if node.kind == REPETITION:
+            return self.component_separator
+        if node.kind == COMPONENT:
+            return self.subcomponent_separator
+        return None
+
+    def has_parts(self, node, separator):
+        # Without its separator an element is a single value, not a parent;
+        # a value holding only subcomponents still gets its one component
+        if separator is None:
+            return False
+        if self.message.find(separator, node.start, node.end) >= 0:
+            return True
+        return (separator == self.component_separator
+                and self.message.find(self.subcomponent_separator, node.start, node.end) >= 0)
+
+    def split(self, node):
+        separator = self.child_separator(node)
+        if not self.has_parts(node, separator):
+            return []
+        if node.kind == FIELD:
+            kind = REPETITION if separator == self.repetition_separator else COMPONENT
+        else:
+            kind = node.kind + 1
+        return self.spans(node, kind, separator, node.start)
+
+    def spans(self, node, kind, separator, start, first_number=1):
+        """Child nodes of `node` between the separators from `start` on."""
+        children = []
+        position = start
+        while True:
+            found = self.message.find(separator, position, node.end)
+            stop = node.end if found < 0 else found
+            children.append(Node(node, len(children), kind, first_number + len(children), position, stop))
+            if found < 0:
+                return children
+            position = found + 1
+
+    def split_segment(self, node):
+        message = self.message
+        name_end = message.find(self.field_separator, node.start, node.end)
+        if name_end < 0:
+            return []
+        if message[node.start:name_end] not in HEADER_SEGMENTS:
+            return self.spans(node, FIELD, self.field_separator, name_end + 1)
+        # MSH-1 is the field separator and MSH-2 the encoding characters;
+        # neither is split any further
+        encoding_end = message.find(self.field_separator, name_end + 1, node.end)
+        encoding_end = node.end if encoding_end < 0 else encoding_end
+        children = [Node(node, 0, FIELD, 1, name_end, name_end + 1, []),
+                    Node(node, 1, FIELD, 2, name_end + 1, encoding_end, [])]
+        if encoding_end < node.end:
+            for child in self.spans(node, FIELD, self.field_separator, encoding_end + 1, first_number=3):
+                child.row += 2
+                children.append(child)
+        return children
+
+    def label(self, node):
+        if node.kind == SEGMENT:
+            name_end = self.message.find(self.field_separator, node.start, node.end)
+            return self.message[node.start:node.end if name_end < 0 else name_end]
+        parent = self.label(node.parent)
+        if node.kind == FIELD:
+            return f"{parent}-{node.number}"
+        if node.kind == REPETITION:
+            return f"{parent}({node.number})"
+        return f"{parent}.{node.number}"
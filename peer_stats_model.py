@@ -0,0 +1,108 @@
+from datetime import datetime
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex
+from metrics import format_count, format_bytes, format_latency
+
+COLUMNS = ["Source", "Messages", "Bytes", "Errors", "Last Seen", "Mean", "p99", "In Flight"]
+# Raw column values, for sorting through a QSortFilterProxyModel
+SORT_ROLE = Qt.UserRole
+
+
+def format_time(value):
+    return "-" if value is None else datetime.fromtimestamp(value).strftime('%H:%M:%S')
+
+
+FORMATTERS = [str, format_count, format_bytes, format_count, format_time, format_latency, format_latency,
+              format_count]
+
+
+class PeerStatsModel(QAbstractTableModel):
+    """
+    Table of PeerStats (see metrics.py), one row per connection or sender.
+
+    refresh() reads the current entries from `source` and updates the
+    table incrementally: new entries are appended, entries that are gone
+    are removed, and only rows whose counters changed since the last
+    refresh are recomputed and reported, so an idle sender costs nothing
+    and percentiles are only worked out for busy ones.
+    """
+
+    def __init__(self, source, parent=None):
+        """
+        :param source: Callable returning the PeerStats to show.
+        """
+        super().__init__(parent)
+        self.source = source
+        # [PeerStats, column values, (version, queued, stored) they were computed at]
+        self.rows = []
+
+    # Qt model interface
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        value = self.rows[index.row()][1][index.column()]
+        if role == Qt.DisplayRole:
+            return FORMATTERS[index.column()](value)
+        if role == SORT_ROLE:
+            # Missing values sort below every real one
+            return -1 if value is None else value
+        if role == Qt.TextAlignmentRole and index.column() > 0:
+            return Qt.AlignRight | Qt.AlignVCenter
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return COLUMNS[section]
+        return None
+
+    # Refreshing
+
+    def refresh(self):
+        current = self.source()
+        present = set(current)
+        # Bottom up, so the rows still to be checked keep their numbers
+        for row in range(len(self.rows) - 1, -1, -1):
+            if self.rows[row][0] not in present:
+                self.beginRemoveRows(QModelIndex(), row, row)
+                del self.rows[row]
+                self.endRemoveRows()
+
+        known = {entry[0] for entry in self.rows}
+        added = [new_row(stats) for stats in current if stats not in known]
+        if added:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(added) - 1)
+            self.rows.extend(added)
+            self.endInsertRows()
+
+        first = last = None
+        for row, entry in enumerate(self.rows):
+            latest = stamp(entry[0])
+            if latest != entry[2]:
+                entry[1] = column_values(entry[0])
+                entry[2] = latest
+                first = row if first is None else first
+                last = row
+        if first is not None:
+            self.dataChanged.emit(self.index(first, 0), self.index(last, len(COLUMNS) - 1))
+
+
+def new_row(stats):
+    # Stamped first: `stored` moves on the writer thread meanwhile
+    latest = stamp(stats)
+    return [stats, column_values(stats), latest]
+
+
+def stamp(stats):
+    return stats.version, stats.queued, stats.stored
+
+
+def column_values(stats):
+    name = stats.name if stats.connected is not False else f"{stats.name} (closed)"
+    return (name, stats.messages, stats.bytes, stats.errors, stats.last_seen, stats.mean_us(), stats.p99_us(),
+            stats.in_flight())
@@ -0,0 +1,181 @@
+import os
+import struct
+import threading
+import zlib
+
+from message_record import MessageRecord, ACK_CODES, ACK_CODE_NAMES
+from message_store import parse_index_fields
+
+# Every record is a fixed header followed by the raw message bytes and the
+# raw ACK bytes:
+#   magic, format version, ACK code, CRC-32 of the payload,
+#   received_at, acked_at, message type id, sender id, peer id,
+#   message length, ACK length
+# Ids refer to the archive's SymbolTable; 0 means "not present". The header
+# can be read in place with struct.unpack_from over an mmap.
+RECORD_HEADER = struct.Struct('<2sBBIddIIIII')
+RECORD_MAGIC = b'H7'
+RECORD_VERSION = 1
+
+SYMBOLS_FILE = 'symbols'
+
+
+class SymbolTable:
+    """
+    Append-only table of the strings that records refer to by id (message
+    types, senders, peers). One symbol per line; the id is the line number.
+
+    Only the archive that writes the table opens it writable. It drops a
+    line left half written by a crash, so the next symbol does not get
+    glued onto it, and syncs the table before records that use its ids
+    are made durable.
+    """
+
+    def __init__(self, path, writable=False):
+        self.path = path
+        self.lock = threading.Lock()
+        self.symbols = [None]  # id 0 is reserved for "not present"
+        self.ids = {}
+        self.loaded_bytes = 0
+        self.file = None
+        if writable:
+            self.truncate_partial_line()
+        self.reload()
+
+    def truncate_partial_line(self):
+        try:
+            with open(self.path, 'r+b') as file:
+                data = file.read()
+                end = data.rfind(b'\n') + 1
+                if end < len(data):
+                    file.truncate(end)
+                    file.flush()
+                    os.fsync(file.fileno())
+        except FileNotFoundError:
+            pass
+
+    def reload(self):
+        """Pick up symbols appended by another process or instance."""
+        with self.lock:
+            try:
+                with open(self.path, 'rb') as file:
+                    file.seek(self.loaded_bytes)
+                    data = file.read()
+            except FileNotFoundError:
+                return
+            # Ignore a partially written last line
+            end = data.rfind(b'\n') + 1
+            for line in data[:end].decode('utf-8').split('\n')[:-1]:
+                self.ids[line] = len(self.symbols)
+                self.symbols.append(line)
+            self.loaded_bytes += end
+
+    def id_for(self, value):
+        """Return the id of a string, adding it to the table if it is new."""
+        if not value:
+            return 0
+        symbol_id = self.ids.get(value)
+        if symbol_id is not None:
+            return symbol_id
+        if '\n' in value or '\r' in value:
+            return self.id_for(value.replace('\n', ' ').replace('\r', ' '))
+        with self.lock:
+            symbol_id = self.ids.get(value)
+            if symbol_id is None:
+                line = (value + '\n').encode('utf-8')
+                if self.file is None:
+                    self.file = open(self.path, 'ab')
+                # Flushed so readers see it; made durable by sync()
+                self.file.write(line)
+                self.file.flush()
+                symbol_id = len(self.symbols)
+                self.symbols.append(value)
+                self.ids[value] = symbol_id
+                self.loaded_bytes += len(line)
+            return symbol_id
+
+    def sync(self):
+        """Make every symbol added so far durable."""
+        with self.lock:
+            if self.file is not None:
+                os.fsync(self.file.fileno())
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.file.close()
+                self.file = None
+
+    def lookup(self, symbol_id):
+        if symbol_id >= len(self.symbols):
+            self.reload()
+        return self.symbols[symbol_id] if symbol_id < len(self.symbols) else None
+
+
+def open_symbols(directory, writable=False):
+    return SymbolTable(os.path.join(directory, SYMBOLS_FILE), writable)
+
+
+def encode_record(record, symbols):
+    message_bytes = record.message.encode('utf-8')
+    ack_bytes = record.acknowledgment.encode('utf-8') if record.acknowledgment else b''
+    payload = message_bytes + ack_bytes
+    fields = parse_index_fields(record.message)
+    header = RECORD_HEADER.pack(
+        RECORD_MAGIC,
+        RECORD_VERSION,
+        ACK_CODES.get(record.ack_code, 0),
+        zlib.crc32(payload),
+        record.received_at,
+        record.acked_at or 0.0,
+        symbols.id_for(fields['message_type']),
+        symbols.id_for(fields['sending_facility']),
+        symbols.id_for(record.peer),
+        len(message_bytes),
+        len(ack_bytes),
+    )
+    return header + payload
+
+
+def read_header(buffer, offset):
+    """
+    Unpack the header at offset.
+
+    :return: The header tuple, or None if there is no valid header there.
+    """
+    if offset + RECORD_HEADER.size > len(buffer):
+        return None
+    header = RECORD_HEADER.unpack_from(buffer, offset)
+    if header[0] != RECORD_MAGIC or header[1] != RECORD_VERSION:
+        return None
+    return header
+
+
+def record_end(header, offset):
+    return offset + RECORD_HEADER.size + header[9] + header[10]
+
+
+def decode_record(buffer, offset, header=None, symbols=None):
+    """Build a MessageRecord from the record at offset."""
+    if header is None:
+        header = read_header(buffer, offset)
+    _, _, ack_code, _, received_at, acked_at, _, _, peer_id, message_len, ack_len = header
+    body_start = offset + RECORD_HEADER.size
+    message = bytes(buffer[body_start:body_start + message_len]).decode('utf-8')
+    acknowledgment = bytes(buffer[body_start + message_len:body_start + message_len + ack_len]).decode('utf-8')
+    return MessageRecord(
+        message,
+        acknowledgment or None,
+        received_at,
+        acked_at or None,
+        ACK_CODE_NAMES.get(ack_code),
+        symbols.lookup(peer_id) if symbols is not None and peer_id else None,
+    )
+
+
+def check_record(buffer, offset, header):
+    """Return True if the record's payload matches its CRC."""
+    body_start = offset + RECORD_HEADER.size
+    return zlib.crc32(buffer[body_start:record_end(header, offset)]) == header[3]
@@ -0,0 +1,245 @@
+"""
+Replay archived HL7 messages against an HL7Server.
+
+Examples:
+    python replay.py archive --rate 200 --connections 4
+    python replay.py HL7_messages.db --timing original --speed 10
+    python replay.py HL7_messages.hl7 --timing max
+"""
+import argparse
+import os
+import queue
+import select
+import socket
+import threading
+import time
+
+from archive import iter_segment_records, ACTIVE_SUFFIX, SEALED_SUFFIX
+from message_store import MessageStore
+from import_legacy import read_legacy_messages
+from message_record import ack_code_of
+
+START_BLOCK = b'\x0b'
+END_BLOCK = b'\x1c'
+CARRIAGE_RETURN = b'\x0d'
+
+
+def read_archive_messages(directory):
+    names = sorted(name for name in os.listdir(directory)
+                   if name.endswith(ACTIVE_SUFFIX) or name.endswith(SEALED_SUFFIX))
+    for name in names:
+        for record in iter_segment_records(os.path.join(directory, name)):
+            yield record.received_at, record.message
+
+
+def read_store_messages(path):
+    store = MessageStore(path)
+    try:
+        for _, received_at, message, _ in store.iter_messages():
+            yield received_at, message
+    finally:
+        store.close()
+
+
+def read_messages(source):
+    """Pick a reader from the source: archive directory, SQLite store or legacy file."""
+    if os.path.isdir(source):
+        return read_archive_messages(source)
+    if source.endswith('.db'):
+        return read_store_messages(source)
+    return read_legacy_messages(source)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class ReplayConnection:
+    """A persistent MLLP client connection that reconnects when the server closes it."""
+
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock = None
+        self.buffer = b''
+        self.connects = 0
+
+    def send(self, message):
+        """
+        Send one message and return the ACK text.
+
+        Only a failed send is retried, once, on a new connection. Once the
+        message has gone out, a missing ACK (timeout or hang-up) is raised
+        rather than retried: the server may already have stored it, and a
+        resend would replay it twice.
+        """
+        frame = START_BLOCK + message.encode('utf-8') + END_BLOCK + CARRIAGE_RETURN
+        if self.sock is not None and self.peer_closed():
+            self.close()
+        for attempt in range(2):
+            if self.sock is None:
+                self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+                self.buffer = b''
+                self.connects += 1
+            try:
+                self.sock.sendall(frame)
+                break
+            except OSError:
+                self.close()
+                if attempt:
+                    raise
+        try:
+            return self.read_ack()
+        except OSError:
+            # A late ACK would be taken for the next message's
+            self.close()
+            raise
+
+    def peer_closed(self):
+        """Whether the server closed the idle connection since the last ACK."""
+        readable, _, _ = select.select([self.sock], [], [], 0)
+        if not readable:
+            return False
+        try:
+            return not self.sock.recv(65536, socket.MSG_PEEK)
+        except OSError:
+            return True
+
+    def read_ack(self):
+        terminator = END_BLOCK + CARRIAGE_RETURN
+        while terminator not in self.buffer:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise ConnectionError("Connection closed before ACK was received")
+            self.buffer += chunk
+        frame, self.buffer = self.buffer.split(terminator, 1)
+        return frame.lstrip(START_BLOCK).decode('utf-8', errors='replace')
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+def replay(messages, host='127.0.0.1', port=5000, connections=1, timing='max', rate=100.0,
+           speed=1.0, limit=None, timeout=10.0):
+    """
+    Send messages to a server and measure ACK latency.
+
+    :param messages: Iterable of (received_at, message); received_at may be None.
+    :param timing: 'original' (recorded spacing divided by speed), 'rate' (fixed
+                   messages per second) or 'max' (as fast as the connections allow).
+    :return: Dictionary of results.
+    """
+    work = queue.Queue(maxsize=connections * 4)
+    lock = threading.Lock()
+    latencies = []
+    ack_codes = {}
+    errors = [0]
+    connects = [0]
+    workers = []
+    start = time.perf_counter()
+
+    def worker():
+        client = ReplayConnection(host, port, timeout)
+        while True:
+            item = work.get()
+            if item is None:
+                break
+            send_at, message = item
+            delay = start + send_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            sent = time.perf_counter()
+            try:
+                ack = client.send(message)
+            except OSError:
+                with lock:
+                    errors[0] += 1
+                continue
+            latency = time.perf_counter() - sent
+            code = ack_code_of(ack) or 'none'
+            with lock:
+                latencies.append(latency)
+                ack_codes[code] = ack_codes.get(code, 0) + 1
+        client.close()
+        with lock:
+            connects[0] += client.connects
+
+    for _ in range(connections):
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        workers.append(thread)
+
+    # Schedule messages; the bounded work queue keeps memory flat
+    count = 0
+    first_received_at = None
+    for received_at, message in messages:
+        if limit is not None and count >= limit:
+            break
+        if timing == 'original' and received_at is not None:
+            if first_received_at is None:
+                first_received_at = received_at
+            send_at = (received_at - first_received_at) / speed
+        elif timing in ('rate', 'original'):
+            send_at = count / rate
+        else:
+            send_at = 0.0
+        work.put((send_at, message))
+        count += 1
+
+    for _ in workers:
+        work.put(None)
+    for thread in workers:
+        thread.join()
+
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'sent': count,
+        'acked': len(latencies),
+        'errors': errors[0],
+        'connections_opened': connects[0],
+        'elapsed_s': elapsed,
+        'throughput_msgs_per_s': len(latencies) / elapsed if elapsed else 0.0,
+        'ack_codes': ack_codes,
+        'latency_ms': {
+            'p50': percentile(latencies, 0.50) * 1000,
+            'p95': percentile(latencies, 0.95) * 1000,
+            'p99': percentile(latencies, 0.99) * 1000,
+            'max': (latencies[-1] if latencies else 0.0) * 1000,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay archived HL7 messages against an HL7 server.")
+    parser.add_argument('source', help="Archive directory, SQLite store (.db) or legacy .hl7 file")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--connections', type=int, default=1, help="Parallel persistent connections")
+    parser.add_argument('--timing', choices=['original', 'rate', 'max'], default='max')
+    parser.add_argument('--rate', type=float, default=100.0, help="Messages per second for --timing rate")
+    parser.add_argument('--speed', type=float, default=1.0, help="Speed-up factor for --timing original")
+    parser.add_argument('--limit', type=int, help="Stop after this many messages")
+    parser.add_argument('--timeout', type=float, default=10.0, help="Seconds to wait for each ACK")
+    args = parser.parse_args()
+
+    results = replay(read_messages(args.source), args.host, args.port, args.connections,
+                     args.timing, args.rate, args.speed, args.limit, args.timeout)
+
+    latency = results['latency_ms']
+    print(f"Sent {results['sent']} messages, {results['acked']} ACKed, {results['errors']} errors "
+          f"over {results['connections_opened']} connections in {results['elapsed_s']:.2f}s")
+    print(f"Throughput: {results['throughput_msgs_per_s']:.1f} msgs/s")
+    print(f"ACK latency ms: p50 {latency['p50']:.2f}  p95 {latency['p95']:.2f}  "
+          f"p99 {latency['p99']:.2f}  max {latency['max']:.2f}")
+    print("ACK codes: " + ", ".join(f"{code}={count}" for code, count in sorted(results['ack_codes'].items())))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,46 @@
+import functools
 import logging
+import time
+from collections import Counter, deque
+from datetime import datetime
 from PyQt5.QtNetwork import QTcpServer, QTcpSocket, QHostAddress
-from PyQt5.QtCore import QObject, pyqtSignal, QByteArray
+from PyQt5.QtCore import QObject, pyqtSignal, QByteArray, QTimer
+from PyQt5 import sip
+from write_behind import WriteBehindWriter
+from message_record import MessageRecord
+from duplicates import DuplicateDetector, duplicate_key
+from log_pipeline import LogSampler, BodyDigest
+from metrics import LatencyHistogram, PeerStats
 
 START_BLOCK = b'\x0b'  # MLLP Start Block
 END_BLOCK = b'\x1c'    # MLLP End Block
 CARRIAGE_RETURN = b'\x0d'  # Carriage return
 
+# Socket reads are retried after this delay while the storage queue is full
+BACKPRESSURE_RETRY_MS = 50
+# Cap on Qt's per-socket read buffer so unread data stays in the kernel and
+# TCP flow control can push back; frames larger than this arrive over
+# several reads and are put together in the connection's receive buffer
+SOCKET_READ_BUFFER_SIZE = 256 * 1024
+# Lines per second allowed for each kind of per-message log event; the
+# rest are counted and reported with the next line
+LOG_EVENTS_PER_SECOND = 10
+# Closed connections whose statistics are still shown
+CLOSED_CONNECTIONS_KEPT = 50
+# Sending facilities tracked separately; any further ones share one entry
+MAX_FACILITIES = 1000
+OTHER_FACILITIES = "(other)"
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
 class HL7Server(QObject):
-    message_received = pyqtSignal(str)
     status_changed = pyqtSignal(str)
+    messages_stored = pyqtSignal(int)
 
-    def __init__(self, ip='127.0.0.1', port=5000):
+    def __init__(self, ip='127.0.0.1', port=5000, store=None, archive=None,
+                 close_after_ack=False, intake_queue=None):
         super().__init__()
         self.server = QTcpServer(self)
         self.server.newConnection.connect(self.handle_new_connection)
@@ -21,51 +48,253 @@ class HL7Server(QObject):
         self.ip = ip
         self.port = port
 
+        # MLLP senders normally keep their connection open; set this to hang
+        # up after every ACK instead
+        self.close_after_ack = close_after_ack
+
+        # Received messages are persisted by a background writer so storage
+        # never adds latency to the ACK. With an intake_queue (DurableQueue)
+        # each message is appended to it before it is ACKed, and the writer
+        # reads it from there, so an ACKed message survives a crash.
+        self.writer = None
+        self.intake_queue = intake_queue
+        sinks = [sink for sink in (store, archive) if sink is not None]
+        if sinks:
+            self.writer = WriteBehindWriter(sinks, on_flush=self.messages_stored.emit,
+                                            on_batch_done=self.count_stored, intake=intake_queue)
+            self.writer.start()
+
+        # Retransmitted messages get their original ACK back and are not
+        # processed or stored again
+        self.duplicates = DuplicateDetector(store)
+
+        # Per-message logging is sampled so busy feeds don't spend their
+        # time formatting and writing log lines
+        self.log_sampler = LogSampler(per_second=LOG_EVENTS_PER_SECOND)
+
+        # Metrics, read by the dashboard's timer. Plain counters updated on
+        # the event loop, so keeping them costs next to nothing.
+        self.messages_received = 0
+        self.bytes_received = 0
+        self.ack_counts = Counter()
+        self.active_connections = 0
+        self.ack_latency = LatencyHistogram()   # read to ACK written, microseconds
+        # Per-source statistics: open connections by socket, recently closed
+        # ones, and sending facilities (MSH-4) by name
+        self.connection_stats = {}
+        self.closed_connection_stats = deque(maxlen=CLOSED_CONNECTIONS_KEPT)
+        self.facility_stats = {}
+        # Bytes received on each connection that do not make a whole frame yet
+        self.receive_buffers = {}
+        # Connections whose buffers hold whole frames waiting for storage room
+        self.paused_connections = set()
+
     def start_server(self):
         # Convert the IP string to a QHostAddress
         address = QHostAddress(self.ip)
         if self.server.listen(address, self.port):
-            logging.info(f"Server started at {self.ip}:{self.port}")
+            logger.info("Server started at %s:%s", self.ip, self.port)
             print(f"Server started at {self.ip}:{self.port}")
             self.status_changed.emit("Running")
         else:
-            logging.error(f"Server failed to start: {self.server.errorString()}")
+            logger.error("Server failed to start: %s", self.server.errorString())
             print(f"Server failed to start: {self.server.errorString()}")
 
     def stop_server(self):
         if self.server.isListening():
             self.server.close()
-            logging.info("Server stopped")
+            logger.info("Server stopped")
             print("Server stopped")
             self.status_changed.emit("Down")
 
     def is_listening(self):
         return self.server.isListening()
 
+    def metrics(self):
+        return {
+            'messages_received': self.messages_received,
+            'bytes_received': self.bytes_received,
+            'ack_counts': dict(self.ack_counts),
+            'active_connections': self.active_connections,
+            'duplicates': self.duplicates.duplicates,
+            'storage_queue_depth': self.writer.queue_depth() if self.writer is not None else 0,
+        }
+
+    def stats_by_connection(self):
+        """PeerStats of the open and recently closed connections."""
+        return [*self.connection_stats.values(), *self.closed_connection_stats]
+
+    def stats_by_facility(self):
+        """PeerStats of each sending facility."""
+        return list(self.facility_stats.values())
+
+    def facility_stats_for(self, facility):
+        stats = self.facility_stats.get(facility)
+        if stats is None:
+            if len(self.facility_stats) >= MAX_FACILITIES:
+                facility = OTHER_FACILITIES
+                stats = self.facility_stats.get(facility)
+            if stats is None:
+                stats = self.facility_stats[facility] = PeerStats(facility or "(none)")
+        return stats
+
+    def count_stored(self, batch):
+        # Runs on the writer thread, the only writer of PeerStats.stored
+        for record in batch:
+            for stats in record.stats:
+                stats.stored += 1
+
+    def shutdown(self):
+        """Stop listening and write out any messages still queued for storage."""
+        self.stop_server()
+        if self.writer is not None:
+            self.writer.stop()
+        if self.intake_queue is not None:
+            self.intake_queue.close()
+
     def handle_new_connection(self):
-        client_connection = self.server.nextPendingConnection()
-        client_connection.readyRead.connect(lambda: self.read_data(client_connection))
-        logging.info(f"New connection from {client_connection.peerAddress().toString()}")
+        # newConnection fires once for any number of queued connections
+        while self.server.hasPendingConnections():
+            client_connection = self.server.nextPendingConnection()
+            client_connection.setReadBufferSize(SOCKET_READ_BUFFER_SIZE)
+            self.active_connections += 1
+            self.connection_stats[client_connection] = PeerStats(
+                f"{client_connection.peerAddress().toString()}:{client_connection.peerPort()}", connected=True)
+            # A bound-method slot: PyQt does not keep lambda or partial slots
+            # alive, so those stop firing (or crash) once garbage collected
+            client_connection.readyRead.connect(self.handle_ready_read)
+            # Connect the disconnected signal to log once the client disconnects
+            client_connection.disconnected.connect(self.handle_disconnection)
+            client_connection.disconnected.connect(client_connection.deleteLater)
+            logger.info("New connection from %s", client_connection.peerAddress().toString())
+            # Data that arrived while the connection was pending won't signal readyRead again
+            if client_connection.bytesAvailable():
+                self.read_data(client_connection)
+
+    def handle_ready_read(self):
+        self.read_data(self.sender())
 
     def read_data(self, connection):
-        while connection.bytesAvailable():
+        if sip.isdeleted(connection):
+            return  # closed while a backpressure retry was pending
+        connection_stats = self.connection_stats.get(connection)
+        if connection_stats is None:
+            connection_stats = self.connection_stats[connection] = PeerStats(
+                connection.peerAddress().toString(), connected=True)
+        buffer = self.receive_buffers.get(connection)
+        if buffer is None:
+            buffer = self.receive_buffers[connection] = bytearray()
+        # Frames left waiting by a pause are handled first; otherwise the
+        # buffer only holds a partial frame that was already searched
+        searched = 0 if connection in self.paused_connections else max(0, len(buffer) - 1)
+        self.paused_connections.discard(connection)
+        received_at = time.time()
+        while True:
+            if buffer and not self.handle_frames(connection, buffer, searched, received_at, connection_stats):
+                self.paused_connections.add(connection)
+                self.pause_reading(connection)
+                return
+            if not connection.bytesAvailable():
+                return
+            if self.writer is not None and self.writer.is_full():
+                self.pause_reading(connection)
+                return
+
             data = connection.readAll()
+            received_at = time.time()
             # Ensure `data` is in bytes
             if isinstance(data, QByteArray):
                 data = data.data()  # Convert QByteArray to Python bytes
-                logging.info(f"Received data type: {type(data)}")
-            
-            message = self.process_mllp_message(data)
-            if message:
-                self.message_received.emit(message)
-                logging.info(f"HL7 message received: {message}")
+            self.bytes_received += len(data)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Read %d bytes from %s", len(data), connection.peerAddress().toString())
 
-                # Determine acknowledgment type based on message processing
-                ack_type, error_details = self.process_message_for_ack(message)
+            # A read can hold several frames, or only part of one
+            searched = max(0, len(buffer) - 1)
+            buffer += data
 
-                # Create the acknowledgment message
-                ack_message = self.create_ack_message(message, ack_type, error_details)
-                self.send_ack(connection, ack_message)
+    def pause_reading(self, connection):
+        # Backpressure: leave the data unread so TCP flow control slows the
+        # sender down, and try again shortly. Frames of any size are still
+        # put together; only handling them waits for the storage queue.
+        QTimer.singleShot(BACKPRESSURE_RETRY_MS, functools.partial(self.read_data, connection))
+
+    def handle_frames(self, connection, buffer, searched, received_at, connection_stats):
+        """
+        Handle every complete MLLP frame in `buffer` and remove it, leaving a
+        partial last frame for the next read.
+
+        :param searched: Offset up to which the buffer's partial frame is
+                         known not to contain an end block.
+        :return: False if it stopped early because the storage queue is full.
+        """
+        position = 0
+        while position < len(buffer):
+            start = buffer.find(START_BLOCK, position)
+            if start != position:
+                # Bytes outside any frame
+                junk_end = len(buffer) if start < 0 else start
+                self.log_sampled(logging.WARNING, "Invalid MLLP message framing")
+                connection_stats.record(junk_end - position, 0, True, received_at)
+                position = junk_end
+                continue
+            end = buffer.find(END_BLOCK + CARRIAGE_RETURN, max(start + 1, searched))
+            if end < 0:
+                break   # the rest of this frame has not arrived yet
+            if self.writer is not None and self.writer.is_full():
+                del buffer[:position]
+                return False
+            position = end + len(END_BLOCK + CARRIAGE_RETURN)
+            self.handle_frame(connection, bytes(buffer[start:position]), received_at, connection_stats)
+        del buffer[:position]
+        return True
+
+    def handle_frame(self, connection, frame, received_at, connection_stats):
+        started = time.perf_counter()
+        message = self.process_mllp_message(frame)
+        if not message:
+            connection_stats.record(len(frame), (time.perf_counter() - started) * 1e6, True, received_at)
+            return
+
+        key = duplicate_key(message)
+        # Messages without a control ID are rejected; they count under "(none)"
+        facility_stats = self.facility_stats_for(key[1] if key is not None else '')
+        if key is not None:
+            original_ack = self.duplicates.lookup(key)
+            if original_ack is not None:
+                self.log_sampled(logging.INFO, "Duplicate message %s from %s/%s, replaying original ACK",
+                                 key[2], key[0], key[1])
+                self.send_ack(connection, original_ack)
+                self.count_acked(len(frame), started, received_at, False, connection_stats, facility_stats)
+                return
+
+        # Determine acknowledgment type based on message processing
+        ack_type, error_details = self.process_message_for_ack(message)
+        self.log_message(message, ack_type)
+        self.messages_received += 1
+        self.ack_counts[ack_type] += 1
+
+        # Create the acknowledgment message
+        ack_message = self.create_ack_message(message, ack_type, error_details)
+        if self.writer is not None:
+            # Queued before the ACK goes out: with an intake queue, this is
+            # what makes the message durable
+            connection_stats.queued += 1
+            facility_stats.queued += 1
+            self.writer.put(MessageRecord(message, ack_message, received_at, time.time(),
+                                          ack_type, connection.peerAddress().toString(),
+                                          (connection_stats, facility_stats)))
+        self.send_ack(connection, ack_message)
+        self.count_acked(len(frame), started, received_at, ack_type != 'AA', connection_stats, facility_stats)
+        if key is not None and ack_message:
+            self.duplicates.remember(key, ack_message)
+
+    def count_acked(self, size, started, received_at, error, *sources):
+        # Processing time runs from reading the frame to writing its ACK
+        elapsed_us = (time.perf_counter() - started) * 1e6
+        self.ack_latency.record(elapsed_us)
+        for stats in sources:
+            stats.record(size, elapsed_us, error, received_at)
 
     def process_mllp_message(self, data):
         # Extract the message by removing MLLP framing
@@ -75,10 +304,10 @@ class HL7Server(QObject):
                 # Decode bytes
                 return hl7_message.decode('utf-8')
             except UnicodeDecodeError:
-                logging.error("Failed to decode HL7 message. Invalid encoding.")
+                self.log_sampled(logging.ERROR, "Failed to decode HL7 message. Invalid encoding.")
                 return None
         else:
-            logging.warning("Invalid MLLP message framing")
+            self.log_sampled(logging.WARNING, "Invalid MLLP message framing")
             return None    
 
     def process_message_for_ack(self, message):
@@ -92,19 +321,19 @@ class HL7Server(QObject):
             # Split the message into segments
             segments = message.strip().split('\r')
             if not segments:
-                logging.error("No segments found in the message.")
+                self.log_sampled(logging.ERROR, "No segments found in the message.")
                 return 'AR', {'code': '100', 'description': 'Message is empty or improperly formatted.'}    
 
             # Extract the MSH segment
             msh_segment = next((seg for seg in segments if seg.startswith("MSH")), None)
             if not msh_segment:
-                logging.error("MSH segment not found in the message.")
+                self.log_sampled(logging.ERROR, "MSH segment not found in the message.")
                 return 'AR', {'code': '101', 'description': 'MSH segment is missing.'}    
 
             # Split MSH segment into fields
             msh_fields = msh_segment.split('|')
             if len(msh_fields) < 12:
-                logging.error("MSH segment does not contain all required fields.")
+                self.log_sampled(logging.ERROR, "MSH segment does not contain all required fields.")
                 return 'AR', {'code': '102', 'description': 'MSH segment is incomplete.'}    
 
             # Extract necessary fields from MSH
@@ -154,7 +383,7 @@ class HL7Server(QObject):
                 return 'AA', None    
 
         except Exception as e:
-            logging.error(f"Exception during message validation: {e}")
+            self.log_sampled(logging.ERROR, "Exception during message validation: %s", e)
             return 'AR', {'code': '999', 'description': 'Unexpected error during message validation.'}    
     
 
@@ -172,12 +401,12 @@ class HL7Server(QObject):
             segments = message.strip().split('\r')
             msh_segment = next((seg for seg in segments if seg.startswith("MSH")), None)
             if msh_segment is None:
-                logging.error("MSH segment not found in the message")
+                self.log_sampled(logging.ERROR, "MSH segment not found in the message")
                 return None    
 
             msh_fields = msh_segment.split('|')
             if len(msh_fields) < 10:
-                logging.error("Invalid MSH segment structure")
+                self.log_sampled(logging.ERROR, "Invalid MSH segment structure")
                 return None    
 
             # Extract fields for ACK message
@@ -208,30 +437,28 @@ class HL7Server(QObject):
 
             return ack_message
         except Exception as e:
-            logging.error(f"Error generating acknowledgment message: {e}")
+            self.log_sampled(logging.ERROR, "Error generating acknowledgment message: %s", e)
             return None    
 
 
     def send_ack(self, connection, ack_message):
         if ack_message:
-            logging.info(f"ACK Message being sent: {ack_message}")  # Log the ACK message content
-            
             # Wrap ACK message in MLLP format
             ack = START_BLOCK + ack_message.encode('utf-8') + END_BLOCK + CARRIAGE_RETURN
             
             try:
                 # Check connection state
                 if connection.state() != QTcpSocket.ConnectedState:
-                    logging.error("Connection is not in connected state.")
+                    self.log_sampled(logging.ERROR, "Connection is not in connected state.")
                     return    
 
+                # flush() hands the ACK to the network without blocking the
+                # event loop, which serves every connection
                 connection.write(ack)
-                if connection.waitForBytesWritten(5000):
-                    logging.info(f"ACK written to network successfully: {ack_message}")
-                else:
-                    logging.error("Failed to written ACK message within timeout.")
-                connection.flush()
-                logging.info(f"ACK flushed successfully: {ack_message}")
+                written = connection.flush() or connection.bytesToWrite() == 0
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("ACK %s: %s", "written to network" if written else "queued for sending",
+                                 ack_message)
 
                 
                 # Wait until all the data is written to the network (timeout of 5000ms)
@@ -241,17 +468,47 @@ class HL7Server(QObject):
                 #     logging.error("Failed to send ACK message within timeout.")
             
             except Exception as e:
-                logging.error(f"Error sending ACK message: {e}")    
+                self.log_sampled(logging.ERROR, "Error sending ACK message: %s", e)    
 
-            # Connect the disconnected signal to log once the client disconnects
-            connection.disconnected.connect(self.handle_disconnection)    
-
-            # Request the client to disconnect
-            connection.disconnectFromHost()
+            if self.close_after_ack:
+                # Request the client to disconnect
+                connection.disconnectFromHost()
         else:
-            logging.error("No ACK message to send")
+            self.log_sampled(logging.ERROR, "No ACK message to send")
         
 
 
+    def log_message(self, message, ack_type):
+        # Message bodies can hold patient data, so only DEBUG logs them;
+        # INFO logs a sample of messages by size and digest
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("HL7 message received, ACK %s: %s", ack_type, message)
+        else:
+            self.log_sampled(logging.INFO, "HL7 message received: %d bytes, sha256 %s, ACK %s",
+                             len(message), BodyDigest(message), ack_type)
+
+    def log_sampled(self, level, msg, *args):
+        """
+        Log a per-message event, lazily formatted, if the sampler lets this
+        occurrence through. `msg` identifies the event.
+        """
+        if not logger.isEnabledFor(level):
+            return
+        skipped = self.log_sampler.allow(msg)
+        if skipped is None:
+            return
+        if skipped:
+            msg += " (%d more not logged)"
+            args += (skipped,)
+        logger.log(level, msg, *args)
+
     def handle_disconnection(self):
-        logging.info("Client disconnected successfully.")
+        self.active_connections -= 1
+        self.receive_buffers.pop(self.sender(), None)
+        self.paused_connections.discard(self.sender())
+        stats = self.connection_stats.pop(self.sender(), None)
+        if stats is not None:
+            stats.connected = False
+            stats.version += 1
+            self.closed_connection_stats.append(stats)
+        logger.info("Client disconnected successfully.")
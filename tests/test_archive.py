@@ -0,0 +1,134 @@
+import os
+import time
+
+from archive import (SegmentedArchive, recover_segment, read_index_checkpoint, INDEX_SUFFIX, ACTIVE_SUFFIX,
+                     SEALED_SUFFIX)
+from archive_reader import ArchiveReader
+from message_record import MessageRecord
+from record_format import SYMBOLS_FILE
+
+DAY = 24 * 60 * 60
+
+
+def make_record(number, received_at=None, message_type='ADT^A01'):
+    message = (f"MSH|^~\\&|LAB|FAC|HIS|HOSP|20240101||{message_type}|C{number}|P|2.5\r"
+               f"PID|1||{number}^^^MRN||Doe^John\r")
+    return MessageRecord(message, f"MSH|^~\\&|HIS|HOSP|LAB|FAC|20240101||ACK|A{number}|P|2.5\rMSA|AA|C{number}\r",
+                         received_at if received_at is not None else time.time(), ack_code='AA')
+
+
+def control_ids(records):
+    return [record.message.split('|')[9] for record in records]
+
+
+def read_all(directory):
+    reader = ArchiveReader(directory)
+    return reader, reader.read_range(reader.first_position(), reader.end_position())
+
+
+def raw_segments(directory):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(ACTIVE_SUFFIX))
+
+
+def write_without_closing(directory, count, checkpoint_after=None):
+    """Write records as a crashed run would leave them: flushed, but the archive never closed."""
+    archive = SegmentedArchive(str(directory), checkpoint_bytes=1 << 40, checkpoint_interval=1e9)
+    for number in range(count):
+        archive.add_messages([make_record(number)])
+        if checkpoint_after is not None and number + 1 == checkpoint_after:
+            archive.checkpoint()
+    return archive
+
+
+def test_torn_tail_is_truncated_on_reopen(tmp_path):
+    write_without_closing(tmp_path, 10)
+    path, = raw_segments(tmp_path)
+    with open(path, 'r+b') as file:
+        file.truncate(os.path.getsize(path) - 5)   # cut the last record short
+
+    archive = SegmentedArchive(str(tmp_path))
+    archive.close()
+
+    reader, records = read_all(str(tmp_path))
+    assert reader.count() == 9
+    assert control_ids(records) == [f"C{number}" for number in range(9)]
+    assert (reader.first_position(), reader.end_position()) == (0, 9)
+
+
+def test_recovery_trusts_the_checkpoint_and_scans_the_tail(tmp_path):
+    write_without_closing(tmp_path, 10, checkpoint_after=6)
+    path, = raw_segments(tmp_path)
+    size = os.path.getsize(path)
+    indexed_end, offsets = read_index_checkpoint(path, size)
+    assert len(offsets) == 6 and 0 < indexed_end < size
+
+    with open(path, 'ab') as file:
+        file.write(b'\x00garbage')   # a torn append after the last whole record
+
+    valid_end, offsets = recover_segment(path)
+    assert valid_end == size
+    assert len(offsets) == 10
+    assert os.path.getsize(path) == size
+    # The checkpoint now covers the recovered records, so the next open scans nothing
+    assert read_index_checkpoint(path, size) == (valid_end, offsets)
+
+
+def test_damaged_checkpoint_falls_back_to_a_full_scan(tmp_path):
+    write_without_closing(tmp_path, 5, checkpoint_after=5)
+    path, = raw_segments(tmp_path)
+    with open(path + INDEX_SUFFIX, 'wb') as file:
+        file.write(b'junk')
+
+    valid_end, offsets = recover_segment(path)
+    assert valid_end == os.path.getsize(path)
+    assert len(offsets) == 5
+
+
+def test_torn_symbol_line_is_repaired(tmp_path):
+    archive = SegmentedArchive(str(tmp_path))
+    archive.add_messages([make_record(0, message_type='ADT^A01')])
+    archive.close()
+    symbols_path = os.path.join(tmp_path, SYMBOLS_FILE)
+    with open(symbols_path, 'ab') as file:
+        file.write(b'ORU^R0')   # a symbol whose write was cut short
+
+    archive = SegmentedArchive(str(tmp_path))
+    archive.add_messages([make_record(1, message_type='ORM^O01')])
+    archive.close()
+
+    with open(symbols_path, 'rb') as file:
+        symbols = file.read()
+    assert symbols.endswith(b'\n')
+    assert b'ORU^R0' not in symbols
+    _, records = read_all(str(tmp_path))
+    assert [record.message.split('|')[8] for record in records] == ['ADT^A01', 'ORM^O01']
+
+
+def test_positions_survive_retention(tmp_path):
+    now = time.time()
+    archive = SegmentedArchive(str(tmp_path), max_segment_bytes=2000)
+    for number in range(60):
+        # The first 30 records are old enough to expire below
+        received_at = now - 10 * DAY if number < 30 else now
+        archive.add_messages([make_record(number, received_at)])
+        if number == 29:
+            archive.roll()
+    archive.close()
+
+    reader = ArchiveReader(str(tmp_path))
+    assert reader.end_position() == 60
+    before = control_ids(reader.read_range(40, 50))
+
+    # Reopening seals the raw segment left by close and applies retention
+    archive = SegmentedArchive(str(tmp_path), retention=5 * DAY)
+    archive.close()
+    assert not raw_segments(tmp_path)
+    assert any(name.endswith(SEALED_SUFFIX) for name in os.listdir(tmp_path))
+
+    reader.refresh()
+    assert reader.first_position() == 30
+    assert reader.end_position() == 60
+    assert reader.count() == 30
+    assert control_ids(reader.read_range(40, 50)) == before == [f"C{number}" for number in range(40, 50)]
+    records, start = reader.page_before(35, 20)
+    assert start == 30 and control_ids(records) == [f"C{number}" for number in range(30, 35)]
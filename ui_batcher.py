@@ -0,0 +1,56 @@
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+# Upper bound on how often batched updates reach the GUI
+DEFAULT_MAX_UI_RATE = 15  # updates per second
+
+
+class UpdateCoalescer(QObject):
+    """
+    Buffers items that arrive at any rate and hands them to the GUI in
+    batches, at most `max_rate` times per second. GUI work then depends on
+    the refresh rate rather than on the message rate.
+
+    The timer only runs while items are arriving, so an idle coalescer
+    costs nothing.
+    """
+
+    batch_ready = pyqtSignal(list)
+
+    def __init__(self, max_rate=DEFAULT_MAX_UI_RATE, parent=None):
+        super().__init__(parent)
+        self.pending = []
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.flush)
+        self.set_max_rate(max_rate)
+
+        # Metrics
+        self.items = 0
+        self.batches = 0
+
+    def set_max_rate(self, max_rate):
+        """
+        Change the maximum number of batches per second.
+
+        :param max_rate: Updates per second; values above 1000 are treated as 1000.
+        """
+        if max_rate <= 0:
+            raise ValueError(f"Invalid UI update rate: {max_rate}")
+        self.timer.setInterval(max(1, int(1000 / max_rate)))
+
+    def push(self, item):
+        """Queue an item for the next batch."""
+        self.pending.append(item)
+        self.items += 1
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def flush(self):
+        """Emit everything queued since the last batch."""
+        if not self.pending:
+            # Nothing arrived during the last interval; stop until the next push
+            self.timer.stop()
+            return
+        batch = self.pending
+        self.pending = []
+        self.batches += 1
+        self.batch_ready.emit(batch)
@@ -0,0 +1,214 @@
+import logging
+import math
+import queue
+import struct
+import threading
+import time
+from message_record import MessageRecord
+
+# Default flush policy: a batch is written as soon as any limit is reached
+DEFAULT_MAX_QUEUE = 10000
+DEFAULT_BATCH_COUNT = 500
+DEFAULT_BATCH_BYTES = 1024 * 1024
+DEFAULT_FLUSH_INTERVAL_MS = 200
+
+# Consumer name of the writer's cursor in the intake queue
+INTAKE_CONSUMER = 'writer'
+# Intake record: received_at, acked_at, then the lengths of ack_code, peer,
+# message and acknowledgment (NO_TEXT for None) followed by their UTF-8
+INTAKE_HEADER = struct.Struct('<dd4I')
+NO_TEXT = 0xFFFFFFFF
+
+_STOP = object()
+
+
+class WriteBehindWriter(threading.Thread):
+    """
+    Background thread that drains a bounded queue of received messages and
+    writes them to one or more sinks in batches.
+
+    A sink is any object with an ``add_messages(records)`` method, such as
+    ``MessageStore``. Records are ``MessageRecord`` objects.
+
+    With an ``intake`` DurableQueue, ``put`` appends the record to it and
+    only an IntakeToken goes on the memory queue; the thread reads the
+    records back through its consumer cursor and commits the cursor once
+    each batch has been handed to the sinks. Records accepted before a
+    crash but not yet written are written when the writer next starts
+    (a batch written just before the crash may be written twice).
+    """
+
+    def __init__(self, sinks, max_queue=DEFAULT_MAX_QUEUE, batch_count=DEFAULT_BATCH_COUNT,
+                 batch_bytes=DEFAULT_BATCH_BYTES, flush_interval_ms=DEFAULT_FLUSH_INTERVAL_MS,
+                 on_flush=None, on_batch_done=None, intake=None):
+        super().__init__(name="WriteBehindWriter", daemon=True)
+        self.sinks = list(sinks)
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.intake = intake
+        self.consumer = intake.consumer(INTAKE_CONSUMER) if intake is not None else None
+        # Records left by an earlier run end here; later ones have tokens
+        self.backlog_end = intake.end if intake is not None else 0
+        self.batch_count = batch_count
+        self.batch_bytes = batch_bytes
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.on_flush = on_flush
+        # Called on this thread with every batch, written or not
+        self.on_batch_done = on_batch_done
+
+        # Metrics
+        self.enqueued = 0
+        self.flushed_messages = 0
+        self.flushed_batches = 0
+        self.failed_batches = 0
+        self.last_flush_latency_ms = 0.0
+        self.max_flush_latency_ms = 0.0
+
+    def put(self, record):
+        """
+        Queue a record for writing. Blocks while the queue is full, so callers
+        should check ``is_full()`` first if they can defer work instead.
+        """
+        if self.intake is not None:
+            self.intake.enqueue(pack_record(record))
+            record = IntakeToken(record.size(), record.stats)
+        self.queue.put(record)
+        self.enqueued += 1
+
+    def is_full(self):
+        return self.queue.full()
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def metrics(self):
+        return {
+            'queue_depth': self.queue_depth(),
+            'queue_capacity': self.queue.maxsize,
+            'enqueued': self.enqueued,
+            'flushed_messages': self.flushed_messages,
+            'flushed_batches': self.flushed_batches,
+            'failed_batches': self.failed_batches,
+            'last_flush_latency_ms': self.last_flush_latency_ms,
+            'max_flush_latency_ms': self.max_flush_latency_ms,
+        }
+
+    def stop(self, timeout=None):
+        """Write everything still queued, then stop the thread."""
+        if self.is_alive():
+            self.queue.put(_STOP)
+            self.join(timeout)
+
+    def run(self):
+        if self.consumer is not None:
+            self.write_backlog()
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            batch_size = item.size()
+            deadline = time.monotonic() + self.flush_interval
+
+            # Keep collecting until the batch is full by count or bytes, or
+            # the oldest record in it has waited flush_interval
+            while len(batch) < self.batch_count and batch_size < self.batch_bytes:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                batch_size += item.size()
+
+            self.flush_batch(batch)
+
+    def write_backlog(self):
+        while True:
+            records = self.read_intake(self.batch_count, self.backlog_end)
+            if not records:
+                return
+            logging.info("Writing %d messages left in the intake queue", len(records))
+            self.flush_batch(records)
+
+    def read_intake(self, count, end=None):
+        return [unpack_record(payload) for _, payload in self.consumer.poll(count, end)]
+
+    def flush_batch(self, batch):
+        if self.consumer is not None and batch and isinstance(batch[0], IntakeToken):
+            records = self.read_intake(len(batch))
+            for record, token in zip(records, batch):
+                record.stats = token.stats
+            batch = records
+        try:
+            self.write_batch(batch)
+        finally:
+            if self.consumer is not None:
+                # Failed batches are dropped, as without an intake queue
+                self.consumer.commit()
+            if self.on_batch_done is not None:
+                self.on_batch_done(batch)
+
+    def write_batch(self, batch):
+        start = time.perf_counter()
+        try:
+            for sink in self.sinks:
+                sink.add_messages(batch)
+        except Exception as e:
+            self.failed_batches += 1
+            logging.error("Failed to write batch of %d messages: %s", len(batch), e)
+            return
+
+        latency_ms = (time.perf_counter() - start) * 1000.0
+        self.last_flush_latency_ms = latency_ms
+        self.max_flush_latency_ms = max(self.max_flush_latency_ms, latency_ms)
+        self.flushed_batches += 1
+        self.flushed_messages += len(batch)
+
+        if self.on_flush is not None:
+            self.on_flush(len(batch))
+
+
+class IntakeToken:
+    """Stands for a record in the memory queue while the record waits in the intake queue."""
+
+    __slots__ = ('bytes', 'stats')
+
+    def __init__(self, size, stats):
+        self.bytes = size
+        self.stats = stats
+
+    def size(self):
+        return self.bytes
+
+
+def pack_record(record):
+    """Serialize a MessageRecord for the intake queue; its stats are not kept."""
+    texts = [None if text is None else text.encode('utf-8')
+             for text in (record.ack_code, record.peer, record.message, record.acknowledgment)]
+    acked_at = math.nan if record.acked_at is None else record.acked_at
+    header = INTAKE_HEADER.pack(record.received_at, acked_at,
+                                *(NO_TEXT if text is None else len(text) for text in texts))
+    return header + b''.join(text for text in texts if text is not None)
+
+
+def unpack_record(payload):
+    """Inverse of pack_record."""
+    received_at, acked_at, *lengths = INTAKE_HEADER.unpack_from(payload)
+    texts = []
+    offset = INTAKE_HEADER.size
+    for length in lengths:
+        if length == NO_TEXT:
+            texts.append(None)
+            continue
+        texts.append(bytes(payload[offset:offset + length]).decode('utf-8'))
+        offset += length
+    ack_code, peer, message, acknowledgment = texts
+    return MessageRecord(message, acknowledgment, received_at, None if math.isnan(acked_at) else acked_at,
+                         ack_code, peer)